@@ -0,0 +1,552 @@
+"""
+Reproducible benchmarks for the capture, transfer and panorama paths
+
+Runs without a camera or network: frames are synthetic or loaded from the
+panorama/data fixtures, transfers go over loopback and the panorama
+benchmark uses panorama/video.mp4. Results are written as JSON together with
+the git commit and library versions so runs can be compared across commits.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --quick --only process_frame transfer
+    python benchmarks/run_benchmarks.py --compare bench_results_old.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(REPO_ROOT, "final product", "server")
+CLIENT_DIR = os.path.join(REPO_ROOT, "final product", "client")
+COMMON_DIR = os.path.join(REPO_ROOT, "final product", "common")
+FIXTURE_VIDEO = os.path.join(REPO_ROOT, "panorama", "video.mp4")
+FIXTURE_FRAMES = os.path.join(REPO_ROOT, "panorama", "data", "frame*.jpg")
+
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, CLIENT_DIR)
+sys.path.insert(0, COMMON_DIR)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress output of the code under test"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def load_fixture_frames(limit=None):
+    """Load the panorama/data frames, falling back to synthetic frames"""
+    paths = sorted(glob.glob(FIXTURE_FRAMES),
+                   key=lambda p: int(''.join(filter(str.isdigit, os.path.basename(p))) or 0))
+    frames = [cv2.imread(path) for path in paths[:limit]]
+    frames = [frame for frame in frames if frame is not None]
+    return frames or [synthetic_frame((1280, 720), seed) for seed in range(limit or 8)]
+
+
+def synthetic_frame(size, seed=0):
+    """Textured frame of the given (width, height), deterministic for a seed"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    small = (rng.random((max(height // 8, 1), max(width // 8, 1), 3)) * 255).astype(np.uint8)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_process_frame(quick=False):
+    """VideoProcessor.process_frame throughput across resolutions and qualities"""
+    import sever3
+
+    resolutions = [(320, 240), (640, 480)] if quick else [(320, 240), (640, 480), (1280, 720)]
+    qualities = [50] if quick else [30, 50, 80, 95]
+    frame_count = 30 if quick else 150
+    source_frames = load_fixture_frames(limit=16)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, working_directory(tmp), quiet():
+        for resolution in resolutions:
+            for quality in qualities:
+                processor = sever3.VideoProcessor(resolution=resolution)
+                processor.compression_quality = quality
+                # Warm up encoder and allocator
+                for frame in source_frames[:3]:
+                    processor.process_frame(frame)
+                started = time.perf_counter()
+                for i in range(frame_count):
+                    processor.process_frame(source_frames[i % len(source_frames)])
+                elapsed = time.perf_counter() - started
+                results.append({
+                    'resolution': list(resolution),
+                    'quality': quality,
+                    'frames': frame_count,
+                    'seconds': elapsed,
+                    'fps': frame_count / elapsed,
+                })
+    return results
+
+
+def static_scene(count, size=(640, 480), seed=0):
+    """Mostly static aerial-like footage: fixed background, one small moving object, sensor noise"""
+    width, height = size
+    background = cv2.resize(load_fixture_frames(limit=1)[0], size)
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        frame = background.copy()
+        x = int((i * 4) % (width - 40))
+        cv2.rectangle(frame, (x, height // 2), (x + 40, height // 2 + 24), (40, 40, 200), -1)
+        noise = rng.normal(0, 2, frame.shape)
+        yield np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def bench_motion_gating(quick=False):
+    """Encoded and recorded bytes for mostly static footage, with and without motion gating"""
+    import sever3
+
+    frame_count = 60 if quick else 300
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, working_directory(tmp), quiet():
+        for gating in (False, True):
+            processor = sever3.VideoProcessor()
+            processor.motion_gating = gating
+            output = processor.start_recording()
+            encoded_before = sever3.ENCODED_BYTES.labels().value
+            elapsed = 0.0
+            for frame in static_scene(frame_count):
+                started = time.perf_counter()
+                processor.process_frame(frame)
+                elapsed += time.perf_counter() - started
+            processor.output_file.release()
+            processor.output_file = None
+            processor.is_recording = False
+            results.append({
+                'motion_gating': gating,
+                'frames': frame_count,
+                'seconds': elapsed,
+                'fps': frame_count / elapsed,
+                'encoded_mb': (sever3.ENCODED_BYTES.labels().value - encoded_before) / (1 << 20),
+                'recorded_mb': os.path.getsize(output) / (1 << 20),
+            })
+            os.remove(output)
+            # Recordings are named by the second
+            time.sleep(1.0)
+    return results
+
+
+def _serve_file(listener, file_path, done):
+    import sever3
+    from framing import FramedConnection
+    sock, addr = listener.accept()
+    conn = FramedConnection(sock)
+    try:
+        with quiet():
+            sever3.send_file(conn, file_path, f"{addr[0]}:{addr[1]}")
+    finally:
+        done.wait(30)
+        conn.close()
+
+
+def bench_transfer(quick=False):
+    """send_file -> receive_file throughput over loopback TCP"""
+    from client2 import VideoClientPanorama
+
+    sizes_mb = [1, 8] if quick else [1, 16, 64]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        with quiet():
+            client = VideoClientPanorama(save_directory=os.path.join(tmp, "downloads"),
+                                         data_directory=os.path.join(tmp, "data"))
+        for size_mb in sizes_mb:
+            source = os.path.join(tmp, f"payload_{size_mb}mb.bin")
+            with open(source, 'wb') as f:
+                f.write(np.random.default_rng(size_mb).integers(0, 256, size_mb << 20, dtype=np.uint8).tobytes())
+
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            done = threading.Event()
+            sender = threading.Thread(target=_serve_file, args=(listener, source, done), daemon=True)
+            sender.start()
+
+            sock = socket.create_connection(listener.getsockname())
+            started = time.perf_counter()
+            with quiet():
+                received = client.receive_file(sock)
+            elapsed = time.perf_counter() - started
+            done.set()
+            sock.close()
+            sender.join()
+            listener.close()
+
+            ok = received is not None and os.path.getsize(received) == size_mb << 20
+            results.append({
+                'size_mb': size_mb,
+                'seconds': elapsed,
+                'mb_per_s': size_mb / elapsed if elapsed > 0 else None,
+                'ok': ok,
+            })
+    return results
+
+
+def bench_offload(quick=False):
+    """Aggregate process_frame fps of several sources, in-process threads vs the process pool"""
+    import sever3
+    from offload import OffloadPool
+
+    frames = [synthetic_frame((1280, 720), seed) for seed in range(4)]
+    frame_count = 30 if quick else 150
+    source_counts = [1, 2] if quick else sorted({1, 2, os.cpu_count() or 1})
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, working_directory(tmp), quiet():
+        for workers in (0, os.cpu_count() or 1):
+            pool = OffloadPool(workers) if workers else None
+            if pool is not None:
+                pool.warm_up()
+            for sources in source_counts:
+                processors = [sever3.VideoProcessor(pool=pool) for _ in range(sources)]
+
+                def run(processor):
+                    for i in range(frame_count):
+                        processor.process_frame(frames[i % len(frames)])
+
+                threads = [threading.Thread(target=run, args=(processor,)) for processor in processors]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+                for processor in processors:
+                    processor.close()
+                results.append({
+                    'workers': workers,
+                    'sources': sources,
+                    'frames': frame_count * sources,
+                    'seconds': elapsed,
+                    'fps': frame_count * sources / elapsed,
+                })
+            if pool is not None:
+                pool.shutdown()
+    return results
+
+
+def _write_clip(path, frames, fps=30.0):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'XVID'), fps, (640, 480))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+
+def bench_zip(quick=False):
+    """zip_recordings time versus archive size"""
+    import sever3
+
+    clip_counts = [1, 4] if quick else [1, 4, 16]
+    frames = [cv2.resize(frame, (640, 480)) for frame in load_fixture_frames(limit=45)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, working_directory(tmp):
+        os.makedirs("recordings")
+        clip = os.path.join("recordings", "video_0.avi")
+        _write_clip(clip, frames * (2 if quick else 4))
+
+        for count in clip_counts:
+            for i in range(1, count):
+                target = os.path.join("recordings", f"video_{i}.avi")
+                if not os.path.exists(target):
+                    shutil.copyfile(clip, target)
+            input_bytes = sum(os.path.getsize(p) for p in glob.glob("recordings/*.avi"))
+
+            started = time.perf_counter()
+            with quiet():
+                zip_path = sever3.zip_recordings()
+            elapsed = time.perf_counter() - started
+
+            archive_bytes = os.path.getsize(zip_path) if zip_path else 0
+            results.append({
+                'clips': count,
+                'input_mb': input_bytes / (1 << 20),
+                'archive_mb': archive_bytes / (1 << 20),
+                'ratio': archive_bytes / input_bytes if input_bytes else None,
+                'seconds': elapsed,
+                'mb_per_s': input_bytes / (1 << 20) / elapsed if elapsed > 0 else None,
+            })
+            if zip_path:
+                os.remove(zip_path)
+            # zip_recordings names archives by the second
+            time.sleep(1.0)
+    return results
+
+
+def _panorama_worker(video_path, skip_frames, output):
+    """Run one panorama build in a fresh process so peak RSS is per run"""
+    from client2 import VideoClientPanorama
+
+    with tempfile.TemporaryDirectory() as tmp, quiet():
+        client = VideoClientPanorama(save_directory=tmp, data_directory=tmp)
+        report = client.build_panorama(video_path, skip_frames=skip_frames, save_frames=False)
+    output.put({
+        'skip_frames': skip_frames,
+        'status': report['status'],
+        'frames_extracted': report['frames_extracted'],
+        'extract_seconds': report['extract_seconds'],
+        'stitch_seconds': report['stitch_seconds'],
+        'seconds': report['seconds'],
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def bench_panorama(quick=False, skip_frames=None):
+    """create_panorama_from_video time and peak memory versus skip_frames"""
+    skip_values = skip_frames or ([20] if quick else [5, 10, 20])
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for skip in skip_values:
+        output = context.Queue()
+        worker = context.Process(target=_panorama_worker, args=(FIXTURE_VIDEO, skip, output))
+        worker.start()
+        result = output.get()
+        worker.join()
+        results.append(result)
+    return results
+
+
+SHARPNESS_WIDTH = 800  # Panoramas are compared at one width; Laplacian variance depends on scale
+
+
+def _sharpness(panorama):
+    """Variance of the Laplacian over the covered part of a panorama (higher is sharper)"""
+    scale = SHARPNESS_WIDTH / panorama.shape[1]
+    gray = cv2.cvtColor(cv2.resize(panorama, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_BGR2GRAY)
+    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+    covered = cv2.erode((gray > 0).astype(np.uint8), np.ones((5, 5), np.uint8)) > 0
+    return float(laplacian[covered].var()) if covered.any() else 0.0
+
+
+def bench_stitching(quick=False):
+    """cv2.Stitcher SCANS versus the StitchingEngine presets on panorama/video.mp4 frames"""
+    from panorama_pipeline import open_video, read_frames, select_frames
+    from stitching import PRESETS, StitchingEngine
+
+    skip = 20 if quick else 10
+    capture, _ = open_video(FIXTURE_VIDEO)
+    frames = list(select_frames(read_frames(capture), skip))
+
+    candidates = [('stitcher_scans', None)] + [(name, name) for name in PRESETS]
+    results = []
+    for name, preset in candidates:
+        engine = StitchingEngine.load(preset) if preset else cv2.Stitcher_create(cv2.Stitcher_SCANS)
+        started = time.perf_counter()
+        status, panorama = engine.stitch(frames)
+        elapsed = time.perf_counter() - started
+        ok = status == cv2.Stitcher_OK
+        results.append({
+            'engine': name,
+            'frames': len(frames),
+            'frames_used': engine.frames_used if preset else None,
+            'ok': ok,
+            'seconds': elapsed,
+            'stages': dict(engine.timings) if preset else None,
+            'panorama_mp': panorama.shape[0] * panorama.shape[1] / 1e6 if ok else None,
+            'sharpness': _sharpness(panorama) if ok else None,
+        })
+    return results
+
+
+SECURE_CLIENTS = 10
+SECURE_DROPOUTS = 1
+
+
+def bench_secure_aggregation(quick=False):
+    """Secure aggregation cost per role versus model size, with and without DP clipping and noise"""
+    from secure_aggregation import (SecureAggregationClient, SecureAggregationServer, client_noise_std,
+                                    clip_update)
+
+    sizes = [10_000, 100_000, 1_000_000] + ([] if quick else [10_000_000])
+    ids = list(range(1, SECURE_CLIENTS + 1))
+    dropouts = set(ids[-SECURE_DROPOUTS:])
+    results = []
+    for dimension in sizes:
+        for dp in (False, True):
+            clip, noise_multiplier = (1.0, 1.0) if dp else (None, 0.0)
+            noise_std = client_noise_std(clip, noise_multiplier, len(ids)) if dp else 0.0
+
+            started = time.perf_counter()
+            clients = {u: SecureAggregationClient(u, dimension, clip, noise_std) for u in ids}
+            server = SecureAggregationServer(dimension)
+            plan = server.advertise({u: client.public_key for u, client in clients.items()})
+            for u, (keys, threshold) in plan.items():
+                for v, share in clients[u].share_keys(keys, threshold).items():
+                    clients[v].receive_share(u, share)
+            keys_seconds = time.perf_counter() - started
+
+            # Updates are made one client at a time so 10M-parameter runs fit in memory
+            plain = np.zeros(dimension)
+            mask_seconds = 0.0
+            for u in ids:
+                if u in dropouts:
+                    continue
+                update = np.random.default_rng(u).normal(0.0, 0.01, dimension)
+                plain += clip_update(update, clip) if dp else update
+                started = time.perf_counter()
+                masked = clients[u].masked_update(update)
+                mask_seconds += time.perf_counter() - started
+                server.receive(u, masked)
+                del update, masked
+
+            started = time.perf_counter()
+            dropped = server.dropped()
+            answers = {u: clients[u].unmask_shares(server.survivors, dropped) for u in server.survivors}
+            total = server.unmask(answers)
+            unmask_seconds = time.perf_counter() - started
+
+            participants = len(server.survivors)
+            results.append({
+                'parameters': dimension,
+                'clients': len(ids),
+                'dropouts': len(dropped),
+                'neighbours': len(plan[ids[0]][0]),
+                'dp': dp,
+                'keys_seconds': keys_seconds,
+                'mask_seconds_per_client': mask_seconds / participants,
+                'unmask_seconds': unmask_seconds,
+                'seconds': keys_seconds + mask_seconds + unmask_seconds,
+                'ns_per_parameter': mask_seconds / participants / dimension * 1e9,
+                # Fixed-point rounding without DP; the added noise with it
+                'max_error': float(np.abs(total - plain).max()),
+            })
+            del plain, total
+    return results
+
+
+BENCHMARKS = {
+    'process_frame': bench_process_frame,
+    'motion_gating': bench_motion_gating,
+    'offload': bench_offload,
+    'transfer': bench_transfer,
+    'zip': bench_zip,
+    'panorama': bench_panorama,
+    'stitching': bench_stitching,
+    'secure_aggregation': bench_secure_aggregation,
+}
+
+
+def environment_info():
+    """Commit and library versions recorded with every run"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+# Metric compared by --compare for each benchmark, and whether higher is better
+COMPARE_KEYS = {
+    'process_frame': ('fps', True),
+    'motion_gating': ('recorded_mb', False),
+    'offload': ('fps', True),
+    'transfer': ('mb_per_s', True),
+    'zip': ('seconds', False),
+    'panorama': ('seconds', False),
+    'stitching': ('seconds', False),
+    'secure_aggregation': ('seconds', False),
+}
+
+
+def compare_results(baseline, current):
+    """Print the change of the headline metric for every matching result row"""
+    for name, (key, higher_is_better) in COMPARE_KEYS.items():
+        old_rows = baseline.get('results', {}).get(name)
+        new_rows = current.get('results', {}).get(name)
+        if not old_rows or not new_rows:
+            continue
+        print(f"\n{name} ({key}, {'higher' if higher_is_better else 'lower'} is better)")
+        for old, new in zip(old_rows, new_rows):
+            label = {k: v for k, v in new.items() if k not in (key, 'seconds', 'fps', 'mb_per_s', 'peak_rss_mb',
+                                                               'extract_seconds', 'stitch_seconds', 'ok', 'status',
+                                                               'encoded_mb', 'recorded_mb', 'stages',
+                                                               'frames_used', 'panorama_mp', 'sharpness',
+                                                               'keys_seconds', 'mask_seconds_per_client',
+                                                               'unmask_seconds', 'ns_per_parameter', 'max_error')}
+            if not old.get(key) or new.get(key) is None:
+                continue
+            change = (new[key] - old[key]) / old[key] * 100
+            print(f"  {label}: {old[key]:.4g} -> {new[key]:.4g} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the capture, transfer and panorama benchmarks")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="smaller inputs for a fast smoke run")
+    parser.add_argument('--skip-frames', type=int, nargs='+', help="skip_frames values for the panorama benchmark")
+    parser.add_argument('--output', default='bench_results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="baseline JSON to compare the new results against")
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment_info(), 'quick': args.quick, 'results': {}}
+    for name in args.only or list(BENCHMARKS):
+        print(f"Running {name}...")
+        started = time.perf_counter()
+        if name == 'panorama':
+            report['results'][name] = bench_panorama(args.quick, args.skip_frames)
+        else:
+            report['results'][name] = BENCHMARKS[name](args.quick)
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Headless batch panorama builder
+
+Runs the client's panorama pipeline over many videos or zip archives on a
+process pool, without playing anything or opening OpenCV windows, and writes
+a JSON report with timing, frame counts and stitch status for every video.
+
+Usage:
+    python batch_panorama.py video1.avi recordings_20240101.zip ... \\
+        --workers 4 --report batch_report.json
+
+Use "--report -" to print the report to stdout; progress messages from the
+workers always go to stderr so stdout stays machine-readable.
+
+Panoramas are cached by video content in <data-dir>/cache, so re-running a
+batch over the same clips only stitches the new ones.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from client2 import VideoClientPanorama, CACHE_SIZE_MB, CACHE_DIRECTORY
+from stitching import PRESETS
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv']
+
+
+def _unique(name, used):
+    """name, or name_2, name_3, ... if it is already in used (which it is then added to)"""
+    candidate, number = name, 1
+    while candidate in used:
+        number += 1
+        candidate = f"{name}_{number}"
+    used.add(candidate)
+    return candidate
+
+
+def output_folders(videos):
+    """
+    {video: folder name} with one distinct folder per video
+
+    Folders are named after the video, numbered when several videos share
+    a name (flight.mp4 from two directories, video_0.avi from two zips),
+    so their panoramas never overwrite each other.
+    """
+    used = set()
+    return {video: _unique(Path(video).stem, used) for video in videos}
+
+
+def collect_videos(inputs, save_directory="downloads"):
+    """Expand the given files, directories and zip archives into a list of videos (each listed once)"""
+    with contextlib.redirect_stdout(sys.stderr):
+        client = VideoClientPanorama(save_directory=save_directory, data_directory=save_directory, cache_size=0)
+    videos = []
+    archives = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for file in sorted(files):
+                    if any(file.lower().endswith(ext) for ext in VIDEO_EXTENSIONS):
+                        videos.append(os.path.join(root, file))
+        elif path.lower().endswith('.zip'):
+            # Each archive gets its own folder so clips with the same name don't clash
+            extract_path = os.path.join(save_directory, "extracted", _unique(Path(path).stem, archives))
+            with contextlib.redirect_stdout(sys.stderr):
+                videos.extend(client.extract_zip(path, extract_path))
+        else:
+            videos.append(path)
+    # The same file given twice (directly and through its directory, say) is built once
+    unique, seen = [], set()
+    for video in videos:
+        if os.path.abspath(video) not in seen:
+            seen.add(os.path.abspath(video))
+            unique.append(video)
+    return unique
+
+
+def _batch_job(video_path, data_directory, folder, skip_frames, resize_dims, save_frames, preset, tiles, cache_size):
+    """Build one panorama in a pool worker, logging to stderr"""
+    with contextlib.redirect_stdout(sys.stderr):
+        # Each video gets its own data folder so debug frames from parallel jobs don't mix;
+        # the cache is shared by all of them
+        output_directory = os.path.join(data_directory, folder)
+        client = VideoClientPanorama(save_directory=output_directory, data_directory=output_directory, tiles=tiles,
+                                     cache_size=cache_size,
+                                     cache_directory=os.path.join(data_directory, CACHE_DIRECTORY))
+        return client.build_panorama(video_path, skip_frames, resize_dims, save_frames=save_frames, preset=preset)
+
+
+def run_batch(inputs, data_directory="data", workers=None, skip_frames=5,
+              resize_dims=(640, 360), save_frames=False, save_directory="downloads", preset=None, tiles=False,
+              cache_size=CACHE_SIZE_MB):
+    """
+    Build panoramas for every video in inputs on a process pool
+
+    Args:
+        inputs: Video files, directories or zip archives
+        data_directory: Where panoramas (one sub-folder per video) are written
+        workers: Number of worker processes (default one per CPU core)
+        skip_frames: Use every Nth frame for stitching
+        resize_dims: Frame size used for stitching
+        save_frames: Also write the extracted frames as JPEGs
+        save_directory: Where zip archives are extracted
+        preset: Stitching preset (fast, balanced, quality); None uses cv2.Stitcher
+        tiles: Write Deep Zoom tile pyramids instead of single JPEGs
+        cache_size: MB of the panorama cache in data_directory/cache (0 turns it off)
+
+    Returns:
+        Report dict with one entry per video plus batch totals
+    """
+    started = time.perf_counter()
+    videos = collect_videos(inputs, save_directory)
+    folders = output_folders(videos)
+    workers = max(1, workers or os.cpu_count() or 1)
+
+    results = {}
+    if videos:
+        with ProcessPoolExecutor(max_workers=min(workers, len(videos))) as pool:
+            futures = {
+                pool.submit(_batch_job, video, data_directory, folders[video], skip_frames, resize_dims, save_frames,
+                            preset, tiles, cache_size): video
+                for video in videos
+            }
+            for future in as_completed(futures):
+                video = futures[future]
+                try:
+                    results[video] = future.result()
+                except Exception as e:
+                    results[video] = {'video': video, 'panorama_path': None, 'status': 'failed', 'error': str(e)}
+
+    entries = [results[video] for video in videos]
+    succeeded = sum(1 for entry in entries if entry['status'] == 'ok')
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'workers': workers,
+        'skip_frames': skip_frames,
+        'resize_dims': list(resize_dims),
+        'preset': preset,
+        'videos': entries,
+        'total_videos': len(entries),
+        'succeeded': succeeded,
+        'failed': len(entries) - succeeded,
+        'cache_hits': sum(1 for entry in entries if entry.get('cached')),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build panoramas from videos or zip archives without a GUI")
+    parser.add_argument('inputs', nargs='+', help="video files, directories or zip archives")
+    parser.add_argument('--data-dir', default='data', help="output directory for panoramas (default: data)")
+    parser.add_argument('--save-dir', default='downloads', help="where zip archives are extracted (default: downloads)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU core)")
+    parser.add_argument('--skip-frames', type=int, default=5, help="use every Nth frame (default: 5)")
+    parser.add_argument('--width', type=int, default=640, help="stitching frame width (default: 640)")
+    parser.add_argument('--height', type=int, default=360, help="stitching frame height (default: 360)")
+    parser.add_argument('--save-frames', action='store_true', help="also write the extracted frames as JPEGs")
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        help="stitch with the configurable engine and this preset (default: cv2.Stitcher)")
+    parser.add_argument('--tiles', action='store_true', help="write Deep Zoom tile pyramids (.dzi) instead of JPEGs")
+    parser.add_argument('--cache-size', type=float, default=CACHE_SIZE_MB, metavar='MB',
+                        help=f"size of the panorama cache in <data-dir>/{CACHE_DIRECTORY} "
+                             f"(default: {CACHE_SIZE_MB}, 0 turns it off)")
+    parser.add_argument('--report', default='batch_report.json', help="report path, or - for stdout")
+    args = parser.parse_args(argv)
+
+    report = run_batch(args.inputs, data_directory=args.data_dir, workers=args.workers,
+                       skip_frames=args.skip_frames, resize_dims=(args.width, args.height),
+                       save_frames=args.save_frames, save_directory=args.save_dir, preset=args.preset,
+                       tiles=args.tiles, cache_size=args.cache_size)
+
+    if args.report == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.report}", file=sys.stderr)
+
+    print(f"🏁 {report['succeeded']}/{report['total_videos']} panorama(s) created "
+          f"in {report['seconds']:.1f}s ({report['cache_hits']} from cache)", file=sys.stderr)
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,324 @@
 import socket
 import os
-import struct
+import json
+import sys
 import time
-import zipfile
-import cv2
-import glob
+import queue
+import threading
+import argparse
 from pathlib import Path
 
+# Modules shared by the client, server and panorama scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from lazy import lazy_import, prewarm
+from video_player import VideoPlayerEngine
+from frame_store import FrameStore
+from metrics import (FRAMES_DROPPED, QUEUE_DEPTH, CLIENT_BYTES, STAGE_SECONDS,
+                     start_metrics_server, start_json_dump)
+from framing import (FramedConnection, decode_file_begin, FLAG_COMPRESSED, MSG_HELLO, MSG_PING, MSG_PONG,
+                     MSG_QUIT, MSG_FILE_BEGIN, MSG_FILE_CHUNK, MSG_FILE_END, MSG_FILE_ERROR,
+                     MSG_BROADCAST_BEGIN, MSG_BROADCAST_STATUS, MSG_FRAME, MSG_MODEL_UPDATE)
+from compression import client_hello, accept_hello, load_dictionary
+from fountain import FountainDecoder, open_multicast_receiver, PACKET_HEADER
+from tiles import TileCanvas
+from panorama_pipeline import panorama_from_video, stitch
+from tile_pyramid import save_image, serve_tiles, TILE_PORT
+from geo_mosaic import write_georeference
+from panorama_cache import PanoramaCache
+
+# Heavy modules load on first use, or in the background once connected (see prewarm_client)
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+zipfile = lazy_import('zipfile')
+futures = lazy_import('concurrent.futures')
+
+# Instrumentation: Prometheus text on http://127.0.0.1:METRICS_PORT/metrics
+METRICS_PORT = 9101
+METRICS_DUMP_PATH = "client_metrics.json"
+METRICS_DUMP_INTERVAL = 10.0
+
+PROGRESS_INTERVAL = 0.5  # Seconds between transfer progress lines
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+# Optional dictionary for control messages, trained with common/compression.py
+COMPRESSION_DICTIONARY = load_dictionary("control.dict")
+
+BROADCAST_REPORT_INTERVAL = 0.2  # Report decode progress after this long without packets
+BROADCAST_IDLE_TIMEOUT = 30.0    # Give up on a multicast transfer after this long without packets
+
+LIVE_WINDOW = "Live View"
+LIVE_POLL_INTERVAL = 0.03        # How often the main thread refreshes the live view
+LIVE_PANORAMA_EVERY = 30         # Keep every Nth live frame for the live panorama
+LIVE_PANORAMA_MAX_FRAMES = 100
+
+# Built panoramas are cached by video content hash in <data>/cache, up to this size
+CACHE_SIZE_MB = 1024
+CACHE_DIRECTORY = "cache"
+# Report fields kept with a cached panorama and restored on a hit
+CACHED_FIELDS = ('stitch_mode', 'stitch_status', 'total_frames', 'frames_read', 'frames_extracted', 'fps',
+                 'duration', 'extract_seconds', 'stitch_seconds', 'poses', 'georeference')
+
+
+def prewarm_client():
+    """Load OpenCV and warm up the stitcher and JPEG codec on a background thread"""
+    def stitcher():
+        if hasattr(cv2, 'Stitcher_create'):
+            cv2.Stitcher_create(cv2.Stitcher_SCANS)
+
+    def jpeg_codec():
+        _, jpeg = cv2.imencode('.jpg', np.zeros((64, 64, 3), dtype=np.uint8))
+        cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+
+    return prewarm('numpy', 'cv2', stitcher, jpeg_codec, 'zipfile', 'concurrent.futures', name="client-prewarm")
+
+
+def panorama_params(skip_frames=5, resize_dims=(640, 360), preset=None, tiles=False):
+    """Build parameters a cached panorama must have been made with"""
+    return {
+        'skip_frames': skip_frames,
+        'resize_dims': list(resize_dims) if resize_dims else None,
+        'preset': preset,
+        'tiles': tiles,
+    }
+
+
+def _panorama_job(video_path, save_directory, data_directory, skip_frames, tiles, cache_size=0, cache_key=None):
+    """Build one panorama inside a pool worker process; cache_key is a cache miss to fill"""
+    client = VideoClientPanorama(save_directory, data_directory, tiles=tiles, cache_size=cache_size)
+    return client.build_panorama(video_path, skip_frames=skip_frames, cache_key=cache_key)['panorama_path']
+
+
+class PanoramaJobQueue:
+    """
+    Job queue feeding panorama jobs to a process pool
+
+    Each worker thread takes a video from the queue and runs the stitching in
+    a separate process, so at most max_jobs panoramas are built at once and the
+    caller never blocks on OpenCV. Videos already in the panorama cache are
+    restored on the worker thread without starting a job.
+    """
+
+    def __init__(self, save_directory, data_directory, max_jobs=None, skip_frames=5, tiles=False, cache=None):
+        self.save_directory = save_directory
+        self.data_directory = data_directory
+        self.max_jobs = max(1, max_jobs or os.cpu_count() or 1)
+        self.skip_frames = skip_frames
+        self.tiles = tiles
+        self.cache = cache
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.workers = []
+        self.counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+        self.current = {}
+        self.results = []
+
+    def start(self):
+        """Start the process pool and the worker threads"""
+        if self.executor is not None:
+            return
+        self.executor = futures.ProcessPoolExecutor(max_workers=self.max_jobs)
+        for i in range(self.max_jobs):
+            worker = threading.Thread(target=self._worker, name=f"panorama-job-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        print(f"⚙️ Panorama pool started with {self.max_jobs} concurrent job(s)")
+
+    def submit(self, video_path):
+        """Queue a video for panorama creation"""
+        self.start()
+        with self.lock:
+            self.counts['queued'] += 1
+        self.jobs.put(video_path)
+        print(f"🗂️ Queued panorama job: {os.path.basename(video_path)}")
+
+    def _worker(self):
+        while True:
+            video_path = self.jobs.get()
+            if video_path is None:
+                self.jobs.task_done()
+                break
+
+            name = threading.current_thread().name
+            with self.lock:
+                self.counts['queued'] -= 1
+                self.counts['running'] += 1
+                self.current[name] = video_path
+
+            panorama_path = None
+            try:
+                cache_key, cache_size = None, 0
+                if self.cache is not None:
+                    cache_key = self.cache.key(video_path, panorama_params(self.skip_frames, tiles=self.tiles))
+                    cache_size = self.cache.max_bytes / 2**20
+                    entry = self.cache.get(cache_key, self.data_directory, name=Path(video_path).stem)
+                    if entry is not None:
+                        panorama_path = entry['paths'][0]
+                        print(f"♻️ Panorama for {os.path.basename(video_path)} found in cache")
+                if panorama_path is None:
+                    future = self.executor.submit(_panorama_job, video_path, self.save_directory,
+                                                  self.data_directory, self.skip_frames, self.tiles,
+                                                  cache_size, cache_key)
+                    panorama_path = future.result()
+            except Exception as e:
+                print(f"❌ Panorama job crashed for {os.path.basename(video_path)}: {e}")
+
+            with self.lock:
+                self.counts['running'] -= 1
+                self.current.pop(name, None)
+                if panorama_path:
+                    self.counts['completed'] += 1
+                    self.results.append(panorama_path)
+                else:
+                    self.counts['failed'] += 1
+
+            if panorama_path:
+                print(f"🎉 Successfully created panorama: {os.path.basename(panorama_path)}")
+            else:
+                print(f"❌ Failed to create panorama for: {os.path.basename(video_path)}")
+            self.jobs.task_done()
+
+    def get_status(self):
+        """Return a snapshot of the job counters"""
+        with self.lock:
+            status = dict(self.counts)
+            status['max_jobs'] = self.max_jobs
+            status['in_progress'] = [os.path.basename(path) for path in self.current.values()]
+            status['panoramas'] = list(self.results)
+        if self.cache is not None:
+            status['cache'] = self.cache.stats()
+        return status
+
+    def wait(self):
+        """Block until every queued job has finished"""
+        self.jobs.join()
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads and the process pool"""
+        if self.executor is None:
+            return
+        if wait:
+            self.wait()
+        for _ in self.workers:
+            self.jobs.put(None)
+        if wait:
+            for worker in self.workers:
+                worker.join()
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.executor = None
+        self.workers = []
+
+
+class IncomingFile:
+    """
+    A file being received, preallocated to its announced size
+
+    Chunks are read from the socket with recv_into into one reusable buffer
+    and written straight to the unbuffered output file, so there is no
+    per-chunk bytes object. (Writing through an mmap of the output was
+    measured slower on loopback: page faults cost more than the write copy.)
+    """
+
+    def __init__(self, path, size, buffer):
+        self.path = path
+        self.size = size
+        self.buffer = buffer
+        self.received = 0
+        self.started = time.time()
+        self.next_progress = self.started + PROGRESS_INTERVAL
+        self.file = open(path, 'wb', buffering=0)
+        if size:
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, size)
+            except (AttributeError, OSError):
+                pass  # Not available on this platform / filesystem
+
+    def receive_chunk(self, conn, length):
+        """Read a chunk payload from conn into the file; returns bytes stored"""
+        if self.received + length > self.size:
+            raise ValueError(f"server sent more than the announced {self.size} bytes")
+        remaining = length
+        while remaining:
+            view = self.buffer[:min(remaining, len(self.buffer))]
+            conn.read_payload_into(view)
+            self._write(view)
+            remaining -= len(view)
+        self.received += length
+        return length
+
+    def _write(self, data):
+        # An unbuffered write may store only part of the data; write the rest
+        view = memoryview(data).cast('B')
+        while view:
+            view = view[self.file.write(view):]
+
+    def write_chunk(self, data):
+        """Store an already decoded (decompressed) chunk"""
+        if self.received + len(data) > self.size:
+            raise ValueError(f"server sent more than the announced {self.size} bytes")
+        self._write(data)
+        self.received += len(data)
+        return len(data)
+
+    def progress_due(self, now):
+        if now < self.next_progress:
+            return False
+        self.next_progress = now + PROGRESS_INTERVAL
+        return True
+
+    def close(self):
+        """Close the file; an incomplete file is cut back to the bytes actually received"""
+        if not self.file.closed:
+            if self.received != self.size:
+                self.file.truncate(self.received)
+            self.file.close()
+
+
 class VideoClientPanorama:
-    def __init__(self, save_directory="downloads", data_directory="data"):
+    def __init__(self, save_directory="downloads", data_directory="data", max_jobs=None, tiles=False,
+                 cache_size=CACHE_SIZE_MB, cache_directory=None):
         self.save_directory = save_directory
         self.data_directory = data_directory
+        self.max_jobs = max_jobs
+        self.tiles = tiles  # Save panoramas as Deep Zoom tile pyramids instead of single JPEGs
+        # Panoramas by video content hash (cache_size in MB, 0 turns it off)
+        self.cache = None
+        if cache_size:
+            self.cache = PanoramaCache(cache_directory or os.path.join(data_directory, CACHE_DIRECTORY),
+                                       max_bytes=int(cache_size * 2**20))
+        self.job_queue = None
+        self.playback_queue = queue.Queue()
+        self.connected = False
+        self.server_address = None
+        self.files_received = 0
+        self.incoming = {}  # stream id -> file transfer in progress
+        self.receive_buffer = memoryview(bytearray(RECEIVE_BUFFER_SIZE))  # Reused for every chunk
+        self.live_canvas = TileCanvas()  # Rebuilt from the server's tiled live stream
+        self.live_frames = None          # Sampled live frames for a panorama
         self.create_directories()
+        QUEUE_DEPTH.labels("playback").set_function(self.playback_queue.qsize)
+
+    def get_job_queue(self):
+        """Return the panorama job queue, creating it on first use"""
+        if self.job_queue is None:
+            self.job_queue = PanoramaJobQueue(self.save_directory, self.data_directory, self.max_jobs,
+                                              tiles=self.tiles, cache=self.cache)
+            QUEUE_DEPTH.labels("panorama_jobs").set_function(self.job_queue.jobs.qsize)
+        return self.job_queue
+
+    def get_status(self):
+        """Return connection, playback and panorama job status"""
+        status = {
+            'connected': self.connected,
+            'server': self.server_address,
+            'files_received': self.files_received,
+            'videos_waiting_playback': self.playback_queue.qsize(),
+        }
+        if self.job_queue is not None:
+            status['jobs'] = self.job_queue.get_status()
+        elif self.cache is not None:
+            status['cache'] = self.cache.stats()
+        return status
     
     def create_directories(self):
         """Create necessary directories"""
@@ -42,19 +349,19 @@ class VideoClientPanorama:
         print(f"🎬 Playing video: {os.path.basename(video_path)}")
         print("Controls: SPACE=Pause/Resume, ESC/Q=Quit, R=Restart, Arrow Keys=Skip")
         
-        cap = cv2.VideoCapture(video_path)
+        engine = VideoPlayerEngine(video_path)
         
-        if not cap.isOpened():
+        if not engine.open():
             print(f"❌ Cannot open video file: {video_path}")
             return False
         
         # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = engine.fps
+        total_frames = max(engine.total_frames, 1)
         duration = total_frames / fps if fps > 0 else 0
-        frame_delay = int(1000 / fps) if fps > 0 else 33  # milliseconds
         
-        print(f"📹 Video info: {total_frames} frames, {fps:.2f} FPS, {duration:.2f}s")
+        print(f"📹 Video info: {total_frames} frames, {fps:.2f} FPS, {duration:.2f}s, "
+              f"{engine.keyframe_count()} keyframe(s) indexed")
         
         # Create window - Fixed OpenCV compatibility issue
         try:
@@ -64,22 +371,24 @@ class VideoClientPanorama:
         
         paused = False
         current_frame = 0
+        frame = None
         
         try:
             while True:
                 if not paused:
-                    ret, frame = cap.read()
-                    if not ret:
+                    frame_index, next_frame = engine.next_frame()
+                    if next_frame is None:
                         print("🏁 Video playback finished")
-                        if auto_close:
+                        if auto_close or frame is None:
                             break
                         else:
                             # Loop video
-                            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                            engine.seek(0)
                             current_frame = 0
                             continue
                     
-                    current_frame += 1
+                    frame = next_frame
+                    current_frame = frame_index + 1
                     
                     # Display frame info
                     height, width = frame.shape[:2]
@@ -95,34 +404,41 @@ class VideoClientPanorama:
                     info_text = f"Frame: {current_frame}/{total_frames} | Time: {time_elapsed:.1f}s/{duration:.1f}s | {progress:.1f}%"
                     cv2.putText(frame, info_text, (15, height - 35), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
                     
-                    if paused:
-                        cv2.putText(frame, "PAUSED - Press SPACE to resume", (15, 30), 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-                
-                cv2.imshow(window_name, frame)
+                    cv2.imshow(window_name, frame)
                 
-                # Handle keyboard input
-                key = cv2.waitKey(frame_delay if not paused else 1) & 0xFF
+                # Wait until the next frame is due instead of a fixed 1000/fps delay
+                if paused:
+                    delay = 30
+                else:
+                    delay = max(1, int(engine.time_until_due(current_frame) * 1000))
+                key = cv2.waitKey(delay) & 0xFF
                 
                 if key == 27 or key == ord('q'):  # ESC or Q to quit
                     print("⏹️ Playback stopped by user")
                     break
                 elif key == ord(' '):  # SPACE to pause/resume
                     paused = not paused
+                    engine.set_paused(paused)
+                    if paused:
+                        paused_frame = frame.copy()
+                        cv2.putText(paused_frame, "PAUSED - Press SPACE to resume", (15, 30), 
+                                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                        cv2.imshow(window_name, paused_frame)
                     print("⏸️ Paused" if paused else "▶️ Resumed")
                 elif key == ord('r'):  # R to restart
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    engine.seek(0)
                     current_frame = 0
                     paused = False
+                    engine.set_paused(False)
                     print("🔄 Video restarted")
                 elif key == 83:  # Right arrow - skip forward
                     new_frame = min(current_frame + int(fps * 5), total_frames - 1)  # Skip 5 seconds
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, new_frame)
+                    engine.seek(new_frame)
                     current_frame = new_frame
                     print(f"⏭️ Skipped forward to frame {current_frame}")
                 elif key == 81:  # Left arrow - skip backward
                     new_frame = max(current_frame - int(fps * 5), 0)  # Skip back 5 seconds
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, new_frame)
+                    engine.seek(new_frame)
                     current_frame = new_frame
                     print(f"⏮️ Skipped backward to frame {current_frame}")
         
@@ -130,8 +446,11 @@ class VideoClientPanorama:
             print("\n⏹️ Playback interrupted")
         
         finally:
-            cap.release()
+            engine.close()
             cv2.destroyWindow(window_name)
+            if engine.frames_dropped:
+                FRAMES_DROPPED.labels("playback").inc(engine.frames_dropped)
+                print(f"⚡ Dropped {engine.frames_dropped} late frame(s) to stay in real time")
             print("✅ Video playback completed")
         
         return True
@@ -166,74 +485,223 @@ class VideoClientPanorama:
         
         print("🏁 All videos played successfully!")
 
-    def receive_file(self, s):
-        """Receive a file from the server"""
+    def receive_file(self, conn):
+        """Receive the next complete file from the server, answering PINGs meanwhile"""
+        if not isinstance(conn, FramedConnection):
+            conn = FramedConnection(conn)
         try:
-            # Receive file size
-            file_size_bytes = s.recv(8)
-            if len(file_size_bytes) != 8:
-                print("Error receiving file size")
-                return None
-                
-            file_size = struct.unpack('!Q', file_size_bytes)[0]
-            
-            if file_size == 0:
-                print("Server reported file error or file not found")
-                return None
-                
+            while True:
+                header = conn.read_header()
+                event, file_path = self.handle_frame(conn, header)
+                if event == 'file':
+                    return file_path
+                if event in ('failed', 'quit'):
+                    return None
+        except Exception as e:
+            print(f"❌ Error receiving file: {e}")
+            for transfer in self.incoming.values():
+                transfer.close()
+            self.incoming.clear()
+            return None
+
+    def handle_frame(self, conn, header):
+        """
+        Handle one frame from the server
+        
+        File transfers are tracked per stream id, so several files (and
+        control frames) can arrive interleaved on one connection.
+        
+        Returns:
+            ('file', path) when a file completed, ('failed', None) when a
+            transfer failed, ('quit', None) on QUIT, otherwise (None, None)
+        """
+        if header.msg_type == MSG_PING:
+            # Respond to server ping to maintain connection
+            conn.skip_payload(header.length)
+            conn.send_frame(MSG_PONG)
+            return None, None
+        
+        if header.msg_type == MSG_QUIT:
+            conn.skip_payload(header.length)
+            return 'quit', None
+        
+        if header.msg_type == MSG_HELLO:
+            # Server's answer to our HELLO: the compression both sides use from now on
+            conn.codec = accept_hello(conn.read_payload(header.length), COMPRESSION_DICTIONARY)
+            if conn.codec is not None:
+                dictionary = " + dictionary" if conn.codec.dictionary else ""
+                print(f"🗜️ Compression negotiated: {conn.codec.name}{dictionary}")
+            return None, None
+        
+        if header.msg_type == MSG_BROADCAST_BEGIN:
+            description = json.loads(conn.decode_payload(header, conn.read_payload(header.length)))
+            threading.Thread(target=self.receive_broadcast, args=(conn, description),
+                             name="broadcast", daemon=True).start()
+            return None, None
+        
+        if header.msg_type == MSG_FRAME:
+            payload = conn.read_payload(header.length)
+            if self.live_frames is None:
+                print("📺 Live stream started")
+                self.live_frames = FrameStore(self.data_directory)
+                self.live_canvas.record(self.live_frames, LIVE_PANORAMA_EVERY, LIVE_PANORAMA_MAX_FRAMES)
+            self.live_canvas.apply(payload)
+            return None, None
+        
+        if header.msg_type == MSG_MODEL_UPDATE:
+            update = json.loads(conn.decode_payload(header, conn.read_payload(header.length)))
+            if update.get('secure'):
+                print(f"🧠 Server model updated to version {update['version']} "
+                      f"(secure aggregate of {update['participants']} source(s))")
+            else:
+                print(f"🧠 Server model updated to version {update['version']} "
+                      f"({len(update['updates'])} update(s))")
+            return None, None
+        
+        if header.msg_type == MSG_FILE_BEGIN:
+            file_size, file_name = decode_file_begin(conn.read_payload(header.length))
+            print("📥 Server is sending a video recording file...")
             print(f"\n🎥 Receiving video recording file of size: {file_size / (1024*1024):.2f} MB")
             
-            # Receive file name length
-            file_name_len_bytes = s.recv(4)
-            file_name_len = struct.unpack('!I', file_name_len_bytes)[0]
+            # Full path for saving (never outside the save directory)
+            file_path = os.path.join(self.save_directory, os.path.basename(file_name))
+            print(f"📁 Saving as: {file_path}")
             
-            # Receive file name
-            file_name_bytes = s.recv(file_name_len)
-            file_name = file_name_bytes.decode('utf-8')
+            transfer = IncomingFile(file_path, file_size, self.receive_buffer)
+            transfer.bytes_counter = CLIENT_BYTES.labels(self.server_address or "unknown", "received")
+            self.incoming[header.stream_id] = transfer
+            return None, None
+        
+        if header.msg_type == MSG_FILE_CHUNK:
+            transfer = self.incoming.get(header.stream_id)
+            if transfer is None:
+                conn.skip_payload(header.length)
+                return None, None
             
-            # Full path for saving
-            file_path = os.path.join(self.save_directory, file_name)
-            print(f"📁 Saving as: {file_path}")
+            if header.flags & FLAG_COMPRESSED:
+                chunk = conn.decode_payload(header, conn.read_payload(header.length))
+                transfer.write_chunk(chunk)
+            else:
+                transfer.receive_chunk(conn, header.length)
+            transfer.bytes_counter.inc(header.length)
             
-            # Receive file data with progress bar
-            with open(file_path, 'wb') as f:
-                bytes_received = 0
-                start_time = time.time()
-                last_update = time.time()
+            # Show progress every PROGRESS_INTERVAL seconds
+            current_time = time.time()
+            if transfer.progress_due(current_time):
+                bytes_received, file_size = transfer.received, transfer.size
+                elapsed = current_time - transfer.started
+                progress = (bytes_received / file_size) * 100
+                speed = bytes_received / elapsed / 1024  # KB/s
+                eta = (file_size - bytes_received) / (bytes_received / elapsed)
                 
-                while bytes_received < file_size:
-                    chunk_size = min(4096, file_size - bytes_received)
-                    chunk = s.recv(chunk_size)
-                    if not chunk:
-                        print("Connection lost during file transfer")
-                        return None
-                        
-                    f.write(chunk)
-                    bytes_received += len(chunk)
-                    
-                    # Show progress every 0.5 seconds
-                    current_time = time.time()
-                    if current_time - last_update >= 0.5:
-                        progress = (bytes_received / file_size) * 100
-                        speed = bytes_received / (current_time - start_time) / 1024  # KB/s
-                        eta = (file_size - bytes_received) / (bytes_received / (current_time - start_time))
-                        
-                        print(f"📊 Progress: {progress:.1f}% | Speed: {speed:.1f} KB/s | ETA: {eta:.1f}s", end='\r')
-                        last_update = current_time
-            
-            print(f"\n✅ File received successfully: {file_path}")
-            print(f"🎯 File size: {file_size / (1024*1024):.2f} MB")
+                print(f"📊 Progress: {progress:.1f}% | Speed: {speed:.1f} KB/s | ETA: {eta:.1f}s", end='\r')
+            return None, None
+        
+        if header.msg_type == MSG_FILE_END:
+            conn.skip_payload(header.length)
+            transfer = self.incoming.pop(header.stream_id, None)
+            if transfer is None:
+                return None, None
+            transfer.close()
+            STAGE_SECONDS.labels('receive').observe(time.time() - transfer.started)
             
-            return file_path
+            if transfer.received != transfer.size:
+                print(f"\n❌ Incomplete file: got {transfer.received} of {transfer.size} bytes")
+                return 'failed', None
             
-        except Exception as e:
-            print(f"❌ Error receiving file: {e}")
-            return None
+            print(f"\n✅ File received successfully: {transfer.path}")
+            print(f"🎯 File size: {transfer.size / (1024*1024):.2f} MB")
+            return 'file', transfer.path
+        
+        if header.msg_type == MSG_FILE_ERROR:
+            reason = conn.read_payload(header.length).decode('utf-8', 'replace')
+            print(f"Server reported file error: {reason}")
+            transfer = self.incoming.pop(header.stream_id, None)
+            if transfer is not None:
+                transfer.close()
+            return 'failed', None
+        
+        print(f"❓ Unknown message type: {header.name}")
+        conn.skip_payload(header.length)
+        return None, None
+
+    def receive_broadcast(self, conn, description):
+        """
+        Rebuild a multicast (fountain-coded) file announced by the server
+        
+        Runs in its own thread. Decode progress is reported over the TCP
+        connection whenever the packet stream pauses, so the server sends
+        just enough repair symbols; completion (and the SHA-256 check) is
+        reported the same way.
+        """
+        transfer_id = description['transfer']
+        file_path = os.path.join(self.save_directory, os.path.basename(description['name']))
+        print(f"📡 Receiving {description['name']} by multicast "
+              f"({description['size'] / (1024*1024):.2f} MB, {description['blocks']} blocks)")
+        
+        def report(**status):
+            status['transfer'] = transfer_id
+            try:
+                conn.send_frame(MSG_BROADCAST_STATUS, json.dumps(status).encode('utf-8'))
+            except OSError:
+                pass
+        
+        try:
+            # Join on the interface that reaches the server
+            interface = conn.sock.getsockname()[0]
+            sock = open_multicast_receiver(description['group'], description['port'], interface)
+        except OSError as e:
+            print(f"❌ Cannot join multicast group: {e}")
+            report(complete=False, packets=0, need={})
+            return
+        
+        decoder = FountainDecoder(description, file_path)
+        packet = bytearray(PACKET_HEADER.size + decoder.symbol_size)
+        view = memoryview(packet)
+        sock.settimeout(BROADCAST_REPORT_INTERVAL)
+        started = time.time()
+        last_packet = time.time()
+        reported_at = 0
+        try:
+            while self.connected and not decoder.complete():
+                try:
+                    size = sock.recv_into(packet)
+                except socket.timeout:
+                    idle = time.time() - last_packet
+                    if idle > BROADCAST_IDLE_TIMEOUT:
+                        print("\n❌ Multicast transfer stalled")
+                        break
+                    if decoder.packets != reported_at or idle > 1.0:
+                        reported_at = decoder.packets
+                        needs = decoder.needs()
+                        report(complete=False, packets=decoder.packets,
+                               need={str(block): need for block, need in needs.items()})
+                    continue
+                last_packet = time.time()
+                decoder.add_packet(view[:size])
+        finally:
+            sock.close()
+        
+        ok = decoder.complete() and decoder.verify()
+        decoder.close()
+        report(complete=True, ok=ok, packets=decoder.packets)
+        STAGE_SECONDS.labels('receive').observe(time.time() - started)
+        if not ok:
+            print("❌ Multicast transfer failed; the server will resend over TCP")
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return
+        
+        print(f"\n✅ Multicast file rebuilt: {file_path} ({decoder.packets} packets)")
+        self.files_received += 1
+        self.handle_received_file(file_path)
+        print("-" * 60)
 
-    def extract_zip(self, zip_path):
+    def extract_zip(self, zip_path, extract_path=None):
         """Extract zip file and return list of video files"""
         try:
-            extract_path = os.path.join(self.save_directory, "extracted")
+            if extract_path is None:
+                extract_path = os.path.join(self.save_directory, "extracted")
             if not os.path.exists(extract_path):
                 os.makedirs(extract_path)
             
@@ -259,257 +727,282 @@ class VideoClientPanorama:
 
     def create_panorama_from_video(self, video_path, skip_frames=5, resize_dims=(640, 360)):
         """Extract frames from video and create panorama"""
+        return self.build_panorama(video_path, skip_frames, resize_dims)['panorama_path']
+
+    def build_panorama(self, video_path, skip_frames=5, resize_dims=(640, 360), save_frames=False, preset=None,
+                       cache_key=None):
+        """
+        Extract frames from video and create panorama, returning a report
+        
+        The report holds the panorama path (None on failure), the stitch
+        status, frame counts and per-stage timings. No windows are opened, so
+        this is safe to call on machines without a display. With save_frames
+        the selected frames are also written as JPEGs to frames_<video>/ in
+        the data directory, and a failed stitch leaves sample frames in
+        samples_<video>/, so parallel jobs never overwrite each other's.
+        preset picks a StitchingEngine preset instead of cv2.Stitcher.
+        Videos with a pose sidecar are mosaicked from their telemetry first,
+        and the georeference is saved next to the panorama as .geo.json.
+        
+        A panorama already built from the same video content with the same
+        parameters is restored from the cache instead (report['cached']).
+        cache_key is the key of a lookup the caller already made and missed;
+        runs with save_frames bypass the cache, as the frames are wanted.
+        """
+        report = {
+            'video': video_path,
+            'panorama_path': None,
+            'status': 'failed',
+            'stitch_mode': None,
+            'stitch_status': None,
+            'total_frames': 0,
+            'frames_read': 0,
+            'frames_extracted': 0,
+            'fps': 0.0,
+            'duration': 0.0,
+            'extract_seconds': 0.0,
+            'stitch_seconds': 0.0,
+            'seconds': 0.0,
+            'error': None,
+            'cached': False,
+        }
+        started = time.perf_counter()
+        print(f"\n🎬 Processing video: {os.path.basename(video_path)}")
         try:
-            print(f"\n🎬 Processing video: {os.path.basename(video_path)}")
-            
-            # Read the video
-            cam = cv2.VideoCapture(video_path)
-            
-            if not cam.isOpened():
-                print(f"❌ Could not open video file: {video_path}")
-                return None
-            
-            # Get video properties
-            total_frames = int(cam.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = cam.get(cv2.CAP_PROP_FPS)
-            duration = total_frames / fps if fps > 0 else 0
-            
-            print(f"📹 Video info: {total_frames} frames, {fps:.2f} FPS, {duration:.2f}s duration")
-            
-            # Frame extraction
-            currentframe = 0
-            frames = []
-            frame_count = 0
-            
+            if self.cache is not None and not save_frames and cache_key is None:
+                cache_key = self.cache.key(video_path, panorama_params(skip_frames, resize_dims, preset, self.tiles))
+                if self.restore_cached(cache_key, report, Path(video_path).stem):
+                    return report
             print(f"🔄 Extracting every {skip_frames} frame(s)...")
+            stem = Path(video_path).stem
+            samples_directory = os.path.join(self.data_directory, f'samples_{stem}')
+            panorama, mode = panorama_from_video(
+                video_path, skip_frames, resize_dims,
+                frames_directory=os.path.join(self.data_directory, f'frames_{stem}') if save_frames else None,
+                store_directory=self.data_directory, samples_directory=samples_directory,
+                report=report, progress=self._panorama_progress, preset=preset)
             
-            while True:
-                ret, frame = cam.read()
-                if not ret:
-                    break
-                    
-                if frame_count % skip_frames == 0:
-                    # Downscale frame for better processing
-                    frame_resized = cv2.resize(frame, resize_dims)
-                    
-                    # Save frame for debugging
-                    frame_name = os.path.join(self.data_directory, f'frame{currentframe}.jpg')
-                    cv2.imwrite(frame_name, frame_resized)
-                    
-                    frames.append(frame_resized)
-                    currentframe += 1
-                    
-                    if currentframe % 10 == 0:
-                        print(f"📸 Extracted {currentframe} frames...")
-                
-                frame_count += 1
-            
-            # Release video
-            cam.release()
-            
-            print(f"✅ Extracted {len(frames)} frames total")
-            
-            if len(frames) < 2:
+            if panorama is not None:
+                report['panorama_path'] = self.save_panorama(panorama, Path(video_path).stem, mode)
+                outputs = [report['panorama_path']]
+                if report['panorama_path'].endswith('.dzi'):
+                    outputs.append(report['panorama_path'][:-4] + '_files')
+                if report['georeference'] is not None:
+                    geo_path = write_georeference(report['georeference'], report['panorama_path'])
+                    outputs.append(geo_path)
+                    print(f"🌍 Georeference saved: {geo_path}")
+                report['status'] = 'ok'
+                if self.cache is not None and cache_key is not None:
+                    self.cache.put(cache_key, outputs, {field: report[field] for field in CACHED_FIELDS},
+                                   name=Path(video_path).stem)
+            elif report['error'] == 'could not open video':
+                print(f"❌ Could not open video file: {video_path}")
+            elif report['frames_extracted'] < 2:
                 print("❌ Need at least 2 frames to create panorama")
-                return None
-            
-            # Create panorama - Fixed OpenCV compatibility
-            print("🔧 Stitching frames into panorama...")
-            
-            panorama_path = None
-            
-            try:
-                # Try to use the newer Stitcher API first
-                if hasattr(cv2, 'Stitcher_create'):
-                    # OpenCV 4.x
-                    stitcher_modes = [
-                        (cv2.Stitcher_SCANS, "SCANS"),
-                        (cv2.Stitcher_PANORAMA, "PANORAMA")
-                    ]
-                    
-                    for mode, mode_name in stitcher_modes:
-                        try:
-                            print(f"🎯 Trying {mode_name} mode...")
-                            stitcher = cv2.Stitcher_create(mode)
-                            status, panorama = stitcher.stitch(frames)
-                            
-                            if status == cv2.Stitcher_OK:
-                                # Save panorama
-                                video_name = Path(video_path).stem
-                                panorama_path = os.path.join(self.data_directory, f'panorama_{video_name}_{mode_name.lower()}.jpg')
-                                cv2.imwrite(panorama_path, panorama)
-                                print(f"✅ Panorama created successfully: {panorama_path}")
-                                break
-                            else:
-                                print(f"❌ {mode_name} mode failed with status: {status}")
-                                self.print_stitcher_error(status)
-                                
-                        except Exception as e:
-                            print(f"❌ Error with {mode_name} mode: {e}")
-                
-                else:
-                    # Fallback for older OpenCV versions (3.x)
-                    print("🎯 Using legacy OpenCV Stitcher...")
-                    stitcher = cv2.createStitcher(False)  # False for scans mode
-                    status, panorama = stitcher.stitch(frames)
-                    
-                    if status == cv2.Stitcher_OK:
-                        video_name = Path(video_path).stem
-                        panorama_path = os.path.join(self.data_directory, f'panorama_{video_name}_legacy.jpg')
-                        cv2.imwrite(panorama_path, panorama)
-                        print(f"✅ Panorama created successfully: {panorama_path}")
-                    else:
-                        print(f"❌ Legacy stitcher failed with status: {status}")
-                        self.print_stitcher_error(status)
-                        
-            except Exception as e:
-                print(f"❌ Error during stitching: {e}")
-            
-            if panorama_path is None:
+            else:
                 print("❌ All stitching methods failed. Consider:")
                 print("   - Using a video with more overlapping scenes")
                 print("   - Adjusting skip_frames parameter")
                 print("   - Ensuring camera movement is smooth and linear")
-                
-                # Save a sample of frames for manual inspection
-                sample_frames = frames[::max(1, len(frames)//5)]  # Take 5 sample frames
-                for i, frame in enumerate(sample_frames):
-                    sample_path = os.path.join(self.data_directory, f'sample_frame_{i}.jpg')
-                    cv2.imwrite(sample_path, frame)
-                print(f"💡 Saved {len(sample_frames)} sample frames for inspection")
-            
-            return panorama_path
+                print(f"💡 Saved sample frames to {samples_directory} for inspection")
+            return report
             
         except Exception as e:
             print(f"❌ Error creating panorama: {e}")
-            return None
+            report['error'] = str(e)
+            return report
         finally:
-            cv2.destroyAllWindows()
-
-    def print_stitcher_error(self, status):
-        """Print detailed stitcher error information"""
-        error_messages = {
-            1: "Need more images with better overlap",  # ERR_NEED_MORE_IMGS
-            2: "Homography estimation failed - images may not overlap enough",  # ERR_HOMOGRAPHY_EST_FAIL  
-            3: "Camera parameters adjustment failed"  # ERR_CAMERA_PARAMS_ADJUST_FAIL
-        }
-        
-        # Try to use OpenCV constants if available, otherwise use numeric values
-        try:
-            error_messages.update({
-                cv2.Stitcher_ERR_NEED_MORE_IMGS: "Need more images with better overlap",
-                cv2.Stitcher_ERR_HOMOGRAPHY_EST_FAIL: "Homography estimation failed - images may not overlap enough",
-                cv2.Stitcher_ERR_CAMERA_PARAMS_ADJUST_FAIL: "Camera parameters adjustment failed"
-            })
-        except AttributeError:
-            pass  # Use numeric values for older OpenCV versions
+            report['seconds'] = time.perf_counter() - started
+
+    def restore_cached(self, cache_key, report, name):
+        """Fill report from a cached panorama restored into the data directory as name; False on a miss"""
+        entry = self.cache.get(cache_key, self.data_directory, name=name)
+        if entry is None:
+            return False
+        report.update(entry['info'])
+        report.update(panorama_path=entry['paths'][0], status='ok', cached=True)
+        print(f"♻️ Panorama found in cache: {report['panorama_path']}")
+        return True
+
+    def _panorama_progress(self, event, **info):
+        """Console output for the shared panorama pipeline"""
+        if event == 'opened':
+            print(f"📹 Video info: {info['total_frames']} frames, {info['fps']:.2f} FPS, "
+                  f"{info['duration']:.2f}s duration")
+        elif event == 'frame' and info['count'] % 10 == 0:
+            print(f"📸 Extracted {info['count']} frames...")
+        elif event == 'extracted':
+            print(f"✅ Extracted {info['count']} frames total")
+            if info['count'] >= 2:
+                print("🔧 Stitching frames into panorama...")
+        elif event == 'attempt':
+            print(f"🎯 Trying {info['mode']} mode...")
+        elif event == 'failed':
+            print(f"❌ {info['mode']} mode failed with status: {info['status']}")
+            if info['message']:
+                print(f"   💡 {info['message']}")
+
+    def save_panorama(self, panorama, name, mode):
+        """Write a panorama to data/panorama_<name>_<mode>.jpg (or .dzi tiles) and return the path"""
+        extension = 'dzi' if self.tiles else 'jpg'
+        panorama_path = save_image(panorama, os.path.join(self.data_directory,
+                                                          f'panorama_{name}_{mode.lower()}.{extension}'))
+        print(f"✅ Panorama created successfully: {panorama_path}")
+        return panorama_path
+
+    def stitch_frames(self, frames, name, report):
+        """
+        Stitch frames into a panorama saved as data/panorama_<name>_<mode>.jpg
         
-        if status in error_messages:
-            print(f"   💡 {error_messages[status]}")
+        Tries SCANS then PANORAMA mode; stitch status, mode and errors are
+        recorded in report. Returns the panorama path, or None on failure.
+        """
+        panorama, mode = stitch(frames, report=report, progress=self._panorama_progress)
+        return None if panorama is None else self.save_panorama(panorama, name, mode)
 
-    def process_received_videos(self, video_files):
+    def process_received_videos(self, video_files, play_first=True):
         """Process all received video files - PLAY FIRST, then create panoramas"""
-        print(f"\n🎬 Playing {len(video_files)} extracted video(s) FIRST...")
-        
-        # STEP 1: Play all videos first
-        self.play_multiple_videos(video_files, auto_advance=True)
+        if play_first:
+            print(f"\n🎬 Playing {len(video_files)} extracted video(s) FIRST...")
+            
+            # STEP 1: Play all videos first
+            self.play_multiple_videos(video_files, auto_advance=True)
         
         print(f"\n🎨 Now creating panoramas from the videos...")
         
-        # STEP 2: Then create panoramas
-        panorama_results = []
+        # STEP 2: Then create panoramas in parallel on the job pool
+        jobs = self.get_job_queue()
+        already_done = len(jobs.get_status()['panoramas'])
         for video_file in video_files:
-            print(f"\n{'='*60}")
-            panorama_path = self.create_panorama_from_video(video_file)
-            if panorama_path:
-                panorama_results.append(panorama_path)
-                print(f"🎉 Successfully created panorama: {os.path.basename(panorama_path)}")
-            else:
-                print(f"❌ Failed to create panorama for: {os.path.basename(video_file)}")
+            jobs.submit(video_file)
+        jobs.wait()
+        
+        return jobs.get_status()['panoramas'][already_done:]
+
+    def handle_received_file(self, file_path):
+        """Queue a received file for playback and panorama creation"""
+        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.wmv']
+        
+        # Check if it's a zip file and extract
+        if file_path.endswith('.zip'):
+            print("📦 Extracting zip file...")
+            video_files = self.extract_zip(file_path)
+        elif any(file_path.endswith(ext) for ext in video_extensions):
+            video_files = [file_path]
+        else:
+            video_files = []
+        
+        if not video_files:
+            print("❌ No video files found in received file")
+            return
         
-        return panorama_results
+        jobs = self.get_job_queue()
+        for video_file in video_files:
+            self.playback_queue.put(video_file)
+            jobs.submit(video_file)
+
+    def _network_loop(self, s):
+        """Read server messages; never blocks on playback or stitching"""
+        conn = FramedConnection(s)
+        hello_sent = False
+        while True:
+            try:
+                if not hello_sent:
+                    # Offer the codecs we can decode; the server replies with its choice
+                    conn.send_frame(MSG_HELLO, client_hello(COMPRESSION_DICTIONARY))
+                    hello_sent = True
+                
+                header = conn.read_header()
+                event, file_path = self.handle_frame(conn, header)
+                
+                if event == 'file':
+                    self.files_received += 1
+                    print("🎉 Video file transfer completed successfully!")
+                    self.handle_received_file(file_path)
+                    print("-" * 60)
+                    
+                elif event == 'failed':
+                    print("❌ File transfer failed!")
+                    print("-" * 60)
+                    
+                elif event == 'quit':
+                    print("🔴 Server is closing connection.")
+                    break
+                
+            except ConnectionError:
+                print("📡 Server disconnected.")
+                break
+            except Exception as e:
+                print(f"❌ Connection error: {e}")
+                break
+        
+        for transfer in self.incoming.values():
+            transfer.close()
+        self.incoming.clear()
+        self.connected = False
+        # Wake the playback loop so it can notice the disconnect
+        self.playback_queue.put(None)
 
-    def connect_to_server(self, host = 'localhost', port=8080):
-        """Connect to server and receive video files"""
+    def connect_to_server(self, host = 'localhost', port=8080, play_videos=True):
+        """
+        Connect to server and receive video files
+        
+        The socket is serviced by a background network thread, panoramas are
+        built on the job pool and this thread only plays videos (OpenCV windows
+        must stay on the main thread).
+        """
         print("🚀 Video Recording Client - Connecting to server...")
         
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         try:
             s.connect((host, port))
+            self.connected = True
+            self.server_address = f"{host}:{port}"
             print(f"✅ Connected to video recording server at {host}:{port}")
             print("📺 Waiting for video recordings from server...")
             print("ℹ  Server will automatically send zip files when recording stops")
-            print("🎬 Videos will be PLAYED FIRST, then panoramas will be created")
+            print(f"🎬 Videos will be played while panoramas are built in the background "
+                  f"(max {self.get_job_queue().max_jobs} concurrent jobs)")
             print("-" * 60)
 
+            network_thread = threading.Thread(target=self._network_loop, args=(s,),
+                                              name="network", daemon=True)
+            network_thread.start()
+            # Connected and listening: now pay for OpenCV while the first file is on its way
+            prewarm_client()
+
+            shown_version = 0
             while True:
                 try:
-                    # Receive message type
-                    msg_type = s.recv(7)
-                    if not msg_type:
-                        print("📡 Server disconnected.")
-                        break
-                    
-                    msg_type = msg_type.decode('utf-8').strip()
-                    
-                    if msg_type == 'FILE':
-                        # Receive file
-                        print("📥 Server is sending a video recording file...")
-                        file_path = self.receive_file(s)
-                        
-                        if file_path:
-                            print("🎉 Video file transfer completed successfully!")
-                            
-                            # Check if it's a zip file and extract
-                            if file_path.endswith('.zip'):
-                                print("📦 Extracting zip file...")
-                                video_files = self.extract_zip(file_path)
-                                
-                                if video_files:
-                                    print("🎬 PLAYING videos first, then creating panoramas...")
-                                    panorama_results = self.process_received_videos(video_files)
-                                    
-                                    if panorama_results:
-                                        print(f"\n🌟 Successfully created {len(panorama_results)} panorama(s):")
-                                        for panorama in panorama_results:
-                                            print(f"   📸 {os.path.basename(panorama)}")
-                                    else:
-                                        print("❌ No panoramas could be created")
-                                else:
-                                    print("❌ No video files found in zip")
-                            
-                            elif any(file_path.endswith(ext) for ext in ['.mp4', '.avi', '.mov', '.mkv', '.wmv']):
-                                # Direct video file - PLAY FIRST, then create panorama
-                                print("🎬 Playing received video FIRST...")
-                                self.play_video(file_path)
-                                
-                                print("🎨 Now creating panorama from video...")
-                                panorama_path = self.create_panorama_from_video(file_path)
-                                if panorama_path:
-                                    print(f"🌟 Panorama created: {os.path.basename(panorama_path)}")
-                        else:
-                            print("❌ File transfer failed!")
-                        
-                        print("-" * 60)
-                        
-                    elif msg_type == 'PING':
-                        # Respond to server ping to maintain connection
-                        s.send(b'PONG')
-                        
-                    elif msg_type == 'QUIT':
-                        print("🔴 Server is closing connection.")
+                    video_file = self.playback_queue.get(timeout=LIVE_POLL_INTERVAL)
+                except queue.Empty:
+                    # Nothing to play: show the live view if it changed
+                    if play_videos and self.live_canvas.version != shown_version:
+                        shown_version = self.live_canvas.version
+                        cv2.imshow(LIVE_WINDOW, self.live_canvas.snapshot())
+                        cv2.waitKey(1)
+                    continue
+                if video_file is None:
+                    if not self.connected:
                         break
-                    
-                    else:
-                        if msg_type:  # Only print if not empty
-                            print(f"❓ Unknown message type: {msg_type}")
-                    
-                except socket.timeout:
                     continue
-                except Exception as e:
-                    print(f"❌ Connection error: {e}")
-                    break
+                if play_videos:
+                    self.play_video(video_file)
+            
+            if self.live_frames is not None:
+                self.create_panorama_from_live()
+
+            if self.job_queue is not None:
+                print("⏳ Waiting for remaining panorama jobs...")
+                self.job_queue.wait()
+                results = self.job_queue.get_status()['panoramas']
+                if results:
+                    print(f"\n🌟 Successfully created {len(results)} panorama(s):")
+                    for panorama in results:
+                        print(f"   📸 {os.path.basename(panorama)}")
+                else:
+                    print("❌ No panoramas could be created")
 
         except ConnectionRefusedError:
             print(f"❌ Could not connect to server at {host}:{port}")
@@ -517,12 +1010,34 @@ class VideoClientPanorama:
             print("   1. The server is running")
             print("   2. The IP address is correct")
             print("   3. Port is not blocked by firewall")
+        except KeyboardInterrupt:
+            print("\n⏹️ Client interrupted")
         except Exception as e:
             print(f"❌ Client error: {e}")
         finally:
+            self.connected = False
             s.close()
+            if self.job_queue is not None:
+                self.job_queue.shutdown(wait=False)
             print("🔌 Client connection closed.")
 
+    def create_panorama_from_live(self):
+        """Stitch the frames sampled from the live stream into a panorama"""
+        self.live_canvas.record(None)
+        frame_store, self.live_frames = self.live_frames, None
+        report = {'stitch_status': None, 'stitch_mode': None, 'error': None}
+        try:
+            print(f"📺 Live stream: {self.live_canvas.updates} updates, {self.live_canvas.tiles} tiles, "
+                  f"{self.live_canvas.keyframes} keyframes")
+            if len(frame_store) < 2:
+                print("❌ Not enough live frames for a panorama")
+                return None
+            print(f"🎨 Building panorama from {len(frame_store)} live frames...")
+            name = f"live_{time.strftime('%Y%m%d_%H%M%S')}"
+            return self.stitch_frames(frame_store.frames(), name, report)
+        finally:
+            frame_store.close()
+
     def process_local_video(self, video_path, play_first=True):
         """Process a local video file - PLAY FIRST, then create panorama"""
         if not os.path.exists(video_path):
@@ -541,9 +1056,57 @@ class VideoClientPanorama:
         return panorama_path
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ground station client: receive recordings, play them and build panoramas")
+    parser.add_argument('--mode', choices=['connect', 'process', 'play'],
+                        help="run without the interactive menu: connect to the server, process or play a local video")
+    parser.add_argument('--host', default='localhost', help="server address (connect mode)")
+    parser.add_argument('--port', type=int, default=8080, help="server port (connect mode)")
+    parser.add_argument('--video', help="video file (process and play modes)")
+    parser.add_argument('--jobs', type=int, help="max concurrent panorama jobs (default: one per CPU core)")
+    parser.add_argument('--save-dir', default='downloads', help="where received files are saved")
+    parser.add_argument('--data-dir', default='data', help="where frames and panoramas are written")
+    parser.add_argument('--no-play', action='store_true', help="do not play videos, only build panoramas")
+    parser.add_argument('--tiles', action='store_true',
+                        help="save panoramas as Deep Zoom tile pyramids (.dzi) instead of single JPEGs")
+    parser.add_argument('--cache-size', type=float, default=CACHE_SIZE_MB, metavar='MB',
+                        help=f"size of the panorama cache in <data-dir>/{CACHE_DIRECTORY} "
+                             f"(default: {CACHE_SIZE_MB}, 0 turns it off)")
+    parser.add_argument('--serve-tiles', type=int, nargs='?', const=TILE_PORT, metavar='PORT',
+                        help=f"serve the data directory over HTTP for tile viewers (default port {TILE_PORT})")
+    args = parser.parse_args(argv)
+
     # Create client instance
-    client = VideoClientPanorama()
+    client = VideoClientPanorama(args.save_dir, args.data_dir, max_jobs=args.jobs, tiles=args.tiles,
+                                 cache_size=args.cache_size)
+    if args.serve_tiles:
+        serve_tiles(args.data_dir, args.serve_tiles, host='0.0.0.0')
+        print(f"🗺️ Panorama tiles served at http://0.0.0.0:{args.serve_tiles}/")
+    
+    # Expose instrumentation
+    try:
+        start_metrics_server(METRICS_PORT)
+        print(f"📈 Metrics available at http://127.0.0.1:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"⚠️ Could not start metrics endpoint on port {METRICS_PORT}: {e}")
+    start_json_dump(METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL)
+    
+    if args.mode is not None:
+        # Non-interactive: everything comes from the command line
+        if args.mode == 'connect':
+            client.connect_to_server(args.host, args.port, play_videos=not args.no_play)
+        elif not args.video:
+            parser.error(f"--mode {args.mode} needs --video")
+        elif args.mode == 'process':
+            panorama_path = client.process_local_video(args.video, play_first=not args.no_play)
+            if panorama_path:
+                print(f"🌟 Panorama created successfully: {panorama_path}")
+            else:
+                print("❌ Failed to create panorama")
+                sys.exit(1)
+        else:
+            client.play_video(args.video, auto_close=False)
+        return
     
     print("🎯 Video Client with Panorama Creation - PLAY FIRST, PANORAMA SECOND")
     print("Choose an option:")
@@ -569,6 +1132,13 @@ def main():
         else:
             port = 8080
         
+        jobs_input = input("Max concurrent panorama jobs (press Enter for one per CPU core): ").strip()
+        if jobs_input:
+            try:
+                client.max_jobs = max(1, int(jobs_input))
+            except ValueError:
+                print("Invalid number, using one job per CPU core")
+        
         # Connect to server
         client.connect_to_server(host, port)
         
@@ -0,0 +1,243 @@
+"""
+Playback engine used by VideoClientPanorama.play_video
+
+A decode thread reads ahead into a small ring buffer while the caller
+presents frames against the wall clock, so decode time never adds to the
+frame period and late frames are dropped instead of slowing playback down.
+Seeks go to the nearest keyframe from an index built when the video is
+opened and then grab forward to the exact frame.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+
+def build_keyframe_index(video_path):
+    """
+    Return the frame numbers of the keyframes in a video
+
+    The container is read in raw (demux only) mode, which does not decode
+    anything and takes a fraction of the playback time. Returns None when the
+    backend cannot report keyframes.
+    """
+    if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        return None
+    try:
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    except cv2.error:
+        return None
+    if not cap.isOpened():
+        return None
+
+    keyframes = []
+    index = 0
+    try:
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(index)
+            index += 1
+    finally:
+        cap.release()
+
+    if not keyframes or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    return keyframes
+
+
+class VideoPlayerEngine:
+    """
+    Read-ahead decoder with wall-clock frame scheduling
+
+    Usage:
+        engine = VideoPlayerEngine(path)
+        engine.open()
+        while True:
+            frame_index, frame = engine.next_frame()   # drops late frames
+            if frame is None: break
+            ...display...
+            cv2.waitKey(int(engine.time_until_due(frame_index + 1) * 1000))
+    """
+
+    def __init__(self, video_path, buffer_size=8):
+        self.video_path = video_path
+        self.buffer_size = buffer_size
+        self.cap = None
+        self.fps = 0.0
+        self.total_frames = 0
+        self.frame_period = 1 / 30
+        self.keyframes = None
+
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.decode_thread = None
+        self.running = False
+        self.finished = False
+        self.generation = 0
+        self.seek_target = None
+        self.decode_position = 0
+
+        # Presentation clock: frame clock_frame is due at clock_start
+        self.clock_start = 0.0
+        self.clock_frame = 0
+        self.paused = False
+        self.pause_started = 0.0
+        self.clock_pending = True
+
+        self.frames_presented = 0
+        self.frames_dropped = 0
+
+    def open(self):
+        """Open the video, index keyframes and start the decode thread"""
+        self.cap = cv2.VideoCapture(self.video_path)
+        if not self.cap.isOpened():
+            self.cap = None
+            return False
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_period = 1 / self.fps if self.fps > 0 else 1 / 30
+        self.keyframes = build_keyframe_index(self.video_path)
+
+        self.running = True
+        self.decode_thread = threading.Thread(target=self._decode_loop, name="video-decode", daemon=True)
+        self.decode_thread.start()
+        return True
+
+    def close(self):
+        """Stop the decode thread and release the video"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.decode_thread is not None:
+            self.decode_thread.join()
+            self.decode_thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _decode_loop(self):
+        while True:
+            with self.condition:
+                while self.running and self.seek_target is None and len(self.buffer) >= self.buffer_size:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                target = self.seek_target
+                self.seek_target = None
+                generation = self.generation
+
+            if target is not None:
+                self._seek_decoder(target)
+
+            ret, frame = self.cap.read()
+            with self.condition:
+                frame_index = self.decode_position
+                if ret:
+                    self.decode_position += 1
+                if generation != self.generation or self.seek_target is not None:
+                    # A seek arrived while decoding; this frame belongs to the old position
+                    continue
+                if not ret:
+                    self.finished = True
+                    self.condition.notify_all()
+                    while self.running and self.seek_target is None:
+                        self.condition.wait()
+                    continue
+                self.buffer.append((frame_index, frame))
+                self.condition.notify_all()
+
+    def _seek_decoder(self, target):
+        """Position the decoder on target via the nearest preceding keyframe"""
+        if self.keyframes:
+            keyframe = self.keyframes[bisect.bisect_right(self.keyframes, target) - 1]
+        else:
+            keyframe = None
+
+        # Inside the GOP we are already decoding: grabbing forward is cheapest
+        same_gop = keyframe is not None and keyframe <= self.decode_position <= target
+        if not same_gop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe if keyframe is not None else target)
+            self.decode_position = keyframe if keyframe is not None else target
+
+        while self.decode_position < target and self.cap.grab():
+            self.decode_position += 1
+
+    def seek(self, frame_index):
+        """Jump to frame_index; buffered frames are discarded"""
+        frame_index = max(0, min(frame_index, max(self.total_frames - 1, 0)))
+        with self.condition:
+            self.generation += 1
+            self.buffer.clear()
+            self.finished = False
+            self.seek_target = frame_index
+            self.condition.notify_all()
+        # The clock restarts when the first frame after the seek is decoded
+        self.clock_pending = True
+
+    def reset_clock(self, frame_index):
+        """Make frame_index due now"""
+        self.clock_start = time.perf_counter()
+        self.clock_frame = frame_index
+        if self.paused:
+            self.pause_started = self.clock_start
+
+    def set_paused(self, paused):
+        """Pause or resume the presentation clock"""
+        if paused == self.paused:
+            return
+        now = time.perf_counter()
+        if paused:
+            self.pause_started = now
+        else:
+            self.clock_start += now - self.pause_started
+        self.paused = paused
+
+    def due_time(self, frame_index):
+        """Wall-clock time at which frame_index should be shown"""
+        return self.clock_start + (frame_index - self.clock_frame) * self.frame_period
+
+    def _take_frame(self, timeout):
+        with self.condition:
+            while not self.buffer:
+                if self.finished or not self.running:
+                    return None, None
+                if not self.condition.wait(timeout):
+                    return None, None
+            frame_index, frame = self.buffer.popleft()
+            self.condition.notify_all()
+            return frame_index, frame
+
+    def next_frame(self, timeout=5.0):
+        """
+        Return (frame_index, frame) for the next frame that is still on time
+
+        Frames whose presentation slot has already passed are dropped. Returns
+        (None, None) at the end of the video.
+        """
+        while True:
+            frame_index, frame = self._take_frame(timeout)
+            if frame is None:
+                return None, None
+            if self.clock_pending:
+                self.clock_pending = False
+                self.reset_clock(frame_index)
+            # Always show the last frame so playback ends on the final image
+            is_last = self.total_frames and frame_index >= self.total_frames - 1
+            if not self.paused and not is_last and time.perf_counter() > self.due_time(frame_index + 1):
+                self.frames_dropped += 1
+                continue
+            self.frames_presented += 1
+            return frame_index, frame
+
+    def time_until_due(self, frame_index):
+        """Seconds until frame_index is due (0 when it is already late)"""
+        return max(0.0, self.due_time(frame_index) - time.perf_counter())
+
+    def keyframe_count(self):
+        """Number of indexed keyframes, or 0 when no index is available"""
+        return len(self.keyframes) if self.keyframes else 0
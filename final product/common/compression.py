@@ -0,0 +1,234 @@
+"""
+Per-message compression negotiated in the HELLO handshake
+
+The client lists the codecs it can decode (and the id of its dictionary, if
+any) in a HELLO frame; the server answers with the codec both sides will use.
+After that, a sender may compress any frame payload and marks it with
+FLAG_COMPRESSED; each payload is compressed on its own so frames stay
+independently decodable (the flag and the frame format live in framing.py).
+
+Codecs in order of preference: zstd (``pip install zstandard``), lz4
+(``pip install lz4``) and zlib, which is always available. A dictionary
+trained on typical control messages helps a lot for small, repetitive JSON;
+it is only used when both sides load the same one.
+
+Media that is already compressed (JPEG, PNG, AVI, MP4, ZIP, ...) is detected
+by extension or magic bytes and sent as is.
+
+Usage:
+    python compression.py --train samples/*.json --output control.dict
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Payloads smaller than this are not worth the CPU (a dictionary helps down to a few dozen bytes)
+MIN_COMPRESS_SIZE = 256
+MIN_COMPRESS_SIZE_DICTIONARY = 32
+# Keep the compressed payload only if it saves at least this fraction
+MIN_SAVING = 0.05
+
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+COMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.webp', '.gif',
+    '.avi', '.mp4', '.mkv', '.mov', '.wmv', '.h264', '.h265',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.7z', '.npz',
+}
+
+# (offset, magic) of formats that are already compressed
+COMPRESSED_MAGIC = (
+    (0, b'\xff\xd8\xff'),         # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),    # PNG
+    (0, b'GIF8'),                 # GIF
+    (0, b'PK\x03\x04'),           # ZIP (and npz)
+    (0, b'\x1f\x8b'),             # gzip
+    (0, b'\x28\xb5\x2f\xfd'),     # zstd
+    (0, b'\x04\x22\x4d\x18'),     # lz4 frame
+    (0, b'BZh'),                  # bzip2
+    (0, b'\xfd7zXZ\x00'),         # xz
+    (0, b'\x1a\x45\xdf\xa3'),     # Matroska / WebM
+    (4, b'ftyp'),                 # MP4 / MOV
+    (8, b'AVI '),                 # RIFF AVI
+    (8, b'WEBP'),                 # RIFF WebP
+)
+
+
+def available_codecs():
+    """Codecs this process can use, most preferred first"""
+    codecs = []
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4_frame is not None:
+        codecs.append('lz4')
+    codecs.append('zlib')
+    return codecs
+
+
+def is_compressible(name=None, head=b''):
+    """False for payloads that are already compressed media or archives"""
+    if name and os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    head = bytes(head[:16])
+    for offset, magic in COMPRESSED_MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return False
+    return True
+
+
+def load_dictionary(path):
+    """Read a dictionary file; returns None when path is empty or missing"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def dictionary_id(dictionary):
+    """Short content hash both sides compare before using a dictionary"""
+    if not dictionary:
+        return None
+    return hashlib.sha256(dictionary).hexdigest()[:16]
+
+
+def train_dictionary(samples, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Build a dictionary from sample messages
+
+    Uses zstd's trainer when available. Otherwise the samples themselves
+    become a zlib preset dictionary, most recent last since zlib prefers
+    matches near the end.
+    """
+    samples = [bytes(sample) for sample in samples if sample]
+    if not samples:
+        raise ValueError("no samples to train on")
+    if zstandard is not None and len(samples) >= 8:
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass  # Too few / too similar samples: fall back to raw content
+    return b''.join(samples)[-size:]
+
+
+class Codec:
+    """
+    Compresses and decompresses single payloads with one negotiated codec
+
+    Safe to share between threads: zstd (de)compressor objects are not,
+    so their calls are serialised.
+    """
+
+    def __init__(self, name, dictionary=None, level=None):
+        if name not in available_codecs():
+            raise ValueError(f"codec {name!r} is not available")
+        self.name = name
+        # lz4.frame has no dictionary support
+        self.dictionary = dictionary if name != 'lz4' else None
+        if name == 'zstd':
+            zdict = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+            self.compressor = zstandard.ZstdCompressor(level=level or 3, dict_data=zdict)
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+        self.level = level
+        self.lock = threading.Lock()
+
+    def compress(self, data):
+        if self.name == 'zstd':
+            with self.lock:
+                return self.compressor.compress(data)
+        if self.name == 'lz4':
+            return lz4_frame.compress(data, compression_level=self.level or 0)
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level or 6, zdict=self.dictionary)
+            return compressor.compress(data) + compressor.flush()
+        return zlib.compress(data, self.level or 6)
+
+    def decompress(self, data):
+        if self.name == 'zstd':
+            with self.lock:
+                return self.decompressor.decompress(data)
+        if self.name == 'lz4':
+            return lz4_frame.decompress(data)
+        if self.dictionary:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+            return decompressor.decompress(data) + decompressor.flush()
+        return zlib.decompress(data)
+
+    def maybe_compress(self, data):
+        """Return (payload, compressed?) keeping the original when compression does not pay"""
+        if len(data) < (MIN_COMPRESS_SIZE_DICTIONARY if self.dictionary else MIN_COMPRESS_SIZE):
+            return data, False
+        compressed = self.compress(data)
+        if len(compressed) > len(data) * (1 - MIN_SAVING):
+            return data, False
+        return compressed, True
+
+
+def client_hello(dictionary=None):
+    """HELLO payload sent by the client"""
+    return json.dumps({
+        'version': 1,
+        'codecs': available_codecs(),
+        'dictionary': dictionary_id(dictionary),
+    }).encode('utf-8')
+
+
+def negotiate(hello_payload, dictionary=None):
+    """
+    Server side: choose a codec for a client's HELLO
+
+    Returns (reply payload, Codec or None).
+    """
+    offer = json.loads(bytes(hello_payload).decode('utf-8'))
+    offered = offer.get('codecs') or []
+    chosen = next((name for name in available_codecs() if name in offered), None)
+    use_dictionary = bool(dictionary) and offer.get('dictionary') == dictionary_id(dictionary)
+    reply = {
+        'version': 1,
+        'codec': chosen,
+        'dictionary': dictionary_id(dictionary) if use_dictionary else None,
+    }
+    codec = Codec(chosen, dictionary if use_dictionary else None) if chosen else None
+    return json.dumps(reply).encode('utf-8'), codec
+
+
+def accept_hello(reply_payload, dictionary=None):
+    """Client side: build the Codec the server chose (None for no compression)"""
+    reply = json.loads(bytes(reply_payload).decode('utf-8'))
+    if not reply.get('codec'):
+        return None
+    use_dictionary = reply.get('dictionary') is not None and reply['dictionary'] == dictionary_id(dictionary)
+    return Codec(reply['codec'], dictionary if use_dictionary else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train a compression dictionary for control messages")
+    parser.add_argument('--train', nargs='+', required=True, help="sample message files")
+    parser.add_argument('--output', required=True, help="where to write the dictionary")
+    parser.add_argument('--size', type=int, default=DEFAULT_DICTIONARY_SIZE)
+    args = parser.parse_args(argv)
+
+    samples = []
+    for path in args.train:
+        with open(path, 'rb') as f:
+            samples.append(f.read())
+    dictionary = train_dictionary(samples, args.size)
+    with open(args.output, 'wb') as f:
+        f.write(dictionary)
+    print(f"Dictionary written to {args.output} ({len(dictionary)} bytes, id {dictionary_id(dictionary)})")
+
+
+if __name__ == "__main__":
+    main()
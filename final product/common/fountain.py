@@ -0,0 +1,341 @@
+"""
+Fountain-coded UDP multicast for sending one file to many ground stations
+
+The file is cut into source blocks of up to BLOCK_SYMBOLS symbols of
+SYMBOL_SIZE bytes. Every block is sent systematically (its source symbols
+first) followed by as many repair symbols as the receivers still need. A
+repair symbol is the XOR of a pseudo-random subset of the block's source
+symbols (a random linear code over GF(2)); the subset is derived from
+(transfer, block, symbol id), so receivers regenerate it from the packet
+header. Any K linearly independent symbols rebuild a block of K symbols;
+K + 10 random ones almost always do, no matter which packets were lost.
+
+Egress is the same for one receiver or a thousand: the server paces one
+multicast stream and receivers report over TCP how many symbols each
+incomplete block still needs.
+
+Packet (UDP payload):
+    +-------+-------------+----------+------------+---------+----------+
+    | 'HF'  | transfer id | block    | symbol id  | K       | symbol   |
+    | 2 B   | u32         | u32      | u32        | u16     | S bytes  |
+    +-------+-------------+----------+------------+---------+----------+
+"""
+import hashlib
+import os
+import socket
+import struct
+import time
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+SYMBOL_SIZE = 1024       # Fits one symbol per packet under a 1500 B MTU
+BLOCK_SYMBOLS = 256      # Source symbols per block (K); decoding cost grows with K^2
+PACKET_HEADER = struct.Struct('!2sIIIH')
+PACKET_MAGIC = b'HF'
+
+DEFAULT_GROUP = '239.255.42.99'
+DEFAULT_PORT = 5007
+
+
+def repair_coefficients(transfer_id, block, symbol_id, k):
+    """Source symbols combined into repair symbol symbol_id (bool array of length k)"""
+    rng = np.random.default_rng((transfer_id, block, symbol_id))
+    coefficients = rng.integers(0, 2, k, dtype=np.uint8).astype(bool)
+    if not coefficients.any():
+        coefficients[rng.integers(0, k)] = True
+    return coefficients
+
+
+def _mask_from_bools(coefficients):
+    return int.from_bytes(np.packbits(coefficients, bitorder='little').tobytes(), 'little')
+
+
+def _bits(mask, k):
+    """Indices of the set bits of mask"""
+    raw = np.frombuffer(mask.to_bytes((k + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little')[:k])
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FountainEncoder:
+    """Produces source and repair packets for one file"""
+
+    def __init__(self, path, transfer_id, symbol_size=SYMBOL_SIZE, block_symbols=BLOCK_SYMBOLS):
+        self.path = path
+        self.transfer_id = transfer_id
+        self.symbol_size = symbol_size
+        self.block_symbols = block_symbols
+        self.file_size = os.path.getsize(path)
+        self.symbols = max(1, -(-self.file_size // symbol_size))
+        self.blocks = -(-self.symbols // block_symbols)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r') if self.file_size else np.zeros(0, np.uint8)
+        self.next_repair = {}
+        self._cache = (None, None)
+
+    def describe(self):
+        """Transfer parameters announced to receivers over TCP"""
+        return {
+            'transfer': self.transfer_id,
+            'name': os.path.basename(self.path),
+            'size': self.file_size,
+            'symbol_size': self.symbol_size,
+            'block_symbols': self.block_symbols,
+            'blocks': self.blocks,
+            'sha256': file_digest(self.path),
+        }
+
+    def block_size(self, block):
+        """Number of source symbols (K) in a block; only the last one may be short"""
+        return min(self.block_symbols, self.symbols - block * self.block_symbols)
+
+    def source_block(self, block):
+        """Source symbols of a block as a (K, symbol_size) array, zero padded"""
+        if self._cache[0] == block:
+            return self._cache[1]
+        k = self.block_size(block)
+        start = block * self.block_symbols * self.symbol_size
+        raw = self.data[start:start + k * self.symbol_size]
+        symbols = np.zeros((k, self.symbol_size), dtype=np.uint8)
+        symbols.reshape(-1)[:len(raw)] = raw
+        self._cache = (block, symbols)
+        return symbols
+
+    def packet(self, block, symbol_id):
+        k = self.block_size(block)
+        source = self.source_block(block)
+        if symbol_id < k:
+            symbol = source[symbol_id]
+        else:
+            symbol = np.bitwise_xor.reduce(source[repair_coefficients(self.transfer_id, block, symbol_id, k)], axis=0)
+        return PACKET_HEADER.pack(PACKET_MAGIC, self.transfer_id, block, symbol_id, k) + symbol.tobytes()
+
+    def source_packets(self, block):
+        return [self.packet(block, i) for i in range(self.block_size(block))]
+
+    def repair_packets(self, block, count):
+        """count fresh repair packets for a block (never repeats a symbol id)"""
+        first = self.next_repair.get(block, self.block_size(block))
+        self.next_repair[block] = first + count
+        return [self.packet(block, symbol_id) for symbol_id in range(first, first + count)]
+
+    def close(self):
+        self._cache = (None, None)
+        self.data = None
+
+
+class BlockDecoder:
+    """
+    Incremental GF(2) elimination for one block
+
+    Rows are kept as (bitmask, symbol) pivots keyed by their lowest set bit;
+    symbols already known are subtracted in one vectorised XOR. Once the rank
+    reaches K, back substitution solves the remaining pivots.
+    """
+
+    def __init__(self, k, symbol_size):
+        self.k = k
+        self.symbol_size = symbol_size
+        self.solved = np.zeros((k, symbol_size), dtype=np.uint8)
+        self.solved_mask = 0
+        self.pivots = {}
+        self.complete = False
+        self.received = 0
+
+    def rank(self):
+        return bin(self.solved_mask).count('1') + len(self.pivots)
+
+    def needed(self):
+        return 0 if self.complete else self.k - self.rank()
+
+    def _subtract_solved(self, mask, data):
+        known = mask & self.solved_mask
+        if known:
+            data ^= np.bitwise_xor.reduce(self.solved[_bits(known, self.k)], axis=0)
+            mask ^= known
+        return mask
+
+    def add(self, symbol_id, symbol, transfer_id, block):
+        """Add one received symbol; returns True when the block became decodable"""
+        if self.complete:
+            return False
+        self.received += 1
+        if symbol_id < self.k:
+            mask = 1 << symbol_id
+        else:
+            mask = _mask_from_bools(repair_coefficients(transfer_id, block, symbol_id, self.k))
+        data = np.frombuffer(symbol, dtype=np.uint8).copy()
+
+        mask = self._subtract_solved(mask, data)
+        while mask:
+            low = (mask & -mask).bit_length() - 1
+            pivot = self.pivots.get(low)
+            if pivot is None:
+                break
+            mask ^= pivot[0]
+            np.bitwise_xor(data, pivot[1], out=data)
+            mask = self._subtract_solved(mask, data)
+        if not mask:
+            return False  # Linearly dependent on what we have
+
+        low = (mask & -mask).bit_length() - 1
+        if mask & (mask - 1) == 0:
+            self.solved[low] = data
+            self.solved_mask |= mask
+        else:
+            self.pivots[low] = (mask, data)
+
+        if self.rank() == self.k:
+            self._back_substitute()
+            return True
+        return False
+
+    def _back_substitute(self):
+        # Every higher bit of a pivot is solved by the time we reach it
+        for low in sorted(self.pivots, reverse=True):
+            mask, data = self.pivots[low]
+            rest = mask & ~(1 << low)
+            if rest:
+                data ^= np.bitwise_xor.reduce(self.solved[_bits(rest, self.k)], axis=0)
+            self.solved[low] = data
+            self.solved_mask |= 1 << low
+        self.pivots.clear()
+        self.complete = True
+
+
+class FountainDecoder:
+    """Rebuilds a file announced with FountainEncoder.describe() into output_path"""
+
+    def __init__(self, description, output_path):
+        self.description = description
+        self.transfer_id = description['transfer']
+        self.file_size = description['size']
+        self.symbol_size = description['symbol_size']
+        self.block_symbols = description['block_symbols']
+        self.blocks = description['blocks']
+        self.symbols = max(1, -(-self.file_size // self.symbol_size))
+        self.output_path = output_path
+        self.decoders = {}
+        self.done = set()
+        self.packets = 0
+        self.output = open(output_path, 'wb')
+        self.output.truncate(self.file_size)
+
+    def block_size(self, block):
+        return min(self.block_symbols, self.symbols - block * self.block_symbols)
+
+    def add_packet(self, packet):
+        """Feed one UDP payload; returns True when the whole file is decoded"""
+        if len(packet) != PACKET_HEADER.size + self.symbol_size:
+            return self.complete()
+        magic, transfer_id, block, symbol_id, k = PACKET_HEADER.unpack_from(packet)
+        if magic != PACKET_MAGIC or transfer_id != self.transfer_id or block >= self.blocks or block in self.done:
+            return self.complete()
+        self.packets += 1
+        decoder = self.decoders.get(block)
+        if decoder is None:
+            decoder = self.decoders[block] = BlockDecoder(self.block_size(block), self.symbol_size)
+        if decoder.add(symbol_id, memoryview(packet)[PACKET_HEADER.size:], self.transfer_id, block):
+            self._write_block(block, decoder)
+        return self.complete()
+
+    def _write_block(self, block, decoder):
+        offset = block * self.block_symbols * self.symbol_size
+        length = min(decoder.k * self.symbol_size, self.file_size - offset)
+        self.output.seek(offset)
+        self.output.write(decoder.solved.reshape(-1)[:length].tobytes())
+        self.done.add(block)
+        del self.decoders[block]  # Free the block's memory as soon as it is on disk
+
+    def complete(self):
+        return len(self.done) == self.blocks
+
+    def needs(self):
+        """Symbols still needed per incomplete block"""
+        needs = {}
+        for block in range(self.blocks):
+            if block in self.done:
+                continue
+            decoder = self.decoders.get(block)
+            needs[block] = decoder.needed() if decoder else self.block_size(block)
+        return needs
+
+    def close(self):
+        if not self.output.closed:
+            self.output.close()
+
+    def verify(self):
+        """Check the rebuilt file against the announced SHA-256"""
+        self.close()
+        return file_digest(self.output_path) == self.description.get('sha256')
+
+
+def open_multicast_sender(interface=None, ttl=1):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 << 20)
+    if interface and interface != '0.0.0.0':
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    return sock
+
+
+def open_multicast_receiver(group=DEFAULT_GROUP, port=DEFAULT_PORT, interface=None):
+    """UDP socket joined to group on the given local interface address"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sock.bind(('', port))
+    membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface or '0.0.0.0'))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+
+class Pacer:
+    """Keeps a sender at a constant bit rate"""
+
+    def __init__(self, rate_mbps):
+        self.rate = rate_mbps * 1e6 / 8 if rate_mbps else None
+        self.started = time.perf_counter()
+        self.sent = 0
+
+    def wait(self, nbytes):
+        self.sent += nbytes
+        if self.rate:
+            ahead = self.sent / self.rate - (time.perf_counter() - self.started)
+            if ahead > 0.002:
+                time.sleep(ahead)
+
+
+def send_packets(sock, packets, group, port, pacer):
+    """Send packets to the group at the pacer's rate; returns bytes sent"""
+    total = 0
+    for packet in packets:
+        sock.sendto(packet, (group, port))
+        pacer.wait(len(packet))
+        total += len(packet)
+    return total
+
+
+def interleave(per_block):
+    """
+    Packets for several blocks, round-robin across blocks
+
+    per_block maps block -> list of packets. Interleaving spreads a burst
+    of losses over many blocks instead of wiping out one.
+    """
+    lists = [per_block[block] for block in sorted(per_block)]
+    for i in range(max((len(packets) for packets in lists), default=0)):
+        for packets in lists:
+            if i < len(packets):
+                yield packets[i]
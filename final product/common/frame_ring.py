@@ -0,0 +1,215 @@
+"""
+Fixed-capacity ring of frame slots in shared memory
+
+One producer (a capture worker) writes each processed frame in place into
+the next preallocated slot and publishes it under an increasing sequence
+number. Consumers (display, live stream, an external recorder or analyzer
+in another process) read slots by sequence number without copying.
+
+Ownership is tracked with per-slot generation numbers, seqlock style: the
+producer makes a slot's generation odd while writing and even again when
+the frame is published. The producer never waits for readers; a reader
+that held a slot too long sees the generation (or the slot's sequence
+number) change and knows the frame was overwritten.
+
+    reader in place:  frame = ring.get(seq); use(frame); ok = ring.valid(seq)
+    reader, copy:     frame = ring.read(seq, buffer)   # None if overwritten
+
+Layout of the shared block (all int64 / float64, 64-byte aligned data):
+
+    header      magic, capacity, height, width, channels, latest sequence
+    slots       generation, sequence    (one row per slot)
+    timestamps  publish time of each slot
+    data        capacity x height x width x channels uint8
+
+Usage (attach from another process and record what the server captures):
+    python frame_ring.py haps_1234_cam0 --record out.avi --seconds 10
+"""
+import argparse
+import time
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+resource_tracker = lazy_import('multiprocessing.resource_tracker')
+
+MAGIC = 0x48524E47  # 'HRNG'
+HEADER_FIELDS = 8
+SLOT_FIELDS = 2
+DATA_ALIGN = 64
+DEFAULT_CAPACITY = 8
+
+
+def _attach(name):
+    """Open an existing block without letting this process's resource tracker unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+class FrameRing:
+    """
+    Shared ring of equally shaped uint8 frames
+
+    FrameRing(shape, capacity[, name]) creates a ring (and unlinks it on
+    close); FrameRing(name=...) attaches to an existing one.
+    """
+
+    def __init__(self, shape=None, capacity=DEFAULT_CAPACITY, name=None):
+        self.owner = shape is not None
+        if self.owner:
+            shape = tuple(shape)
+            if len(shape) == 2:
+                shape = shape + (1,)
+            size = self._data_offset(capacity) + capacity * int(np.prod(shape))
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.memory = _attach(name)
+        self.name = self.memory.name
+
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.memory.buf)
+        if self.owner:
+            self.header[:6] = (MAGIC, capacity, shape[0], shape[1], shape[2], -1)
+        elif self.header[0] != MAGIC:
+            raise ValueError(f"shared memory {name!r} is not a frame ring")
+        self.capacity = int(self.header[1])
+        self.shape = tuple(int(value) for value in self.header[2:5])
+
+        offset = HEADER_FIELDS * 8
+        self.slots = np.ndarray((self.capacity, SLOT_FIELDS), dtype=np.int64,
+                                buffer=self.memory.buf, offset=offset)
+        self.timestamps = np.ndarray((self.capacity,), dtype=np.float64,
+                                     buffer=self.memory.buf, offset=offset + self.capacity * SLOT_FIELDS * 8)
+        self.frames = np.ndarray((self.capacity,) + self.shape, dtype=np.uint8,
+                                 buffer=self.memory.buf, offset=self._data_offset(self.capacity))
+        if self.owner:
+            self.slots[:, 0] = 0    # generation
+            self.slots[:, 1] = -1   # sequence held by the slot
+        self.next_sequence = int(self.header[5]) + 1
+
+    @staticmethod
+    def _data_offset(capacity):
+        offset = HEADER_FIELDS * 8 + capacity * (SLOT_FIELDS * 8 + 8)
+        return -(-offset // DATA_ALIGN) * DATA_ALIGN
+
+    # Producer side (one producer per ring)
+
+    def claim(self):
+        """Reserve the next slot; returns (sequence, writable frame view)"""
+        sequence = self.next_sequence
+        index = sequence % self.capacity
+        self.slots[index, 0] += 1   # Odd: being written
+        self.slots[index, 1] = sequence
+        return sequence, self.frames[index]
+
+    def publish(self, sequence, timestamp=None):
+        """Make a claimed slot visible to readers"""
+        index = sequence % self.capacity
+        self.timestamps[index] = time.time() if timestamp is None else timestamp
+        self.slots[index, 0] += 1   # Even: stable
+        self.header[5] = sequence
+        self.next_sequence = sequence + 1
+
+    # Consumer side
+
+    def latest(self):
+        """Sequence number of the newest published frame (-1 before the first)"""
+        return int(self.header[5])
+
+    def valid(self, sequence):
+        """True while the slot still holds the published frame sequence"""
+        if sequence < 0:
+            return False
+        index = sequence % self.capacity
+        return self.slots[index, 1] == sequence and self.slots[index, 0] % 2 == 0
+
+    def get(self, sequence):
+        """Read-only view of a published frame, or None if it is gone; check valid() after use"""
+        if not self.valid(sequence):
+            return None
+        view = self.frames[sequence % self.capacity].view()
+        view.flags.writeable = False
+        return view
+
+    def timestamp(self, sequence):
+        return float(self.timestamps[sequence % self.capacity]) if self.valid(sequence) else None
+
+    def read(self, sequence, out):
+        """Copy a published frame into out; None if it was overwritten before or during the copy"""
+        index = sequence % self.capacity
+        generation = self.slots[index, 0]
+        if generation % 2 or self.slots[index, 1] != sequence:
+            return None
+        np.copyto(out, self.frames[index])
+        if self.slots[index, 0] != generation or self.slots[index, 1] != sequence:
+            return None
+        return out
+
+    def wait(self, after, timeout=None, poll=0.002):
+        """Wait for a frame newer than sequence after; returns the newest sequence or None on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sequence = self.latest()
+            if sequence > after:
+                return sequence
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def describe(self):
+        return {'name': self.name, 'capacity': self.capacity, 'shape': list(self.shape),
+                'latest': self.latest()}
+
+    def close(self):
+        self.header = self.slots = self.timestamps = self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def main(argv=None):
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Attach to a frame ring and show or record its frames")
+    parser.add_argument('name', help="shared memory name of the ring (see the server's /status)")
+    parser.add_argument('--record', help="write the frames to this video file")
+    parser.add_argument('--fps', type=float, default=30.0, help="frame rate of the recording")
+    parser.add_argument('--seconds', type=float, default=10.0, help="how long to record")
+    args = parser.parse_args(argv)
+
+    ring = FrameRing(name=args.name)
+    print(f"Ring {ring.name}: {ring.capacity} slots of {ring.shape}, latest frame {ring.latest()}")
+    if not args.record:
+        ring.close()
+        return
+
+    height, width, _ = ring.shape
+    writer = cv2.VideoWriter(args.record, cv2.VideoWriter_fourcc(*'XVID'), args.fps, (width, height))
+    buffer = np.empty(ring.shape, dtype=np.uint8)
+    sequence = ring.latest()
+    written = missed = 0
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        newest = ring.wait(sequence, timeout=1.0)
+        if newest is None:
+            continue
+        # Take every frame still in the ring; anything older was overwritten
+        for wanted in range(max(sequence + 1, newest - ring.capacity + 1), newest + 1):
+            if ring.read(wanted, buffer) is None:
+                missed += 1
+                continue
+            writer.write(buffer)
+            written += 1
+        missed += max(0, newest - ring.capacity - sequence)
+        sequence = newest
+    writer.release()
+    ring.close()
+    print(f"Recorded {written} frames to {args.record} ({missed} missed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Pluggable frame sources for the capture loop
+
+The server reads frames through a FrameSource instead of a hard-wired
+cv2.VideoCapture(0), so it can run from a camera, a recorded video, a
+directory of still images or a synthetic generator (no hardware needed).
+
+Sources are described by short strings:
+
+    camera:0              camera index 0 (a bare integer works too)
+    file:flight.avi       video file (a bare path to a file works too)
+    dir:frames/           image directory, read in name order
+    synthetic:640x480     moving test pattern
+    ...?loop=1&fps=30     options: loop at the end, pace to fps (0 = unthrottled),
+                          frames=N stops a synthetic source after N frames,
+                          pose=telemetry.jsonl replays per-frame poses (see pose.py)
+
+A source may know the camera pose of each frame (source.pose()): the
+synthetic source simulates a nadir camera on a HAPS, a video file
+replays its pose sidecar if it has one, and pose= attaches a recorded
+telemetry log to any source.
+
+Usage:
+    source = open_source("file:flight.avi?loop=1")
+    while True:
+        ok, frame = source.read()
+        if not ok:
+            break
+    source.release()
+"""
+import glob
+import os
+import time
+from urllib.parse import parse_qsl
+
+from lazy import lazy_import
+from pose import DEFAULT_HFOV, POSE_FIELDS, find_sidecar, from_local, ground_width, read_poses
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+SOURCE_KINDS = ('camera', 'file', 'dir', 'synthetic')
+SYNTHETIC_ORIGIN = (48.137, 11.575)  # lat, lon under the first synthetic frame
+SYNTHETIC_ALTITUDE = 20000.0          # metres, a typical HAPS altitude
+
+
+class FrameSource:
+    """
+    Base class: read() returns (ok, frame) like cv2.VideoCapture
+
+    read(out) decodes into a previously returned frame where the source
+    allows it, so a capture loop need not allocate a frame per read.
+    """
+
+    name = "source"
+    live = False  # A failed read of a live device may be transient; for the others it is the end
+
+    def __init__(self, fps=0.0):
+        # fps > 0 paces read() to that rate; 0 returns frames as fast as they come
+        self.fps = fps
+        self.frames_read = 0
+        self.frames_skipped = 0  # Unreadable frames passed over
+        self._next_due = None
+        self.hfov = DEFAULT_HFOV
+        self.poses = None  # Replayed telemetry: {frame number: pose}
+
+    def load_poses(self, path):
+        """Replay the poses of a sidecar or telemetry log, frame by frame (wrapping around)"""
+        camera, self.poses = read_poses(path)
+        self.hfov = camera['hfov']
+
+    def pose(self):
+        """Pose (lat, lon, alt, heading) of the frame read last, or None without telemetry"""
+        if not self.poses or not self.frames_read:
+            return None
+        record = self.poses.get((self.frames_read - 1) % (max(self.poses) + 1))
+        return None if record is None else {key: record[key] for key in POSE_FIELDS}
+
+    def _pace(self):
+        if self.fps <= 0:
+            return
+        now = time.perf_counter()
+        if self._next_due is None:
+            self._next_due = now
+        elif self._next_due > now:
+            time.sleep(self._next_due - now)
+        self._next_due = max(self._next_due, now - 1.0 / self.fps) + 1.0 / self.fps
+
+    def read(self, out=None):
+        self._pace()
+        ok, frame = self._read(out)
+        if ok:
+            self.frames_read += 1
+        return ok, frame
+
+    def _read(self, out):
+        raise NotImplementedError
+
+    def is_opened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def describe(self):
+        return {'name': self.name, 'fps': self.fps, 'frames_read': self.frames_read}
+
+
+class CameraSource(FrameSource):
+    """A local camera; the device itself sets the pace"""
+
+    live = True
+
+    def __init__(self, index=0, fps=0.0):
+        super().__init__(fps)
+        self.name = f"camera:{index}"
+        self.capture = cv2.VideoCapture(index)
+
+    def _read(self, out):
+        return self.capture.read(out) if out is not None else self.capture.read()
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(FrameSource):
+    """A recorded video, optionally looped"""
+
+    def __init__(self, path, loop=False, fps=0.0):
+        super().__init__(fps)
+        self.name = f"file:{path}"
+        self.path = path
+        self.loop = loop
+        self.capture = cv2.VideoCapture(path)
+
+    def _read(self, out):
+        ok, frame = self.capture.read(out) if out is not None else self.capture.read()
+        if not ok and self.loop and self.frames_read:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read(out) if out is not None else self.capture.read()
+        return ok, frame
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """Still images from a directory in name order, optionally looped"""
+
+    def __init__(self, directory, loop=False, fps=0.0):
+        super().__init__(fps)
+        self.name = f"dir:{directory}"
+        self.loop = loop
+        self.paths = sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                            if path.lower().endswith(IMAGE_EXTENSIONS))
+        self.position = 0
+
+    def _read(self, out):
+        while self.paths:
+            if self.position >= len(self.paths):
+                if not self.loop:
+                    return False, None
+                self.position = 0
+            path = self.paths[self.position]
+            self.position += 1
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is not None:
+                return True, frame
+            print(f"Skipping unreadable image: {path}")
+            self.frames_skipped += 1
+            self.paths.remove(path)
+            self.position -= 1
+        return False, None
+
+    def is_opened(self):
+        return bool(self.paths)
+
+
+class SyntheticSource(FrameSource):
+    """
+    Deterministic moving test pattern
+
+    The view pans back and forth across a wide textured scene, so motion
+    gating, the live stream and panorama stitching all have something to
+    work on. pose() gives the exact pose of a nadir camera flying east and
+    west over the scene at SYNTHETIC_ALTITUDE.
+    """
+
+    def __init__(self, width=640, height=480, fps=0.0, seed=0, limit=None):
+        super().__init__(fps)
+        self.name = f"synthetic:{width}x{height}"
+        self.width = width
+        self.height = height
+        self.limit = limit
+        rng = np.random.default_rng(seed)
+        scene = rng.integers(0, 256, (height // 8, width // 2, 3), dtype=np.uint8)
+        scene = cv2.resize(scene, (width * 4, height), interpolation=cv2.INTER_CUBIC)
+        self.scene = cv2.GaussianBlur(scene, (0, 0), 3)
+        self.offset = 0
+
+    def pose(self):
+        if self.poses:
+            return super().pose()
+        metres = ground_width(SYNTHETIC_ALTITUDE, self.hfov) / self.width
+        lat, lon = from_local(self.offset * metres, 0.0, SYNTHETIC_ORIGIN)
+        return {'lat': lat, 'lon': lon, 'alt': SYNTHETIC_ALTITUDE, 'heading': 0.0}
+
+    def _read(self, out):
+        if self.limit is not None and self.frames_read >= self.limit:
+            return False, None
+        span = self.scene.shape[1] - self.width
+        # Bounce back and forth across the scene, 4 px per frame
+        offset = (self.frames_read * 4) % (2 * span)
+        offset = self.offset = offset if offset < span else 2 * span - offset
+        view = self.scene[:, offset:offset + self.width]
+        if out is not None and out.shape == view.shape:
+            np.copyto(out, view)
+            return True, out
+        return True, view.copy()
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def open_source(spec, fps=None, loop=None):
+    """
+    Build a FrameSource from a description string (see module docstring)
+
+    fps and loop override the options given in the string.
+    """
+    spec = str(spec)
+    spec, _, query = spec.partition('?')
+    options = dict(parse_qsl(query))
+    if fps is not None:
+        options['fps'] = fps
+    if loop is not None:
+        options['loop'] = loop
+    rate = float(options.get('fps', 0) or 0)
+    looped = _flag(options.get('loop', False))
+
+    kind, _, target = spec.partition(':')
+    if kind not in SOURCE_KINDS:
+        # Bare forms: an integer is a camera, a directory or file is itself
+        if spec.isdigit():
+            kind, target = 'camera', spec
+        elif os.path.isdir(spec):
+            kind, target = 'dir', spec
+        else:
+            kind, target = 'file', spec
+
+    if kind == 'camera':
+        source = CameraSource(int(target or 0), fps=rate)
+    elif kind == 'file':
+        source = VideoFileSource(target, loop=looped, fps=rate)
+        options.setdefault('pose', find_sidecar(target))
+    elif kind == 'dir':
+        source = ImageDirectorySource(target, loop=looped, fps=rate)
+    elif kind == 'synthetic':
+        width, height = 640, 480
+        if target:
+            width, height = (int(part) for part in target.lower().split('x'))
+        limit = int(options['frames']) if 'frames' in options else None
+        source = SyntheticSource(width, height, fps=rate, seed=int(options.get('seed', 0)), limit=limit)
+    else:
+        raise ValueError(f"unknown frame source {spec!r}")
+    if options.get('pose'):
+        source.load_poses(options['pose'])
+    return source
@@ -0,0 +1,127 @@
+"""
+Disk-backed frame storage for panorama building
+
+Frames extracted from a video are appended to a flat file of fixed-shape
+uint8 frames instead of a Python list, and read back lazily through a
+numpy.memmap, so extracting frames no longer grows memory with the length
+of the video.
+
+Stitching is another matter. cv2.Stitcher copies every input image into
+its own buffers, so its peak memory still grows with the number of
+frames handed to it (choose skip_frames accordingly). StitchingEngine
+reads full-size frames one at a time but keeps a seam-resolution copy of
+each, and GeoMosaic keeps only the mosaic and one warped frame.
+"""
+import os
+import tempfile
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+class FrameStore:
+    """
+    Append-only store of equally sized uint8 frames backed by a file
+
+    Usage:
+        with FrameStore() as store:
+            for frame in frames:
+                store.append(frame)
+            stitcher.stitch(store.frames())
+    """
+
+    def __init__(self, directory=None, frame_shape=None):
+        """
+        Args:
+            directory: Where the backing file is created (default: system temp dir)
+            frame_shape: Shape of every frame; taken from the first frame if None
+        """
+        fd, self.path = tempfile.mkstemp(prefix="frames_", suffix=".u8", dir=directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.frame_shape = tuple(frame_shape) if frame_shape is not None else None
+        self.frame_bytes = int(np.prod(self.frame_shape)) if self.frame_shape else 0
+        self.count = 0
+        self.mapped = None
+        self.mapped_count = 0
+
+    def append(self, frame):
+        """Write a frame to the end of the store"""
+        if self.file is None:
+            raise ValueError("FrameStore is closed")
+        if frame.dtype != np.uint8:
+            raise ValueError(f"Frames must be uint8, got {frame.dtype}")
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+            self.frame_bytes = frame.nbytes
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match store shape {self.frame_shape}")
+
+        # Plain file writes keep the data out of this process's address space
+        self.file.write(np.ascontiguousarray(frame).data)
+        self.count += 1
+
+    def extend(self, frames):
+        """Append every frame from an iterable"""
+        for frame in frames:
+            self.append(frame)
+
+    def _mapping(self):
+        """Return a read-only memmap covering every appended frame"""
+        if self.mapped is None or self.mapped_count != self.count:
+            if self.file is not None:
+                self.file.flush()
+            self.mapped = np.memmap(self.path, dtype=np.uint8, mode='r',
+                                    shape=(self.count,) + tuple(self.frame_shape))
+            self.mapped_count = self.count
+        return self.mapped
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("frame index out of range")
+        return self._mapping()[index]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def frames(self):
+        """Return the frames as a list of lazily paged-in memmap views"""
+        if self.count == 0:
+            return []
+        mapping = self._mapping()
+        return [mapping[index] for index in range(self.count)]
+
+    def nbytes(self):
+        """Size of the stored frames on disk"""
+        return self.count * self.frame_bytes
+
+    def close(self):
+        """Release the mapping and delete the backing file"""
+        self.mapped = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Windows keeps the file locked while a view is still alive
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, 'path'):
+            self.close()
@@ -0,0 +1,347 @@
+"""
+Binary framing layer shared by the server, client and tools
+
+Every message on a connection is one frame:
+
+    +------+-------+------------------+----------------+-----------------+
+    | type | flags | stream id        | payload length | payload         |
+    | 1 B  | 1 B   | varint (1-10 B)  | varint         | length bytes    |
+    +------+-------+------------------+----------------+-----------------+
+
+Varints are unsigned LEB128. Stream 0 carries control traffic (PING, PONG,
+QUIT, HELLO); every file transfer, live stream or model update gets its own
+stream id so many logical streams can share one TCP connection. Frames are
+written atomically under a per-connection lock, which keeps the server's
+ping thread from interleaving bytes into a file transfer.
+
+Reads go through a reusable receive buffer filled with recv_into; large
+payloads can be read straight into the caller's memoryview without an
+intermediate bytes object.
+
+Once HELLO has negotiated a codec (see compression.py), payloads sent with
+compress=True are compressed when it pays and carry FLAG_COMPRESSED.
+"""
+import socket
+import struct
+import threading
+
+# Control messages (stream 0)
+MSG_HELLO = 0x01
+MSG_PING = 0x02
+MSG_PONG = 0x03
+MSG_QUIT = 0x04
+
+# File transfer (one stream per file)
+MSG_FILE_BEGIN = 0x10   # payload: !Q file size + UTF-8 file name
+MSG_FILE_CHUNK = 0x11   # payload: next bytes of the file
+MSG_FILE_END = 0x12     # payload: empty
+MSG_FILE_ERROR = 0x13   # payload: UTF-8 reason
+
+# Multicast broadcast (see fountain.py)
+MSG_BROADCAST_BEGIN = 0x14   # server -> client, JSON transfer description + group/port
+MSG_BROADCAST_STATUS = 0x15  # client -> server, JSON decode progress / completion
+
+# Media and learning streams
+MSG_FRAME = 0x20
+MSG_MODEL_UPDATE = 0x30
+
+MESSAGE_NAMES = {
+    MSG_HELLO: 'HELLO', MSG_PING: 'PING', MSG_PONG: 'PONG', MSG_QUIT: 'QUIT',
+    MSG_FILE_BEGIN: 'FILE_BEGIN', MSG_FILE_CHUNK: 'FILE_CHUNK', MSG_FILE_END: 'FILE_END',
+    MSG_FILE_ERROR: 'FILE_ERROR', MSG_BROADCAST_BEGIN: 'BROADCAST_BEGIN',
+    MSG_BROADCAST_STATUS: 'BROADCAST_STATUS', MSG_FRAME: 'FRAME', MSG_MODEL_UPDATE: 'MODEL_UPDATE',
+}
+
+# Flag bits
+FLAG_COMPRESSED = 0x01
+
+CONTROL_STREAM = 0
+MAX_HEADER_SIZE = 2 + 10 + 10
+MAX_PAYLOAD_SIZE = 1 << 30
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+FILE_BEGIN_STRUCT = struct.Struct('!Q')
+
+
+def encode_varint(value):
+    """Encode a non-negative integer as unsigned LEB128"""
+    if value < 0:
+        raise ValueError("varint must be non-negative")
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(buffer, offset):
+    """Decode a varint from buffer at offset; returns (value, new offset) or None if incomplete"""
+    value = 0
+    shift = 0
+    end = len(buffer)
+    while offset < end:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+        if shift > 63:
+            raise ProtocolError("varint too long")
+    return None
+
+
+def encode_header(msg_type, length, stream_id=CONTROL_STREAM, flags=0):
+    """Build the frame header for a payload of the given length"""
+    return bytes((msg_type, flags)) + encode_varint(stream_id) + encode_varint(length)
+
+
+def encode_frame(msg_type, payload=b'', stream_id=CONTROL_STREAM, flags=0):
+    """Build a complete frame (header + payload) as bytes"""
+    return encode_header(msg_type, len(payload), stream_id, flags) + bytes(payload)
+
+
+def encode_file_begin(file_size, file_name):
+    return FILE_BEGIN_STRUCT.pack(file_size) + file_name.encode('utf-8')
+
+
+def decode_file_begin(payload):
+    """Return (file size, file name) from a FILE_BEGIN payload"""
+    file_size = FILE_BEGIN_STRUCT.unpack_from(payload)[0]
+    return file_size, bytes(payload[FILE_BEGIN_STRUCT.size:]).decode('utf-8')
+
+
+class ProtocolError(Exception):
+    """The peer sent something that is not a valid frame"""
+
+
+def recv_exact_into(sock, view):
+    """Fill the whole memoryview from the socket; raises ConnectionError on EOF"""
+    received = 0
+    total = len(view)
+    while received < total:
+        count = sock.recv_into(view[received:], total - received)
+        if count == 0:
+            raise ConnectionError("connection closed by peer")
+        received += count
+    return total
+
+
+def recv_exact(sock, size):
+    """Read exactly size bytes from the socket"""
+    data = bytearray(size)
+    recv_exact_into(sock, memoryview(data))
+    return data
+
+
+class FrameHeader:
+    __slots__ = ('msg_type', 'flags', 'stream_id', 'length')
+
+    def __init__(self, msg_type, flags, stream_id, length):
+        self.msg_type = msg_type
+        self.flags = flags
+        self.stream_id = stream_id
+        self.length = length
+
+    @property
+    def name(self):
+        return MESSAGE_NAMES.get(self.msg_type, f"0x{self.msg_type:02x}")
+
+    def __repr__(self):
+        return f"FrameHeader({self.name}, flags={self.flags}, stream={self.stream_id}, length={self.length})"
+
+
+class FramedConnection:
+    """
+    A socket speaking the framing protocol
+
+    Sending is thread-safe: each frame is written whole under a lock, so
+    several threads (ping loop, file sender, live stream) can share the
+    connection. Receiving is meant for a single reader thread.
+    """
+
+    def __init__(self, sock, buffer_size=256 * 1024):
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.next_stream = 1
+        self.stream_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.codec = None  # Set once HELLO has negotiated compression
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def new_stream_id(self):
+        """Allocate a stream id for a new logical stream from this side"""
+        with self.stream_lock:
+            stream_id = self.next_stream
+            self.next_stream += 1
+            return stream_id
+
+    # --- sending -------------------------------------------------------
+
+    def send_frame(self, msg_type, payload=b'', stream_id=CONTROL_STREAM, flags=0, compress=False):
+        """
+        Send one frame; payload may be bytes, bytearray or memoryview
+
+        With compress=True the payload is compressed with the negotiated
+        codec when that saves bytes.
+        """
+        if compress and self.codec is not None:
+            payload, compressed = self.codec.maybe_compress(bytes(payload))
+            if compressed:
+                flags |= FLAG_COMPRESSED
+        header = encode_header(msg_type, len(payload), stream_id, flags)
+        with self.send_lock:
+            if len(payload) <= 64 * 1024:
+                self.sock.sendall(header + bytes(payload))
+            else:
+                self.sock.sendall(header)
+                self.sock.sendall(payload)
+            self.bytes_sent += len(header) + len(payload)
+
+    def send_file_chunk(self, msg_type, stream_id, file, offset, count, flags=0):
+        """Send count bytes of an open file as one frame using sendfile (zero-copy where supported)"""
+        header = encode_header(msg_type, count, stream_id, flags)
+        with self.send_lock:
+            self.sock.sendall(header)
+            sent = self.sock.sendfile(file, offset, count)
+            if sent != count:
+                raise ConnectionError(f"short sendfile: {sent} of {count} bytes")
+            self.bytes_sent += len(header) + count
+
+    # --- receiving -----------------------------------------------------
+
+    def buffered(self):
+        """Number of received bytes not consumed yet"""
+        return self.end - self.start
+
+    def _fill(self, minimum):
+        """Ensure at least minimum unconsumed bytes are buffered"""
+        available = self.end - self.start
+        if available >= minimum:
+            return
+        if available == 0:
+            self.start = self.end = 0
+        elif len(self.buffer) - self.start < minimum:
+            # Compact: move unconsumed bytes to the front
+            self.buffer[:available] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, available
+        while self.end - self.start < minimum:
+            count = self.sock.recv_into(self.view[self.end:])
+            if count == 0:
+                raise ConnectionError("connection closed by peer")
+            self.end += count
+            self.bytes_received += count
+
+    def read_header(self):
+        """Block until a full frame header has arrived and return it"""
+        self._fill(2)
+        while True:
+            parsed = self._parse_header()
+            if parsed is not None:
+                return parsed
+            self._fill(min(self.end - self.start + 1, MAX_HEADER_SIZE))
+
+    def _parse_header(self):
+        buffer = self.view[:self.end]
+        offset = self.start
+        if self.end - offset < 2:
+            return None
+        msg_type = buffer[offset]
+        flags = buffer[offset + 1]
+        stream = decode_varint(buffer, offset + 2)
+        if stream is None:
+            return None
+        stream_id, offset = stream
+        length = decode_varint(buffer, offset)
+        if length is None:
+            return None
+        length, offset = length
+        if length > MAX_PAYLOAD_SIZE:
+            raise ProtocolError(f"frame too large: {length} bytes")
+        self.start = offset
+        return FrameHeader(msg_type, flags, stream_id, length)
+
+    def read_payload_into(self, view):
+        """Read the next len(view) payload bytes into view (buffered bytes first, then recv_into)"""
+        size = len(view)
+        buffered = min(size, self.end - self.start)
+        if buffered:
+            view[:buffered] = self.view[self.start:self.start + buffered]
+            self.start += buffered
+        if buffered < size:
+            recv_exact_into(self.sock, view[buffered:])
+            self.bytes_received += size - buffered
+        return size
+
+    def read_payload(self, length):
+        """Read a whole payload and return it as bytes"""
+        if length <= len(self.buffer):
+            self._fill(length)
+            data = bytes(self.view[self.start:self.start + length])
+            self.start += length
+            return data
+        data = bytearray(length)
+        self.read_payload_into(memoryview(data))
+        return bytes(data)
+
+    def skip_payload(self, length):
+        """Discard a payload without keeping it"""
+        while length:
+            self._fill(1)
+            step = min(length, self.end - self.start)
+            self.start += step
+            length -= step
+
+    def decode_payload(self, header, payload):
+        """Undo compression of a payload read for header"""
+        if header.flags & FLAG_COMPRESSED:
+            if self.codec is None:
+                raise ProtocolError("compressed frame before compression was negotiated")
+            return self.codec.decompress(payload)
+        return payload
+
+    def recv_frame(self):
+        """Read one whole frame; returns (header, payload bytes), decompressed"""
+        header = self.read_header()
+        return header, self.decode_payload(header, self.read_payload(header.length))
+
+
+async def read_frame_async(reader):
+    """Read one frame from an asyncio StreamReader; returns (header, payload)"""
+    prefix = await reader.readexactly(2)
+    values = []
+    for _ in range(2):
+        value = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift > 63:
+                raise ProtocolError("varint too long")
+        values.append(value)
+    stream_id, length = values
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"frame too large: {length} bytes")
+    payload = await reader.readexactly(length) if length else b''
+    return FrameHeader(prefix[0], prefix[1], stream_id, length), payload
@@ -0,0 +1,251 @@
+"""
+Pose-seeded mosaicking of nadir video frames
+
+Feature-based stitching estimates every frame's transform from image
+content alone: all frames are matched against each other, which grows
+quadratically with their number, and low-texture terrain (water, sand,
+cloud tops) fails with ERR_HOMOGRAPHY_EST_FAIL. With per-frame telemetry
+(see pose.py) each frame's place on the ground is already known:
+
+    GPS -> position, altitude + field of view -> scale, heading -> rotation
+
+GeoMosaic places every frame with that similarity transform. With refine
+on, the transform is then corrected by matching the frame against its
+predecessor only, and only between features within REFINE_WINDOW pixels
+of where the pose puts them; frames without enough such matches keep the
+pose prediction. Refined placements are pulled towards the pose
+(POSE_WEIGHT), so small registration errors do not add up along a long
+pass. Registration and compositing are therefore linear in the number of
+frames, and the mosaic comes out north-up with a known georeference.
+
+Usage:
+    camera, poses = read_poses(sidecar_path("flight.avi"))
+    mosaic = GeoMosaic([poses[n] for n in frame_numbers], hfov=camera['hfov'])
+    status, panorama = mosaic.stitch(frames)   # same contract as cv2.Stitcher
+    mosaic.georeference                        # corner coordinates, metres per pixel
+
+    python geo_mosaic.py flight.avi --skip-frames 5 --output pano.jpg
+"""
+import argparse
+import json
+import os
+import time
+
+from lazy import lazy_import
+from pose import DEFAULT_HFOV, ground_width, to_local, from_local
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+REFINE_WINDOW = 24        # pixels a refined feature may sit from its pose prediction
+REFINE_FEATURES = 1000    # ORB features per frame
+MIN_INLIERS = 12          # matches a refinement needs to be trusted over the pose
+POSE_WEIGHT = 0.2         # pull of the pose on each refined placement; bounds the drift of chaining
+MAX_MOSAIC_PIXELS = 400e6  # guards against bogus altitudes or fields of view
+
+
+def _homogeneous(matrix):
+    return np.vstack([matrix, [0.0, 0.0, 1.0]])
+
+
+class GeoMosaic:
+    """Mosaics frames placed by their poses, optionally refined against the previous frame"""
+
+    name = 'geo'
+
+    def __init__(self, poses, hfov=DEFAULT_HFOV, refine=True, window=REFINE_WINDOW):
+        self.poses = list(poses)
+        self.hfov = hfov
+        self.refine = refine
+        self.window = window
+        self.timings = {}
+        self.frames_used = 0
+        self.frames_refined = 0
+        self.georeference = None
+
+    def predicted_transforms(self, size):
+        """
+        2x3 transforms from each image of size (width, height) into mosaic pixels
+
+        Returns (transforms, metres per mosaic pixel). Mosaic pixel (0, 0)
+        is the ground point below the first pose; x runs east, y south.
+        """
+        width, height = size
+        local = to_local(self.poses)
+        gsd = [ground_width(pose['alt'], self.hfov) / width for pose in self.poses]
+        resolution = float(np.median(gsd))
+        transforms = []
+        for (east, north), pose, metres in zip(local, self.poses, gsd):
+            heading = np.radians(pose['heading'])
+            scale = metres / resolution
+            cos, sin = scale * np.cos(heading), scale * np.sin(heading)
+            # Image centre lands on the pose's ground point; up points along the heading
+            cx, cy = (width - 1) / 2.0, (height - 1) / 2.0
+            tx = east / resolution - (cos * cx - sin * cy)
+            ty = -north / resolution - (sin * cx + cos * cy)
+            transforms.append(np.array([[cos, -sin, tx], [sin, cos, ty]]))
+        return transforms, resolution
+
+    def _features(self, detector, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return detector.detectAndCompute(gray, None)
+
+    def _refine(self, previous, current, relative):
+        """
+        Relative transform current -> previous image, or None to keep the pose
+
+        Only matches landing within the window around the pose-predicted
+        position count, so repetitive texture elsewhere cannot pull the
+        frame away from where the telemetry says it is.
+        """
+        (points_a, descriptors_a), (points_b, descriptors_b) = previous, current
+        if descriptors_a is None or descriptors_b is None or len(points_a) < MIN_INLIERS \
+                or len(points_b) < MIN_INLIERS:
+            return None
+        matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors_b, descriptors_a)
+        if len(matches) < MIN_INLIERS:
+            return None
+        source = np.float32([points_b[m.queryIdx].pt for m in matches])
+        target = np.float32([points_a[m.trainIdx].pt for m in matches])
+        predicted = source @ relative[:, :2].T + relative[:, 2]
+        close = np.linalg.norm(predicted - target, axis=1) <= self.window
+        if close.sum() < MIN_INLIERS:
+            return None
+        estimate, inliers = cv2.estimateAffinePartial2D(source[close], target[close], method=cv2.RANSAC,
+                                                        ransacReprojThreshold=3.0)
+        if estimate is None or inliers.sum() < MIN_INLIERS:
+            return None
+        return estimate
+
+    def register(self, images):
+        """Final 2x3 transform per image: the pose prediction, refined where the images agree"""
+        height, width = images[0].shape[:2]
+        transforms, resolution = self.predicted_transforms((width, height))
+        self.frames_refined = 0
+        if not self.refine:
+            return transforms, resolution
+        detector = cv2.ORB.create(REFINE_FEATURES)
+        placed = [transforms[0]]
+        previous = self._features(detector, images[0])
+        for index in range(1, len(images)):
+            current = self._features(detector, images[index])
+            # Pose-predicted mapping from this image into the previous one
+            relative = (np.linalg.inv(_homogeneous(transforms[index - 1])) @ _homogeneous(transforms[index]))[:2]
+            refined = self._refine(previous, current, relative)
+            if refined is None:
+                # Keep the previous frame's correction, move as the poses say
+                placed.append((_homogeneous(placed[-1]) @ _homogeneous(relative))[:2])
+            else:
+                chained = (_homogeneous(placed[-1]) @ _homogeneous(refined))[:2]
+                placed.append((1 - POSE_WEIGHT) * chained + POSE_WEIGHT * transforms[index])
+                self.frames_refined += 1
+            previous = current
+        return placed, resolution
+
+    def stitch(self, images):
+        """Mosaic BGR images (one per pose); returns (status, panorama) like cv2.Stitcher.stitch"""
+        self.timings = {}
+        self.frames_used = 0
+        self.georeference = None
+        started = time.perf_counter()
+        images = list(images)
+        if len(images) < 2 or len(images) != len(self.poses):
+            return cv2.Stitcher_ERR_NEED_MORE_IMGS, None
+        height, width = images[0].shape[:2]
+        transforms, resolution = self.register(images)
+        now = time.perf_counter()
+        self.timings['registration'] = now - started
+        started = now
+
+        # Mosaic bounds from the transformed image corners
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        placed = [corners @ transform[:, :2].T + transform[:, 2] for transform in transforms]
+        x_min, y_min = np.floor(np.min([points.min(axis=0) for points in placed], axis=0)).astype(int)
+        x_max, y_max = np.ceil(np.max([points.max(axis=0) for points in placed], axis=0)).astype(int)
+        mosaic_width, mosaic_height = int(x_max - x_min), int(y_max - y_min)
+        if mosaic_width * mosaic_height > MAX_MOSAIC_PIXELS:
+            raise ValueError(f"mosaic would be {mosaic_width}x{mosaic_height} pixels; "
+                             f"check the altitude and field of view in the poses")
+
+        # Feather-weighted accumulation, one frame-sized window of the mosaic at a time
+        border = np.zeros((height, width), np.uint8)
+        border[1:-1, 1:-1] = 1
+        weight = cv2.distanceTransform(border, cv2.DIST_L2, 3).astype(np.float32)
+        total = np.zeros((mosaic_height, mosaic_width, 3), np.float32)
+        weights = np.zeros((mosaic_height, mosaic_width), np.float32)
+        for image, transform, points in zip(images, transforms, placed):
+            x0, y0 = np.floor(points.min(axis=0)).astype(int) - (x_min, y_min)
+            x1, y1 = np.ceil(points.max(axis=0)).astype(int) - (x_min, y_min)
+            shifted = transform.copy()
+            shifted[:, 2] -= (x_min + x0, y_min + y0)
+            size = (int(x1 - x0), int(y1 - y0))
+            warped = cv2.warpAffine(image, shifted, size, flags=cv2.INTER_LINEAR)
+            warped_weight = cv2.warpAffine(weight, shifted, size, flags=cv2.INTER_LINEAR)
+            total[y0:y1, x0:x1] += warped * warped_weight[..., None]
+            weights[y0:y1, x0:x1] += warped_weight
+        covered = weights > 0
+        total[covered] /= weights[covered][:, None]
+        panorama = cv2.convertScaleAbs(total)
+        self._georeference(resolution, x_min, y_min, mosaic_width, mosaic_height)
+        self.frames_used = len(images)
+        self.timings['compositing'] = time.perf_counter() - started
+        return cv2.Stitcher_OK, panorama
+
+    def _georeference(self, resolution, x_min, y_min, width, height):
+        """Corner coordinates of the mosaic; the first frame is placed by its pose alone, so it anchors them"""
+        origin = (self.poses[0]['lat'], self.poses[0]['lon'])
+
+        def corner(x, y):
+            return list(from_local((x + x_min) * resolution, -(y + y_min) * resolution, origin))
+
+        self.georeference = {
+            'crs': 'WGS84',
+            'north_up': True,
+            'metres_per_pixel': resolution,
+            'width': width,
+            'height': height,
+            'corners': {
+                'top_left': corner(0, 0),
+                'top_right': corner(width, 0),
+                'bottom_right': corner(width, height),
+                'bottom_left': corner(0, height),
+            },
+            'frames': len(self.poses),
+            'frames_refined': self.frames_refined,
+        }
+
+
+def write_georeference(georeference, image_path):
+    """Write georeference as <image>.geo.json next to an image; returns the path"""
+    path = os.path.splitext(image_path)[0] + '.geo.json'
+    with open(path, 'w') as f:
+        json.dump(georeference, f, indent=2)
+    return path
+
+
+def main(argv=None):
+    import sys
+    from panorama_pipeline import panorama_from_video
+    from pose import find_sidecar
+
+    parser = argparse.ArgumentParser(description="Mosaic a video using its pose sidecar")
+    parser.add_argument('video', help="input video with a <video>.pose.jsonl sidecar")
+    parser.add_argument('--skip-frames', type=int, default=5, help="use every Nth frame (default: 5)")
+    parser.add_argument('--output', default='mosaic.jpg', help="mosaic image to write")
+    args = parser.parse_args(argv)
+    if find_sidecar(args.video) is None:
+        sys.exit(f"No pose sidecar for {args.video}")
+
+    report = {}
+    started = time.perf_counter()
+    panorama, mode = panorama_from_video(args.video, args.skip_frames, None, modes=(), report=report)
+    if panorama is None:
+        sys.exit(f"Mosaicking failed: {report['error']}")
+    cv2.imwrite(args.output, panorama)
+    write_georeference(report['georeference'], args.output)
+    print(f"{mode}: {report['frames_extracted']} frames, {panorama.shape[1]}x{panorama.shape[0]} "
+          f"in {time.perf_counter() - started:.2f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
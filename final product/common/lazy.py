@@ -0,0 +1,74 @@
+"""
+Deferred imports and background pre-warming for fast start
+
+OpenCV and NumPy take most of the start-up time of the client and server,
+yet the first thing either does is open a socket. Modules bind heavy
+dependencies lazily instead:
+
+    cv2 = lazy_import('cv2')
+    np = lazy_import('numpy')
+
+The real import happens on first attribute access (cv2.imread, np.uint8)
+from whichever thread gets there first. Once a process knows what it will
+need, prewarm() pays for it on a background thread while the foreground
+is busy connecting or listening:
+
+    prewarm('cv2', 'numpy', lambda: cv2.Stitcher_create())
+"""
+import importlib
+import sys
+import threading
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attribute):
+        value = getattr(self._lazy_load(), attribute)
+        # Later lookups of this attribute no longer go through __getattr__
+        setattr(self, attribute, value)
+        return value
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module {self._lazy_name!r} ({state})>"
+
+
+def lazy_import(name):
+    """Return a LazyModule for name, or the module itself if it is already imported"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+
+def prewarm(*steps, name="prewarm"):
+    """
+    Run warm-up steps on a daemon thread and return the thread
+
+    A step is a module name to import or a callable. Failures are reported
+    and skipped: whatever was not warmed up is simply loaded on first use.
+    """
+    def run():
+        for step in steps:
+            try:
+                if isinstance(step, str):
+                    importlib.import_module(step)
+                else:
+                    step()
+            except Exception as e:
+                print(f"Pre-warm step {getattr(step, '__name__', step)} failed: {e}")
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
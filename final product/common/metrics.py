@@ -0,0 +1,361 @@
+"""
+Lightweight in-process metrics for the capture, transfer and panorama paths
+
+Latency histograms, counters and gauges are kept in memory and exposed in
+the Prometheus text format over a local HTTP endpoint, plus an optional
+periodic JSON dump. Recording a sample is a perf_counter call, a bisect
+and a locked increment, so instrumentation can stay on in the hot loop.
+
+Usage:
+    from metrics import STAGE_SECONDS, timed, start_metrics_server
+
+    with timed('compress'):
+        compressed = compress(frame)
+
+    start_metrics_server(9100)   # curl http://127.0.0.1:9100/metrics
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds; tuned for per-frame work (sub-ms) up to file transfers
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    """Label value escaped as the Prometheus text format requires"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    """Base class for a metric family with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *values):
+        """Return the child metric for the given label values"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self.children[values] = child
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+    def snapshot(self):
+        return {",".join(values) or "": child.snapshot() for values, child in self.children.items()}
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {self.value}"]
+
+    def snapshot(self):
+        return self.value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (frames dropped, bytes sent, ...)"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeValue:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time (e.g. a queue size)"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return 0
+        return self.value
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {self.get()}"]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Gauge(_Metric):
+    """Value that can go up and down (queue depths, connected clients, ...)"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager that observes the elapsed time of its block"""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """Estimate a quantile from the bucket counts (upper bucket bound)"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def render(self, name, labelnames, values):
+        with self.lock:
+            counts = list(self.counts)
+            total_sum, total = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, ('le', bound))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labelnames, values, ('le', '+Inf'))} {total}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {total_sum}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {total}")
+        return lines
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    """Latency distribution with fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+class MetricsRegistry:
+    """Collection of metric families rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return every metric as a JSON-serialisable dict"""
+        return {
+            'timestamp': time.time(),
+            'metrics': {name: metric.snapshot() for name, metric in list(self.metrics.items())},
+        }
+
+
+REGISTRY = MetricsRegistry()
+
+# Shared metric families used by the server, client and tools
+STAGE_SECONDS = REGISTRY.histogram(
+    "haps_stage_seconds", "Time spent in each pipeline stage",
+    ("stage",))
+FRAMES_DROPPED = REGISTRY.counter(
+    "haps_frames_dropped_total", "Frames dropped by the capture or playback loop",
+    ("where",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "haps_queue_depth", "Items waiting in internal queues",
+    ("queue",))
+CLIENT_BYTES = REGISTRY.counter(
+    "haps_client_bytes_total", "Bytes transferred per client and direction",
+    ("client", "direction"))
+
+_stage_children = {}
+
+
+def timed(stage):
+    """Time a block into haps_stage_seconds{stage=...}"""
+    child = _stage_children.get(stage)
+    if child is None:
+        child = _stage_children[stage] = STAGE_SECONDS.labels(stage)
+    return _Timer(child)
+
+
+def _metrics_handler(registry):
+    """Request handler class serving registry (http.server is only imported when serving)"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body = json.dumps(registry.snapshot(), indent=2).encode('utf-8')
+                content_type = "application/json"
+            elif self.path.startswith("/metrics") or self.path == "/":
+                body = registry.render_prometheus().encode('utf-8')
+                content_type = "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the console
+
+    return MetricsHandler
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _metrics_handler(registry))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
+
+
+def start_json_dump(path, interval=10.0, registry=REGISTRY):
+    """Write a JSON snapshot to path every interval seconds from a daemon thread"""
+    stop_event = threading.Event()
+
+    def dump_loop():
+        while not stop_event.wait(interval):
+            dump_json(path, registry)
+
+    thread = threading.Thread(target=dump_loop, name="metrics-dump", daemon=True)
+    thread.start()
+    return stop_event
+
+
+def dump_json(path, registry=REGISTRY):
+    """Atomically write a JSON snapshot of the registry to path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,128 @@
+"""
+Process-pool offload of the server's CPU-heavy work
+
+JPEG encoding, per-frame analysis and zipping run in worker processes, so
+they no longer compete with the capture, transfer and client threads for
+the GIL. Frames are not pickled: each VideoProcessor owns a SharedFrameSlab
+(a block of shared memory holding its input frame and encoder reference);
+tasks carry only the slab name, slot numbers and tile rectangles, and
+workers read and write the slots in place.
+
+Usage:
+    pool = OffloadPool(workers=4)
+    slab = SharedFrameSlab((480, 640, 3), slots=2)
+    slab.frame(0)[:] = frame
+    brightness, detect = pool.analyze(slab, 0)
+    encoded_bytes = pool.encode(slab, 0, 1, [(0, 0, 640, 480, 50)])
+    ...
+    slab.close(); pool.shutdown()
+"""
+import os
+
+from compression import is_compressible
+from lazy import lazy_import
+from tiles import frame_features, encode_rects
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+zipfile = lazy_import('zipfile')
+futures = lazy_import('concurrent.futures')
+multiprocessing = lazy_import('multiprocessing')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+
+
+class SharedFrameSlab:
+    """
+    Fixed number of equally shaped uint8 frames in one shared memory block
+
+    The creating process owns the block and unlinks it on close(); worker
+    processes attach by name.
+    """
+
+    def __init__(self, shape, slots=2, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape))
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.frame_bytes * slots)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.array = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.memory.buf)
+
+    def frame(self, index):
+        """Writable view of one slot"""
+        return self.array[index]
+
+    def close(self):
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Worker side: slabs attached so far, by name
+_attached = {}
+
+
+def _slab(name, shape, slots):
+    slab = _attached.get(name)
+    if slab is None:
+        slab = _attached[name] = SharedFrameSlab(shape, slots, name=name)
+    return slab
+
+
+def _init_worker():
+    # One OpenCV thread per worker; the pool itself provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def analyze_slot(name, shape, slots, index):
+    """Brightness and detection image of a slab slot"""
+    return frame_features(_slab(name, shape, slots).frame(index))
+
+
+def encode_slot(name, shape, slots, source, target, rects):
+    """JPEG round-trip rects of one slot into another; returns encoded bytes"""
+    slab = _slab(name, shape, slots)
+    return encode_rects(slab.frame(source), slab.frame(target), rects)
+
+
+def write_zip(zip_path, entries):
+    """Write [(file path, archive name), ...] to zip_path; already compressed media is stored"""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for file_path, arcname in entries:
+            # Encoded video does not shrink under DEFLATE; store it
+            compress_type = zipfile.ZIP_DEFLATED if is_compressible(file_path) else zipfile.ZIP_STORED
+            zipf.write(file_path, arcname, compress_type=compress_type)
+    return zip_path
+
+
+class OffloadPool:
+    """Worker processes for frame analysis, encoding and archiving"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # spawn: forking a process that is already running threads is unsafe
+        self.executor = futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=_init_worker)
+
+    def warm_up(self):
+        """Start every worker now rather than on the first frame"""
+        for future in [self.executor.submit(_init_worker) for _ in range(self.workers)]:
+            future.result()
+
+    def analyze(self, slab, index):
+        return self.executor.submit(analyze_slot, slab.name, slab.shape, slab.slots, index).result()
+
+    def encode(self, slab, source, target, rects):
+        return self.executor.submit(encode_slot, slab.name, slab.shape, slab.slots,
+                                    source, target, rects).result()
+
+    def write_zip(self, zip_path, entries):
+        return self.executor.submit(write_zip, zip_path, entries).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
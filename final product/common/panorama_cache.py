@@ -0,0 +1,262 @@
+"""
+Content-addressed cache of built panoramas
+
+The same clips arrive again and again (every zip is extracted into the
+same folder, batches are re-run), and stitching them is by far the most
+expensive thing the client does. A panorama is keyed by the SHA-256 of
+the video's bytes (plus its pose sidecar, if any) and of the parameters
+it was built with, so a renamed copy still hits and a changed parameter
+misses.
+
+Each entry is a folder <key>/ holding copies of the output files (not
+links: a later build writing the same file name must not change them)
+and <key>.json with the build report and the last time it was used.
+Entries are written atomically, so several processes can share one
+cache. When the cache grows past max_bytes the least recently used
+entries are evicted.
+
+Usage:
+    cache = PanoramaCache("data/cache", max_bytes=512 * 2**20)
+    key = cache.key("flight.avi", {'skip_frames': 5})
+    entry = cache.get(key, "data", name="flight")   # restores the files into data/
+    if entry is None:
+        path = build(...)
+        cache.put(key, [path], {'stitch_mode': 'SCANS'}, name="flight")
+    cache.stats()   # hits, misses, entries, bytes
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from metrics import REGISTRY
+from pose import find_sidecar
+
+DEFAULT_MAX_BYTES = 1024 * 2**20
+HASH_CHUNK = 1024 * 1024
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "haps_panorama_cache_lookups_total", "Panorama cache lookups by result (hit or miss)", ["result"])
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy(source, target):
+    """Copy a file, or a directory tree (the tiles of a .dzi), replacing target"""
+    if os.path.isdir(source):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target)
+    else:
+        shutil.copy2(source, target)
+    return target
+
+
+def _publish(source, target):
+    """
+    Copy source to target atomically: into a temporary sibling first, then renamed
+
+    A copy cut short (by a crash, or by eviction in another process) never
+    appears under the final name. When another process published target
+    meanwhile, its copy is kept and ours discarded.
+    """
+    temporary = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        _copy(source, temporary)
+        if os.path.isdir(temporary):
+            os.rename(temporary, target)  # Fails, rather than merging, if target exists
+        else:
+            os.replace(temporary, target)
+    except OSError:
+        if not os.path.exists(target):
+            raise
+    finally:
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary, ignore_errors=True)
+        elif os.path.exists(temporary):
+            os.remove(temporary)
+    return target
+
+
+def _rename(file, old, new):
+    """Replace the first whole-word old (between underscores and dots) in a file name with new"""
+    pattern = rf'(?:^|(?<=_)){re.escape(old)}(?=[_.]|$)'
+    return re.sub(pattern, lambda match: new, file, count=1)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+class PanoramaCache:
+    """Panoramas by content hash of the video and build parameters, evicted least recently used first"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._digests = {}  # (path, size, mtime) -> digest, so unchanged files are hashed once
+        os.makedirs(directory, exist_ok=True)
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(memo)
+        if digest is None:
+            digest = self._digests[memo] = file_digest(path)
+        return digest
+
+    def key(self, video_path, params):
+        """Cache key of video_path built with params (a JSON-serialisable dict)"""
+        sidecar = find_sidecar(video_path)
+        content = {
+            'video': self._digest(video_path),
+            'poses': self._digest(sidecar) if sidecar else None,
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, entry):
+        # Write then rename, so readers in other processes never see half an entry
+        path = self._entry_path(entry['key'])
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(temporary, path)
+
+    def _count(self, result):
+        with self.lock:
+            if result == 'hit':
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_LOOKUPS.labels(result).inc()
+
+    def get(self, key, directory, name=None):
+        """
+        Entry for key with its files restored into directory, or None on a miss
+
+        Files of the same name in directory are replaced: they may come from
+        a build with other parameters. When the files were stored under
+        another video name (a renamed copy of the clip), name takes its
+        place in the restored file names. entry['paths'] lists the restored
+        files, the panorama first, and entry['info'] the report stored with it.
+        """
+        entry = self._read_entry(key)
+        folder = os.path.join(self.directory, key)
+        if entry is None or not all(os.path.exists(os.path.join(folder, file)) for file in entry['files']):
+            self._count('miss')
+            return None
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        try:
+            for file in entry['files']:
+                target = file
+                if name and entry.get('name'):
+                    target = _rename(file, entry['name'], name)
+                paths.append(_copy(os.path.join(folder, file), os.path.join(directory, target)))
+        except OSError:
+            # Evicted by another process while being restored
+            self._count('miss')
+            return None
+        entry['last_used'] = time.time()
+        entry['uses'] = entry.get('uses', 0) + 1
+        self._write_entry(entry)
+        self._count('hit')
+        return dict(entry, paths=paths)
+
+    def put(self, key, paths, info=None, name=None):
+        """
+        Store the output files of a build (the panorama first) with its report, then evict
+
+        name is the video name the file names are derived from, if any.
+        """
+        folder = os.path.join(self.directory, key)
+        os.makedirs(folder, exist_ok=True)
+        files = []
+        for path in paths:
+            file = os.path.basename(path)
+            target = os.path.join(folder, file)
+            if not os.path.exists(target):
+                _publish(path, target)
+            files.append(file)
+        now = time.time()
+        self._write_entry({
+            'key': key,
+            'name': name,
+            'files': files,
+            'bytes': _size(folder),
+            'info': info or {},
+            'created': now,
+            'last_used': now,
+            'uses': 0,
+        })
+        self.evict()
+
+    def entries(self):
+        """Every readable entry, least recently used first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                entry = self._read_entry(name[:-len('.json')])
+                if entry is not None:
+                    entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['last_used'])
+
+    def remove(self, key):
+        """Drop an entry and its files"""
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes; returns how many"""
+        entries = self.entries()
+        total = sum(entry['bytes'] for entry in entries)
+        evicted = 0
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(entry['key'])
+            total -= entry['bytes']
+            evicted += 1
+        return evicted
+
+    def stats(self):
+        """Hit and miss counts of this process, with the number and size of entries"""
+        entries = self.entries()
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': len(entries),
+            'bytes': sum(entry['bytes'] for entry in entries),
+            'max_bytes': self.max_bytes,
+        }
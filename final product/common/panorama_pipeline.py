@@ -0,0 +1,260 @@
+"""
+Streaming video-to-panorama pipeline
+
+Shared by the client, the batch builder and the scripts in panorama/.
+Frames flow through generator stages, one decoded frame at a time:
+
+    decode -> select every Nth -> downscale -> (save JPEGs) -> FrameStore -> stitch
+
+Only the stitcher needs every frame at once, and it reads them from a
+disk-backed FrameStore (feature stitchers still copy every frame they
+are given; see frame_store.py). JPEG copies of the selected frames are written
+only when a directory is asked for, not as a staging step.
+
+When the video has a pose sidecar (see pose.py), its frames are first
+placed by their telemetry (GeoMosaic, mode GEO) and feature stitching is
+only the fallback.
+
+Usage:
+    report = {}
+    panorama, mode = panorama_from_video("flight.avi", skip_frames=5, report=report)
+    if panorama is not None:
+        cv2.imwrite("panorama.jpg", panorama)
+
+The stages can also be chained by hand:
+    capture, info = open_video("flight.avi")
+    frames = downscale(select_frames(read_frames(capture), 5), (640, 360))
+"""
+import os
+import time
+
+from frame_store import FrameStore
+from geo_mosaic import GeoMosaic
+from lazy import lazy_import
+from pose import find_sidecar, read_poses
+from stitching import StitchingEngine
+
+cv2 = lazy_import('cv2')
+
+STITCH_MODES = ('SCANS', 'PANORAMA')  # Tried in order until one succeeds
+DEFAULT_SIZE = (640, 360)
+SAMPLE_FRAMES = 5  # Frames kept for inspection when stitching fails
+
+# Numeric values cover OpenCV builds without the named constants
+STITCH_ERRORS = {
+    1: "Need more images with better overlap",
+    2: "Homography estimation failed - images may not overlap enough",
+    3: "Camera parameters adjustment failed",
+}
+
+
+def stitch_error_message(status):
+    """Human-readable explanation of a non-OK stitcher status (None if unknown)"""
+    return STITCH_ERRORS.get(int(status))
+
+
+def open_video(path):
+    """Open a video; returns (capture, info dict) or (None, None) if it cannot be read"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        return None, None
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    info = {
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'total_frames': total_frames,
+        'fps': fps,
+        'duration': total_frames / fps if fps > 0 else 0,
+    }
+    return capture, info
+
+
+def read_frames(capture, report=None):
+    """Decode every frame of an open capture, releasing it at the end; counts frames_read in report"""
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if report is not None:
+                report['frames_read'] = report.get('frames_read', 0) + 1
+            yield frame
+    finally:
+        capture.release()
+
+
+def select_frames(frames, every=1):
+    """Keep every Nth frame, starting with the first"""
+    for index, frame in enumerate(frames):
+        if index % every == 0:
+            yield frame
+
+
+def downscale(frames, size=DEFAULT_SIZE):
+    """Resize frames to size (width, height); None passes them through"""
+    for frame in frames:
+        yield frame if size is None else cv2.resize(frame, size)
+
+
+def fit_size(size, native):
+    """Largest (width, height) within size with the aspect ratio of native"""
+    scale = min(size[0] / native[0], size[1] / native[1])
+    return max(1, round(native[0] * scale)), max(1, round(native[1] * scale))
+
+
+def save_frames(frames, directory, prefix='frame'):
+    """Write each frame as directory/<prefix><n>.jpg on its way through"""
+    os.makedirs(directory, exist_ok=True)
+    for index, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(directory, f'{prefix}{index}.jpg'), frame)
+        yield frame
+
+
+def collect(frames, directory=None, progress=None):
+    """Append frames to a new FrameStore (the caller closes it)"""
+    store = FrameStore(directory)
+    try:
+        for frame in frames:
+            store.append(frame)
+            _notify(progress, 'frame', count=len(store))
+    except BaseException:
+        store.close()
+        raise
+    return store
+
+
+def _notify(progress, event, **info):
+    if progress is not None:
+        progress(event, **info)
+
+
+def _stitchers(modes, preset=None, mosaic=None):
+    """(mode, factory) per stitcher to try; OpenCV 3.x builds only have the legacy one"""
+    stitchers = [('GEO', lambda: mosaic)] if mosaic is not None else []
+    if preset is not None:
+        engine = StitchingEngine.load(preset)
+        return stitchers + [(engine.name.upper(), lambda: engine)]
+    if not hasattr(cv2, 'Stitcher_create'):
+        return stitchers + [('LEGACY', lambda: cv2.createStitcher(False))]
+    return stitchers + [(mode, lambda mode=mode: cv2.Stitcher_create(getattr(cv2, f'Stitcher_{mode}')))
+                        for mode in modes]
+
+
+def pose_mosaic(pose_file, frame_numbers, report=None):
+    """
+    GeoMosaic for the given video frame numbers, or None if any of them has no pose
+
+    report['poses'] records how many of the frames had one.
+    """
+    camera, poses = read_poses(pose_file)
+    selected = [poses[number] for number in frame_numbers if number in poses]
+    if report is not None:
+        report['poses'] = len(selected)
+    if len(selected) < len(frame_numbers):
+        return None
+    return GeoMosaic(selected, hfov=camera['hfov'])
+
+
+def stitch(frames, modes=STITCH_MODES, report=None, progress=None, preset=None, mosaic=None):
+    """
+    Stitch frames with the first mode that works; returns (panorama, mode) or (None, None)
+
+    With a preset (a stitching.PRESETS name or config dict) the configurable
+    StitchingEngine is used instead of cv2.Stitcher and the modes are ignored.
+    A GeoMosaic for the frames is tried first, as mode GEO; its
+    georeference goes into report.
+
+    progress(event, **info) hears 'attempt' before and 'failed' after each
+    unsuccessful try. Stitch status, mode and errors go into report.
+    """
+    report = {} if report is None else report
+    for mode, create in _stitchers(modes, preset, mosaic):
+        _notify(progress, 'attempt', mode=mode)
+        try:
+            stitcher = create()
+            status, panorama = stitcher.stitch(frames)
+        except Exception as e:
+            report['error'] = str(e)
+            _notify(progress, 'failed', mode=mode, status=None, message=str(e))
+            continue
+        report['stitch_status'] = int(status)
+        if status == cv2.Stitcher_OK:
+            report['stitch_mode'] = mode
+            if mode == 'GEO':
+                report['georeference'] = stitcher.georeference
+            return panorama, mode
+        _notify(progress, 'failed', mode=mode, status=int(status), message=stitch_error_message(status))
+    return None, None
+
+
+def panorama_from_video(path, skip_frames=5, size=DEFAULT_SIZE, modes=STITCH_MODES, frames_directory=None,
+                        store_directory=None, samples_directory=None, report=None, progress=None,
+                        preset=None, pose_file=None, use_poses=True):
+    """
+    Build a panorama from every skip_frames-th frame of a video
+
+    Args:
+        size: (width, height) frames are downscaled to before stitching, None keeps them.
+              When frames are placed by their poses they are fitted within size
+              instead, keeping the video's aspect ratio: the pose scale assumes
+              square pixels.
+        frames_directory: Also write the selected frames there as JPEGs
+        store_directory: Where the FrameStore backing file lives (default: temp dir)
+        samples_directory: On a failed stitch, write a few frames there for inspection
+        report: Dict filled with video info, frame counts, timings and stitch status
+        progress: Callback progress(event, **info) for 'opened', 'frame', 'extracted'
+                  and the stitch() events
+        preset: Stitch with StitchingEngine and this preset instead of cv2.Stitcher
+        pose_file: Pose sidecar of the video (default: <video>.pose.jsonl if it exists)
+        use_poses: Place frames by their poses when every selected frame has one
+
+    Returns (panorama, mode), or (None, None) if the video could not be
+    opened or stitched; report['error'] says why.
+    """
+    report = {} if report is None else report
+    report.update(frames_read=0, frames_extracted=0, extract_seconds=0.0, stitch_seconds=0.0,
+                  stitch_mode=None, stitch_status=None, error=None, poses=0, georeference=None)
+    started = time.perf_counter()
+    capture, info = open_video(path)
+    if capture is None:
+        report['error'] = 'could not open video'
+        return None, None
+    report.update(info)
+    _notify(progress, 'opened', **info)
+
+    pose_file = (pose_file or find_sidecar(path)) if use_poses else None
+    if size is not None and pose_file is not None and info['width'] and info['height']:
+        size = fit_size(size, (info['width'], info['height']))
+    frames = downscale(select_frames(read_frames(capture, report), max(1, skip_frames)), size)
+    if frames_directory is not None:
+        frames = save_frames(frames, frames_directory)
+    store = collect(frames, store_directory, progress)
+    try:
+        report['frames_extracted'] = len(store)
+        report['extract_seconds'] = time.perf_counter() - started
+        _notify(progress, 'extracted', count=len(store))
+        if len(store) < 2:
+            report['error'] = 'need at least 2 frames'
+            return None, None
+
+        stitch_started = time.perf_counter()
+        frames = store.frames()
+        mosaic = None
+        if pose_file is not None:
+            # Selected frame k is frame k * skip_frames of the recording
+            step = max(1, skip_frames)
+            mosaic = pose_mosaic(pose_file, [index * step for index in range(len(frames))], report)
+        panorama, mode = stitch(frames, modes, report, progress, preset, mosaic)
+        report['stitch_seconds'] = time.perf_counter() - stitch_started
+        if panorama is None:
+            report['error'] = report['error'] or 'stitching failed'
+            if samples_directory is not None:
+                os.makedirs(samples_directory, exist_ok=True)
+                for index, frame in enumerate(frames[::max(1, len(frames) // SAMPLE_FRAMES)]):
+                    cv2.imwrite(os.path.join(samples_directory, f'sample_frame_{index}.jpg'), frame)
+        else:
+            report['error'] = None
+        return panorama, mode
+    finally:
+        store.close()
@@ -0,0 +1,117 @@
+"""
+Per-frame camera pose (telemetry) recorded alongside a video
+
+A recording flight.avi carries its telemetry in a sidecar file
+flight.avi.pose.jsonl, standing in for metadata embedded in the video
+stream. The first line describes the camera, every further line one
+recorded frame:
+
+    {"format": "haps-pose/1", "hfov": 60.0}
+    {"frame": 0, "t": 0.0, "lat": 48.137, "lon": 11.575, "alt": 20000.0, "heading": 0.0}
+
+lat/lon are WGS84 degrees, alt metres above the ground, heading degrees
+clockwise from north that the top of the image points to, hfov the
+camera's horizontal field of view in degrees. The camera looks straight
+down (nadir).
+
+Usage:
+    with PoseWriter("recordings/flight.avi", hfov=60.0) as log:
+        log.write(0, lat=48.137, lon=11.575, alt=20000.0, heading=0.0)
+
+    camera, poses = read_poses(sidecar_path("recordings/flight.avi"))
+"""
+import json
+import math
+import os
+
+SIDECAR_SUFFIX = '.pose.jsonl'
+POSE_FORMAT = 'haps-pose/1'
+DEFAULT_HFOV = 60.0  # degrees
+EARTH_RADIUS = 6378137.0  # metres (WGS84 equatorial)
+POSE_FIELDS = ('lat', 'lon', 'alt', 'heading')
+
+
+def sidecar_path(video_path):
+    """Path of the pose sidecar belonging to video_path"""
+    return video_path + SIDECAR_SUFFIX
+
+
+def find_sidecar(video_path):
+    """The pose sidecar of video_path if there is one, else None"""
+    path = sidecar_path(video_path)
+    return path if os.path.exists(path) else None
+
+
+class PoseWriter:
+    """Appends one pose line per recorded frame to a sidecar"""
+
+    def __init__(self, video_path, hfov=DEFAULT_HFOV):
+        self.path = sidecar_path(video_path)
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({'format': POSE_FORMAT, 'hfov': hfov}) + '\n')
+        self.written = 0
+
+    def write(self, frame, t=None, **pose):
+        record = {'frame': frame, 't': t}
+        record.update((key, pose[key]) for key in POSE_FIELDS)
+        self.file.write(json.dumps(record) + '\n')
+        self.written += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_poses(path):
+    """
+    Read a sidecar; returns (camera dict, {frame number: pose dict})
+
+    Lines that are not valid JSON or lack a field are skipped, so a
+    sidecar cut short by a crash still gives the poses written so far.
+    """
+    camera = {'hfov': DEFAULT_HFOV}
+    poses = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'format' in record:
+                camera.update(record)
+            elif 'frame' in record and all(record.get(key) is not None for key in POSE_FIELDS):
+                poses[int(record['frame'])] = record
+    return camera, poses
+
+
+def ground_width(alt, hfov):
+    """Width in metres of the ground seen by a nadir camera at alt"""
+    return 2.0 * alt * math.tan(math.radians(hfov) / 2.0)
+
+
+def to_local(poses, origin=None):
+    """
+    (east, north) metres of each pose relative to origin (lat, lon)
+
+    An equirectangular approximation, accurate to well under a pixel over
+    the few kilometres a single pass covers. origin defaults to the first pose.
+    """
+    if origin is None:
+        origin = (poses[0]['lat'], poses[0]['lon'])
+    lat0, lon0 = origin
+    scale = math.radians(1.0) * EARTH_RADIUS
+    cos_lat = math.cos(math.radians(lat0))
+    return [((pose['lon'] - lon0) * scale * cos_lat, (pose['lat'] - lat0) * scale) for pose in poses]
+
+
+def from_local(east, north, origin):
+    """(lat, lon) of a point east/north metres from origin (lat, lon)"""
+    lat0, lon0 = origin
+    scale = math.radians(1.0) * EARTH_RADIUS
+    return lat0 + north / scale, lon0 + east / (scale * math.cos(math.radians(lat0)))
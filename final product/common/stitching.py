@@ -0,0 +1,318 @@
+"""
+Configurable panorama stitching engine
+
+cv2.Stitcher_create() always composites at full resolution with graph-cut
+seams and multi-band blending, which dominates the runtime on long pans.
+StitchingEngine runs the same pipeline from the cv2.detail building blocks
+with every expensive step configurable:
+
+    registration_resol   megapixels for feature matching
+    seam_resol           megapixels for seam estimation
+    compose_resol        megapixels of the composited panorama (-1 = input resolution)
+    features             orb, akaze or sift
+    match_range          match each frame only with this many neighbours (0 = all pairs);
+                         video frames only overlap their neighbours anyway
+    matcher              affine (linear scans, like Stitcher SCANS) or homography
+                         (rotating camera, like Stitcher PANORAMA)
+    warper               affine, plane, cylindrical, spherical, ...
+    seam_finder          none, voronoi, dp_color or gc_color
+    blender              none, feather or multiband (with blend_bands)
+    exposure             none, gain or gain_blocks
+
+A configuration is a preset name (PRESETS) or a dict of overrides on top of
+one:
+
+    engine = StitchingEngine.load('fast')
+    engine = StitchingEngine.load({'preset': 'balanced', 'blender': 'feather'})
+    status, panorama = engine.stitch(frames)   # same contract as cv2.Stitcher
+
+Usage (time every preset on a video):
+    python stitching.py ../../panorama/video.mp4 --skip-frames 5
+"""
+import argparse
+import json
+import math
+import time
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+PRESETS = {
+    'fast': {
+        'registration_resol': 0.3, 'seam_resol': 0.05, 'compose_resol': 0.5,
+        'features': 'orb', 'match_range': 2, 'matcher': 'affine', 'warper': 'affine', 'match_conf': 0.3,
+        'seam_finder': 'voronoi', 'blender': 'feather', 'blend_strength': 5, 'exposure': 'none',
+    },
+    'balanced': {
+        'registration_resol': 0.6, 'seam_resol': 0.1, 'compose_resol': 1.0,
+        'features': 'orb', 'match_range': 4, 'matcher': 'affine', 'warper': 'affine', 'match_conf': 0.3,
+        'seam_finder': 'dp_color', 'blender': 'multiband', 'blend_bands': 3, 'blend_strength': 5,
+        'exposure': 'gain',
+    },
+    'quality': {
+        'registration_resol': 0.6, 'seam_resol': 0.1, 'compose_resol': -1,
+        'features': 'orb', 'match_range': 0, 'matcher': 'affine', 'warper': 'affine', 'match_conf': 0.3,
+        'seam_finder': 'gc_color', 'blender': 'multiband', 'blend_bands': 5, 'blend_strength': 5,
+        'exposure': 'gain_blocks',
+    },
+}
+DEFAULT_PRESET = 'balanced'
+CONFIDENCE_THRESHOLD = 1.0
+
+SEAM_FINDERS = ('none', 'voronoi', 'dp_color', 'gc_color')
+BLENDERS = ('none', 'feather', 'multiband')
+EXPOSURE = ('none', 'gain', 'gain_blocks')
+WARPERS = ('affine', 'plane', 'cylindrical', 'spherical', 'fisheye', 'stereographic', 'mercator',
+           'transverseMercator')
+
+
+def _scale(resol, area):
+    """Scale factor that brings an image of area pixels down to resol megapixels (never up)"""
+    if resol is None or resol < 0:
+        return 1.0
+    return min(1.0, math.sqrt(resol * 1e6 / area))
+
+
+class StitchingEngine:
+    """cv2.detail stitching pipeline with configurable resolutions, seams, blending and warping"""
+
+    def __init__(self, config=None):
+        config = dict(config or {})
+        preset = config.pop('preset', DEFAULT_PRESET)
+        if preset not in PRESETS:
+            raise ValueError(f"unknown stitching preset {preset!r} (choose from {', '.join(PRESETS)})")
+        self.config = dict(PRESETS[preset], **config)
+        self.name = preset if not config else f"{preset}+custom"
+        self.timings = {}
+        self.frames_used = 0
+        for key, choices in (('seam_finder', SEAM_FINDERS), ('blender', BLENDERS),
+                             ('exposure', EXPOSURE), ('warper', WARPERS), ('matcher', ('affine', 'homography')),
+                             ('features', ('orb', 'akaze', 'sift'))):
+            if self.config[key] not in choices:
+                raise ValueError(f"{key} must be one of {', '.join(choices)}, got {self.config[key]!r}")
+
+    @classmethod
+    def load(cls, name_or_config):
+        """Engine for a preset name, a config dict or a JSON file path"""
+        if isinstance(name_or_config, cls):
+            return name_or_config
+        if isinstance(name_or_config, dict):
+            return cls(name_or_config)
+        if name_or_config in PRESETS:
+            return cls({'preset': name_or_config})
+        with open(name_or_config) as f:
+            return cls(json.load(f))
+
+    # Building blocks
+
+    def _feature_finder(self):
+        kind = self.config['features']
+        if kind == 'orb':
+            return cv2.ORB.create()
+        if kind == 'akaze':
+            return cv2.AKAZE_create()
+        return cv2.SIFT_create()
+
+    def _matcher(self):
+        if self.config['matcher'] == 'affine':
+            return cv2.detail_AffineBestOf2NearestMatcher(False, False, self.config['match_conf'])
+        return cv2.detail_BestOf2NearestMatcher(False, self.config['match_conf'])
+
+    def _match(self, features):
+        """Pairwise matches; with match_range only frames that close in the sequence are compared"""
+        matcher = self._matcher()
+        match_range = self.config.get('match_range', 0)
+        if match_range and len(features) > match_range + 1:
+            indices = np.arange(len(features))
+            mask = (np.abs(indices[:, None] - indices[None, :]) <= match_range).astype(np.uint8)
+            matches = matcher.apply2(features, mask)
+        else:
+            matches = matcher.apply2(features)
+        matcher.collectGarbage()
+        return matches
+
+    def _estimator_and_adjuster(self):
+        if self.config['matcher'] == 'affine':
+            return cv2.detail_AffineBasedEstimator(), cv2.detail_BundleAdjusterAffinePartial()
+        return cv2.detail_HomographyBasedEstimator(), cv2.detail_BundleAdjusterRay()
+
+    def _seam_finder(self):
+        kind = self.config['seam_finder']
+        if kind == 'voronoi':
+            return cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_VORONOI_SEAM)
+        if kind == 'dp_color':
+            return cv2.detail_DpSeamFinder('COLOR')
+        if kind == 'gc_color':
+            return cv2.detail_GraphCutSeamFinder('COST_COLOR')
+        return cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_NO)
+
+    def _exposure_compensator(self):
+        kind = {'gain': cv2.detail.ExposureCompensator_GAIN,
+                'gain_blocks': cv2.detail.ExposureCompensator_GAIN_BLOCKS}.get(self.config['exposure'],
+                                                                               cv2.detail.ExposureCompensator_NO)
+        return cv2.detail.ExposureCompensator_createDefault(kind)
+
+    def _blender(self, corners, sizes):
+        roi = cv2.detail.resultRoi(corners=corners, sizes=sizes)
+        blend_width = math.sqrt(roi[2] * roi[3]) * self.config.get('blend_strength', 5) / 100
+        kind = self.config['blender']
+        if kind == 'none' or blend_width < 1:
+            blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
+        elif kind == 'multiband':
+            blender = cv2.detail_MultiBandBlender()
+            bands = self.config.get('blend_bands') or int(math.log2(blend_width) - 1)
+            blender.setNumBands(max(1, bands))
+        else:
+            blender = cv2.detail_FeatherBlender()
+            blender.setSharpness(1.0 / blend_width)
+        blender.prepare(roi)
+        return blender
+
+    def _timed(self, stage, started):
+        now = time.perf_counter()
+        self.timings[stage] = now - started
+        return now
+
+    # Pipeline
+
+    def stitch(self, images):
+        """Stitch BGR images; returns (status, panorama) like cv2.Stitcher.stitch"""
+        self.timings = {}
+        self.frames_used = 0
+        started = time.perf_counter()
+        images = list(images)
+        if len(images) < 2:
+            return cv2.Stitcher_ERR_NEED_MORE_IMGS, None
+        height, width = images[0].shape[:2]
+        area = height * width
+        work_scale = _scale(self.config['registration_resol'], area)
+        seam_scale = _scale(self.config['seam_resol'], area)
+        compose_scale = _scale(self.config['compose_resol'], area)
+
+        # Registration: features and pairwise matches at registration resolution
+        finder = self._feature_finder()
+        features = []
+        for image in images:
+            small = image if work_scale == 1 else cv2.resize(image, None, fx=work_scale, fy=work_scale,
+                                                               interpolation=cv2.INTER_LINEAR_EXACT)
+            features.append(cv2.detail.computeImageFeatures2(finder, small))
+        matches = self._match(features)
+        indices = cv2.detail.leaveBiggestComponent(features, matches, CONFIDENCE_THRESHOLD)
+        indices = [int(index) for index in np.asarray(indices).ravel()]
+        if len(indices) < 2:
+            return cv2.Stitcher_ERR_NEED_MORE_IMGS, None
+        if len(indices) < len(images):
+            # Frames that matched nothing are dropped; the bindings return the
+            # indices but leave the features alone, so match the subset again
+            images = [images[index] for index in indices]
+            features = [features[index] for index in indices]
+            for number, feature in enumerate(features):
+                feature.img_idx = number
+            matches = self._match(features)
+        self.frames_used = len(images)
+
+        estimator, adjuster = self._estimator_and_adjuster()
+        ok, cameras = estimator.apply(features, matches, None)
+        if not ok:
+            return cv2.Stitcher_ERR_HOMOGRAPHY_EST_FAIL, None
+        for camera in cameras:
+            camera.R = camera.R.astype(np.float32)
+        adjuster.setConfThresh(CONFIDENCE_THRESHOLD)
+        refine_mask = np.zeros((3, 3), np.uint8)
+        refine_mask[0, :] = 1
+        refine_mask[1, 1:] = 1
+        adjuster.setRefinementMask(refine_mask)
+        ok, cameras = adjuster.apply(features, matches, cameras)
+        if not ok:
+            return cv2.Stitcher_ERR_CAMERA_PARAMS_ADJUST_FAIL, None
+        if self.config['matcher'] == 'homography':
+            rotations = cv2.detail.waveCorrect([np.copy(camera.R) for camera in cameras],
+                                               cv2.detail.WAVE_CORRECT_HORIZ)
+            for camera, rotation in zip(cameras, rotations):
+                camera.R = rotation
+        warped_scale = float(np.median([camera.focal for camera in cameras]))
+        started = self._timed('registration', started)
+
+        # Seams and exposure at seam resolution
+        seam_aspect = seam_scale / work_scale
+        warper = cv2.PyRotationWarper(self.config['warper'], warped_scale * seam_aspect)
+        corners, warped, masks = [], [], []
+        for image, camera in zip(images, cameras):
+            small = cv2.resize(image, None, fx=seam_scale, fy=seam_scale, interpolation=cv2.INTER_LINEAR_EXACT)
+            K = camera.K().astype(np.float32)
+            K[0, 0] *= seam_aspect; K[0, 2] *= seam_aspect; K[1, 1] *= seam_aspect; K[1, 2] *= seam_aspect
+            corner, image_warped = warper.warp(small, K, camera.R, cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
+            _, mask_warped = warper.warp(np.full(small.shape[:2], 255, np.uint8), K, camera.R,
+                                         cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
+            corners.append(corner)
+            warped.append(image_warped)
+            masks.append(mask_warped)
+        compensator = self._exposure_compensator()
+        compensator.feed(corners=corners, images=warped, masks=masks)
+        seam_masks = self._seam_finder().find([image.astype(np.float32) for image in warped], corners, masks)
+        started = self._timed('seams', started)
+
+        # Compositing at compose resolution
+        compose_aspect = compose_scale / work_scale
+        warper = cv2.PyRotationWarper(self.config['warper'], warped_scale * compose_aspect)
+        size = (int(round(width * compose_scale)), int(round(height * compose_scale)))
+        corners, sizes, intrinsics = [], [], []
+        for camera in cameras:
+            camera.focal *= compose_aspect
+            camera.ppx *= compose_aspect
+            camera.ppy *= compose_aspect
+            K = camera.K().astype(np.float32)
+            roi = warper.warpRoi(size, K, camera.R)
+            corners.append(roi[0:2])
+            sizes.append(roi[2:4])
+            intrinsics.append(K)
+        blender = self._blender(corners, sizes)
+        for index, (image, camera, K) in enumerate(zip(images, cameras, intrinsics)):
+            if compose_scale != 1:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR_EXACT)
+            _, image_warped = warper.warp(image, K, camera.R, cv2.INTER_LINEAR, cv2.BORDER_REFLECT)
+            _, mask_warped = warper.warp(np.full(image.shape[:2], 255, np.uint8), K, camera.R,
+                                         cv2.INTER_NEAREST, cv2.BORDER_CONSTANT)
+            compensator.apply(index, corners[index], image_warped, mask_warped)
+            seam_mask = cv2.resize(cv2.dilate(seam_masks[index].get(), None),
+                                   (mask_warped.shape[1], mask_warped.shape[0]), 0, 0, cv2.INTER_LINEAR_EXACT)
+            blender.feed(cv2.UMat(image_warped.astype(np.int16)), cv2.bitwise_and(seam_mask, mask_warped),
+                         corners[index])
+        panorama, _ = blender.blend(None, None)
+        panorama = cv2.convertScaleAbs(panorama)
+        self._timed('compositing', started)
+        return cv2.Stitcher_OK, panorama
+
+
+def main(argv=None):
+    import sys
+    from panorama_pipeline import open_video, read_frames, select_frames, downscale
+
+    parser = argparse.ArgumentParser(description="Time the stitching presets on a video")
+    parser.add_argument('video', help="input video")
+    parser.add_argument('--skip-frames', type=int, default=5, help="use every Nth frame (default: 5)")
+    parser.add_argument('--presets', nargs='+', default=list(PRESETS), help="presets to run")
+    parser.add_argument('--output', help="write each panorama to <output>_<preset>.jpg")
+    args = parser.parse_args(argv)
+
+    capture, _ = open_video(args.video)
+    if capture is None:
+        sys.exit(f"Could not open {args.video}")
+    frames = list(downscale(select_frames(read_frames(capture), args.skip_frames), None))
+    for preset in args.presets:
+        engine = StitchingEngine.load(preset)
+        started = time.perf_counter()
+        status, panorama = engine.stitch(frames)
+        elapsed = time.perf_counter() - started
+        stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in engine.timings.items())
+        shape = f"{panorama.shape[1]}x{panorama.shape[0]}" if panorama is not None else "-"
+        print(f"{preset:10s} status {int(status)}  {elapsed:6.2f}s  {shape}  "
+              f"{engine.frames_used}/{len(frames)} frames  ({stages})")
+        if args.output and panorama is not None:
+            cv2.imwrite(f"{args.output}_{preset}.jpg", panorama)
+
+
+if __name__ == "__main__":
+    main()
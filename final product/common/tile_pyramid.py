@@ -0,0 +1,356 @@
+"""
+Deep Zoom tile pyramids for large panoramas
+
+A long HAPS sweep makes a mosaic that is slow to encode, send and open as
+one JPEG. Panoramas are instead written as a Deep Zoom Image (DZI): an XML
+descriptor plus one folder of JPEG tiles per zoom level, each level half
+the size of the next, down to 1x1 pixel:
+
+    panorama.dzi
+    panorama_files/<level>/<col>_<row>.jpg
+
+Viewers (OpenSeadragon, or DeepZoomReader below) fetch only the tiles and
+levels on screen, from disk or over plain HTTP.
+
+DeepZoomWriter takes the image as horizontal bands from top to bottom and
+builds every level in the same pass: tiles are written as soon as their
+rows are complete and each level keeps only about one tile row, so the
+pyramid never has to exist in memory.
+
+Usage:
+    with DeepZoomWriter("data/panorama", width, height) as writer:
+        for band in bands:
+            writer.write(band)
+
+    python tile_pyramid.py build panorama.jpg data/panorama
+    python tile_pyramid.py serve data --port 9103
+    python tile_pyramid.py fetch http://host:9103/panorama.dzi --width 800 --output view.jpg
+"""
+import argparse
+import math
+import os
+import threading
+import urllib.request
+import xml.etree.ElementTree as ET
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+TILE_SIZE = 254  # With a 1 px overlap on both sides interior tiles are 256 px
+TILE_OVERLAP = 1
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+BAND_ROWS = 256  # Rows per band when a whole image is written
+TILE_PORT = 9103
+
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+
+
+def level_count(width, height):
+    """Number of Deep Zoom levels: level 0 is 1x1, the last one full size"""
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def level_size(width, height, level, levels=None):
+    """(width, height) of a level"""
+    levels = levels or level_count(width, height)
+    scale = 2 ** (levels - 1 - level)
+    return -(-width // scale), -(-height // scale)
+
+
+def _tile_span(index, tile_size, overlap, limit):
+    """Pixel range covered by tile index along one axis, including overlap"""
+    return max(0, index * tile_size - overlap), min(limit, (index + 1) * tile_size + overlap)
+
+
+class _Level:
+    """One pyramid level: buffers rows until tile rows are complete, feeds the next smaller level"""
+
+    def __init__(self, writer, level, width, height, smaller):
+        self.writer = writer
+        self.level = level
+        self.width = width
+        self.height = height
+        self.smaller = smaller
+        self.cols = -(-width // writer.tile_size)
+        self.rows = -(-height // writer.tile_size)
+        self.buffer = None          # Rows buffer_top .. received-1
+        self.buffer_top = 0
+        self.received = 0
+        self.next_row = 0
+        self.pending = None         # Odd row waiting for its pair before downsampling
+        os.makedirs(os.path.join(writer.tiles_directory, str(level)), exist_ok=True)
+
+    def write(self, rows):
+        rows = rows[:self.height - self.received]
+        if not len(rows):
+            return
+        # Copy: callers may reuse the band they passed in
+        self.buffer = rows.copy() if self.buffer is None else np.concatenate((self.buffer, rows))
+        self.received += len(rows)
+        self._emit(final=False)
+        if self.smaller is not None:
+            self._downsample(rows)
+
+    def _downsample(self, rows, final=False):
+        if self.pending is not None:
+            rows = np.concatenate((self.pending, rows))
+            self.pending = None
+        paired = len(rows) - len(rows) % 2
+        if len(rows) % 2:
+            if final:
+                paired = len(rows)
+            else:
+                self.pending = rows[paired:]
+        if paired:
+            height = -(-paired // 2)
+            self.smaller.write(cv2.resize(rows[:paired], (self.smaller.width, height), interpolation=cv2.INTER_AREA))
+
+    def _emit(self, final):
+        tile_size, overlap = self.writer.tile_size, self.writer.overlap
+        while self.next_row < self.rows:
+            top, bottom = _tile_span(self.next_row, tile_size, overlap, self.height)
+            if bottom > self.received and not final:
+                break
+            band = self.buffer[top - self.buffer_top:bottom - self.buffer_top]
+            for col in range(self.cols):
+                left, right = _tile_span(col, tile_size, overlap, self.width)
+                self.writer.write_tile(self.level, col, self.next_row, band[:, left:right])
+            self.next_row += 1
+            # Rows above the next tile row's top overlap are no longer needed
+            keep_from = min(self.received, max(0, self.next_row * tile_size - overlap))
+            self.buffer = self.buffer[keep_from - self.buffer_top:]
+            self.buffer_top = keep_from
+
+    def close(self):
+        if self.received < self.height:
+            raise ValueError(f"level {self.level} got {self.received} of {self.height} rows")
+        self._emit(final=True)
+        self.buffer = None
+        if self.smaller is not None:
+            if self.pending is not None:
+                self._downsample(self.pending[:0], final=True)
+            self.smaller.close()
+
+
+class DeepZoomWriter:
+    """
+    Streams an image of known size into a Deep Zoom pyramid
+
+    path is the output path without extension: path.dzi and path_files/
+    are created. Write the image top to bottom as bands of any height.
+    """
+
+    def __init__(self, path, width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                 tile_format=TILE_FORMAT, quality=TILE_QUALITY):
+        if path.endswith('.dzi'):
+            path = path[:-4]
+        self.path = path + '.dzi'
+        self.tiles_directory = path + '_files'
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_format = tile_format
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality] if tile_format in ('jpg', 'jpeg') else []
+        self.levels = level_count(width, height)
+        self.tiles_written = 0
+        self.bytes_written = 0
+
+        smaller = None
+        for level in range(self.levels):
+            level_width, level_height = level_size(width, height, level, self.levels)
+            smaller = _Level(self, level, level_width, level_height, smaller)
+        self.top = smaller  # Full resolution level
+        self.closed = False
+
+    def write(self, band):
+        """Append the next rows of the image"""
+        if band.shape[1] != self.width:
+            raise ValueError(f"band width {band.shape[1]} does not match image width {self.width}")
+        self.top.write(band)
+
+    def write_tile(self, level, col, row, tile):
+        ok, encoded = cv2.imencode('.' + self.tile_format, tile, self.encode_params)
+        if not ok:
+            raise ValueError(f"could not encode tile {level}/{col}_{row}")
+        with open(os.path.join(self.tiles_directory, str(level), f"{col}_{row}.{self.tile_format}"), 'wb') as f:
+            f.write(encoded)
+        self.tiles_written += 1
+        self.bytes_written += len(encoded)
+
+    def close(self):
+        """Flush the last tile rows and write the .dzi descriptor"""
+        if self.closed:
+            return
+        self.top.close()
+        image = ET.Element('Image', {'xmlns': DZI_NAMESPACE, 'TileSize': str(self.tile_size),
+                                     'Overlap': str(self.overlap), 'Format': self.tile_format})
+        ET.SubElement(image, 'Size', {'Width': str(self.width), 'Height': str(self.height)})
+        ET.ElementTree(image).write(self.path, encoding='utf-8', xml_declaration=True)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def write_pyramid(image, path, band_rows=BAND_ROWS, **options):
+    """Write an in-memory image as a Deep Zoom pyramid; returns the .dzi path"""
+    height, width = image.shape[:2]
+    with DeepZoomWriter(path, width, height, **options) as writer:
+        for top in range(0, height, band_rows):
+            writer.write(image[top:top + band_rows])
+    return writer.path
+
+
+def save_image(image, path):
+    """Write image to path: a tile pyramid for .dzi paths, a plain image file otherwise"""
+    if path.endswith('.dzi'):
+        return write_pyramid(image, path)
+    cv2.imwrite(path, image)
+    return path
+
+
+class DeepZoomReader:
+    """
+    Reads tiles and regions of a Deep Zoom pyramid from a .dzi path or URL
+
+    Only the tiles covering a requested region are loaded.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.remote = source.startswith(('http://', 'https://'))
+        root = ET.fromstring(self._read(source))
+        namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+        size = root.find(namespace + 'Size')
+        self.width = int(size.get('Width'))
+        self.height = int(size.get('Height'))
+        self.tile_size = int(root.get('TileSize'))
+        self.overlap = int(root.get('Overlap'))
+        self.tile_format = root.get('Format')
+        self.levels = level_count(self.width, self.height)
+        self.base = source[:-4] + '_files'
+        self.tiles_read = 0
+        self.lock = threading.Lock()
+
+    def _read(self, location):
+        if self.remote:
+            with urllib.request.urlopen(location, timeout=30) as response:
+                return response.read()
+        with open(location, 'rb') as f:
+            return f.read()
+
+    def level_size(self, level):
+        return level_size(self.width, self.height, level, self.levels)
+
+    def level_for_width(self, width):
+        """Smallest level at least width pixels wide (the full level if none is)"""
+        for level in range(self.levels):
+            if self.level_size(level)[0] >= width:
+                return level
+        return self.levels - 1
+
+    def tile(self, level, col, row):
+        """Decoded tile, overlap included"""
+        separator = '/' if self.remote else os.sep
+        location = separator.join((self.base, str(level), f"{col}_{row}.{self.tile_format}"))
+        data = self._read(location)
+        with self.lock:
+            self.tiles_read += 1
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def region(self, level, x0=0, y0=0, x1=None, y1=None):
+        """Pixels x0..x1, y0..y1 of a level (default: the whole level), built from the tiles that cover them"""
+        width, height = self.level_size(level)
+        x1 = width if x1 is None else min(x1, width)
+        y1 = height if y1 is None else min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError(f"empty region {x0},{y0}-{x1},{y1} on level {level} ({width}x{height})")
+        size = self.tile_size
+        out = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        for row in range(y0 // size, (y1 - 1) // size + 1):
+            for col in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self.tile(level, col, row)
+                # Tiles other than the first in a row/column start with overlap pixels
+                left = col * size - (self.overlap if col else 0)
+                top = row * size - (self.overlap if row else 0)
+                ax0, ay0 = max(x0, col * size), max(y0, row * size)
+                ax1, ay1 = min(x1, (col + 1) * size), min(y1, (row + 1) * size)
+                out[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = tile[ay0 - top:ay1 - top, ax0 - left:ax1 - left]
+        return out
+
+
+def serve_tiles(directory, port=TILE_PORT, host='127.0.0.1'):
+    """Serve a directory of pyramids over HTTP from a daemon thread; returns the server"""
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class TileHandler(SimpleHTTPRequestHandler):
+        def end_headers(self):
+            # Tiles never change once written
+            self.send_header("Cache-Control", "public, max-age=86400")
+            super().end_headers()
+
+        def log_message(self, format, *args):
+            pass  # Keep tile requests out of the console
+
+    server = ThreadingHTTPServer((host, port), partial(TileHandler, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="tile-http", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, serve and read Deep Zoom tile pyramids")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="turn an image into a pyramid")
+    build.add_argument('image')
+    build.add_argument('output', help="output path without extension (writes <output>.dzi and <output>_files/)")
+    serve = commands.add_parser('serve', help="serve a directory of pyramids over HTTP")
+    serve.add_argument('directory')
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=TILE_PORT)
+    fetch = commands.add_parser('fetch', help="fetch a region from a local or remote pyramid")
+    fetch.add_argument('source', help=".dzi path or URL")
+    fetch.add_argument('--width', type=int, help="pick the level closest to this width (default: full size)")
+    fetch.add_argument('--level', type=int, help="level to read (overrides --width)")
+    fetch.add_argument('--region', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'),
+                       help="pixel region on that level (default: all of it)")
+    fetch.add_argument('--output', default='region.jpg')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if image is None:
+            parser.error(f"cannot read {args.image}")
+        print(f"Pyramid written to {write_pyramid(image, args.output)}")
+    elif args.command == 'serve':
+        server = serve_tiles(args.directory, args.port, args.host)
+        print(f"Serving tiles from {args.directory} on http://{args.host}:{args.port}/")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        reader = DeepZoomReader(args.source)
+        if args.level is not None:
+            level = args.level
+        elif args.width:
+            level = reader.level_for_width(args.width)
+        else:
+            level = reader.levels - 1
+        image = reader.region(level, *(args.region or ()))
+        cv2.imwrite(args.output, image)
+        print(f"Level {level} region {image.shape[1]}x{image.shape[0]} from {reader.tiles_read} tiles "
+              f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Fixed tile grids over video frames
+
+Shared by the server's motion-gated encoder and the tiled live stream:
+frames are cut into tile_size x tile_size tiles, change is measured per
+tile on a downscaled grayscale copy, and contiguous runs of changed tiles
+are handed to the encoder as rectangles.
+
+Live stream updates (MSG_FRAME payloads) carry JPEG-encoded rectangles of
+tiles (usually runs within one tile row, or the whole frame when most of
+it changed); a TileCanvas on the receiving side pastes them into a
+persistent frame. Keyframes carry every tile.
+
+    +-------------+-------+--------+-----------+-------+-------------+
+    | frame index | width | height | tile size | flags | span count  |
+    | u32         | u16   | u16    | u16       | u8    | u16         |
+    +-------------+-------+--------+-----------+-------+-------------+
+    then per span: first row u16, end row u16, first col u16, end col u16,
+                   JPEG length u32, JPEG
+"""
+import hashlib
+import struct
+import threading
+
+from lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+DEFAULT_TILE_SIZE = 32
+DETECT_SCALE = 4  # Change detection runs on a 1/4 scale grayscale image
+
+UPDATE_HEADER = struct.Struct('!IHHHBH')
+SPAN_HEADER = struct.Struct('!HHHHI')
+FLAG_KEYFRAME = 0x01
+
+
+class TileGrid:
+    """Tile layout of a frame of the given (height, width)"""
+
+    def __init__(self, height, width, tile_size=DEFAULT_TILE_SIZE):
+        self.height = height
+        self.width = width
+        self.tile_size = tile_size
+        self.rows = -(-height // tile_size)
+        self.cols = -(-width // tile_size)
+
+    @classmethod
+    def for_frame(cls, frame, tile_size=DEFAULT_TILE_SIZE):
+        return cls(frame.shape[0], frame.shape[1], tile_size)
+
+    def matches(self, frame):
+        return frame.shape[0] == self.height and frame.shape[1] == self.width
+
+    def rect(self, row, col_start, col_end=None, row_end=None):
+        """Pixel rectangle (x0, y0, x1, y1) of tiles col_start..col_end-1 in rows row..row_end-1"""
+        col_end = col_start + 1 if col_end is None else col_end
+        row_end = row + 1 if row_end is None else row_end
+        x0 = col_start * self.tile_size
+        y0 = row * self.tile_size
+        return (x0, y0, min(col_end * self.tile_size, self.width),
+                min(row_end * self.tile_size, self.height))
+
+    def tile_means(self, image):
+        """Mean of a single-channel image over every tile, as a (rows, cols) float32 array"""
+        return cv2.resize(image.astype(np.float32, copy=False), (self.cols, self.rows),
+                          interpolation=cv2.INTER_AREA)
+
+    def expand(self, mask, height, width):
+        """Blow a (rows, cols) tile mask up to a (height, width) pixel mask"""
+        return cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+
+def detection_image(gray):
+    """Downscaled grayscale frame used for change detection"""
+    height, width = gray.shape[:2]
+    return cv2.resize(gray, (max(1, width // DETECT_SCALE), max(1, height // DETECT_SCALE)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def frame_features(frame):
+    """Mean brightness and detection image of a BGR frame (the per-frame analysis work)"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return float(np.mean(gray)), detection_image(gray)
+
+
+def encode_rects(frame, target, rects):
+    """
+    JPEG round-trip each (x0, y0, x1, y1, quality) region of frame into target
+
+    Returns the number of JPEG bytes produced.
+    """
+    encoded = 0
+    for x0, y0, x1, y1, quality in rects:
+        _, jpeg = cv2.imencode('.jpg', frame[y0:y1, x0:x1], [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        encoded += len(jpeg)
+        target[y0:y1, x0:x1] = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+    return encoded
+
+
+def tile_differences(reference, current, grid):
+    """Mean absolute difference per tile between two detection images"""
+    return grid.tile_means(cv2.absdiff(reference, current))
+
+
+def changed_tiles(reference, current, grid, threshold):
+    """Boolean (rows, cols) mask of tiles whose mean difference exceeds threshold"""
+    return tile_differences(reference, current, grid) > threshold
+
+
+def row_spans(mask, max_gap=1):
+    """
+    Runs of set tiles per row as (row, col_start, col_end)
+
+    Runs separated by up to max_gap clear tiles are merged, since one
+    slightly larger rectangle encodes cheaper than two small ones.
+    """
+    spans = []
+    for row in np.flatnonzero(mask.any(axis=1)):
+        cols = np.flatnonzero(mask[row])
+        start = previous = cols[0]
+        for col in cols[1:]:
+            if col - previous > max_gap + 1:
+                spans.append((int(row), int(start), int(previous) + 1))
+                start = col
+            previous = col
+        spans.append((int(row), int(start), int(previous) + 1))
+    return spans
+
+
+def tile_hashes(frame, grid):
+    """64-bit content hash of every tile, as a (rows, cols) uint64 array"""
+    hashes = np.empty((grid.rows, grid.cols), dtype=np.uint64)
+    size = grid.tile_size
+    for row in range(grid.rows):
+        for col in range(grid.cols):
+            tile = frame[row * size:(row + 1) * size, col * size:(col + 1) * size]
+            digest = hashlib.blake2b(np.ascontiguousarray(tile).data, digest_size=8).digest()
+            hashes[row, col] = int.from_bytes(digest, 'little')
+    return hashes
+
+
+def encode_tile_update(frame_index, grid, spans, keyframe=False):
+    """Build a live-stream payload from [(row, row_end, col_start, col_end, jpeg bytes), ...]"""
+    parts = [UPDATE_HEADER.pack(frame_index, grid.width, grid.height, grid.tile_size,
+                                FLAG_KEYFRAME if keyframe else 0, len(spans))]
+    for row, row_end, col_start, col_end, jpeg in spans:
+        parts.append(SPAN_HEADER.pack(row, row_end, col_start, col_end, len(jpeg)))
+        parts.append(jpeg)
+    return b''.join(parts)
+
+
+def decode_tile_update(payload):
+    """Parse a live-stream payload; returns (header dict, [(row, row_end, col_start, col_end, jpeg view), ...])"""
+    view = memoryview(payload)
+    frame_index, width, height, tile_size, flags, count = UPDATE_HEADER.unpack_from(view)
+    offset = UPDATE_HEADER.size
+    spans = []
+    for _ in range(count):
+        row, row_end, col_start, col_end, length = SPAN_HEADER.unpack_from(view, offset)
+        offset += SPAN_HEADER.size
+        spans.append((row, row_end, col_start, col_end, view[offset:offset + length]))
+        offset += length
+    header = {
+        'frame_index': frame_index,
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'keyframe': bool(flags & FLAG_KEYFRAME),
+    }
+    return header, spans
+
+
+class TileCanvas:
+    """
+    Persistent frame rebuilt from live-stream tile updates
+
+    The network thread applies updates; the player and the panorama
+    builder read snapshots. Deltas arriving before the first keyframe are
+    ignored. Optionally every Nth rebuilt frame is appended to a frame
+    store (e.g. FrameStore) for stitching; recording stops if the stream
+    changes resolution. The frames carry the server's text overlays, so
+    their tiles change with every update and they show in a panorama
+    built from the stream, as in one built from a recording.
+    """
+
+    def __init__(self):
+        self.image = None
+        self.grid = None
+        self.frame_index = -1
+        self.version = 0
+        self.keyframes = 0
+        self.updates = 0
+        self.tiles = 0
+        self.lock = threading.Lock()
+        self.recorder = None
+        self.record_every = 1
+        self.record_limit = None
+
+    def apply(self, payload):
+        """Paste one update into the canvas; returns False if it could not be applied"""
+        header, spans = decode_tile_update(payload)
+        with self.lock:
+            if header['keyframe']:
+                shape = (header['height'], header['width'], 3)
+                if self.image is None or self.image.shape != shape:
+                    self.image = np.zeros(shape, dtype=np.uint8)
+                self.grid = TileGrid(header['height'], header['width'], header['tile_size'])
+                self.keyframes += 1
+            elif self.image is None:
+                return False  # Wait for a keyframe
+            for row, row_end, col_start, col_end, jpeg in spans:
+                x0, y0, x1, y1 = self.grid.rect(row, col_start, col_end, row_end)
+                tile = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if tile is None or tile.shape[0] != y1 - y0 or tile.shape[1] != x1 - x0:
+                    continue
+                self.image[y0:y1, x0:x1] = tile
+                self.tiles += (row_end - row) * (col_end - col_start)
+            self.frame_index = header['frame_index']
+            self.updates += 1
+            self.version += 1
+            if self.recorder is not None and self.updates % self.record_every == 0:
+                if self.record_limit is None or len(self.recorder) < self.record_limit:
+                    try:
+                        self.recorder.append(self.image)
+                    except ValueError:
+                        # The stream changed resolution (or the store was closed): keep
+                        # the frames recorded so far rather than fail the network thread
+                        self.recorder = None
+        return True
+
+    def snapshot(self):
+        """Copy of the current frame (None before the first keyframe)"""
+        with self.lock:
+            return None if self.image is None else self.image.copy()
+
+    def record(self, store, every=1, limit=None):
+        """Append every Nth rebuilt frame to store, up to limit frames (None stops recording)"""
+        with self.lock:
+            self.recorder = store
+            self.record_every = max(1, every)
+            self.record_limit = limit
@@ -1,107 +1,313 @@
-import cv2
-import numpy as np
 import os
 import time
 from datetime import datetime
 import threading
 import queue
-import zipfile
 import socket
-import struct
 import glob
-
-# Global variables for federated learning simulation
-model_updates_queue = queue.Queue()
-current_model_version = 0
-is_recording = False
-recording_start_time = None
+import select
+import sys
+import json
+import random
+import argparse
+from urllib.parse import urlsplit, parse_qsl
+
+# Modules shared by the client, server and panorama scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from lazy import lazy_import, prewarm
+from metrics import (REGISTRY, FRAMES_DROPPED, QUEUE_DEPTH, CLIENT_BYTES, timed,
+                     start_metrics_server, start_json_dump)
+from framing import (FramedConnection, ProtocolError, encode_file_begin, MSG_HELLO, MSG_PING, MSG_PONG,
+                     MSG_QUIT, MSG_FILE_BEGIN, MSG_FILE_CHUNK, MSG_FILE_END, MSG_FILE_ERROR,
+                     MSG_BROADCAST_BEGIN, MSG_BROADCAST_STATUS, MSG_FRAME, MSG_MODEL_UPDATE)
+from compression import negotiate, is_compressible, load_dictionary
+from tiles import (TileGrid, detection_image, tile_differences, row_spans, tile_hashes, encode_tile_update,
+                   frame_features, encode_rects)
+from fountain import (FountainEncoder, Pacer, open_multicast_sender, send_packets, interleave,
+                      DEFAULT_GROUP, DEFAULT_PORT)
+from frame_sources import open_source
+from pose import DEFAULT_HFOV, PoseWriter, SIDECAR_SUFFIX
+from secure_aggregation import secure_sum
+from offload import OffloadPool, SharedFrameSlab, write_zip
+from frame_ring import FrameRing
+
+# Heavy modules load on first use; main() warms them up while the transfer server starts
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
 
 # Global variables for server
 connected_clients = []
 server_socket = None
 auto_send_zip = True  # Automatically send zip files to clients
+PING_INTERVAL = 1.0      # Seconds between keep-alive pings
+CLIENT_TIMEOUT = 30.0    # Drop clients silent for this long (longer than typical link outages)
+FILE_CHUNK_SIZE = 256 * 1024
+
+# Optional dictionary for control messages, trained with common/compression.py
+COMPRESSION_DICTIONARY = load_dictionary("control.dict")
+
+# Multicast broadcast mode: one fountain-coded UDP stream for all clients
+broadcast_mode = False
+BROADCAST_GROUP = DEFAULT_GROUP
+BROADCAST_PORT = DEFAULT_PORT
+BROADCAST_TTL = 1              # Raise to cross routers
+BROADCAST_RATE_MBPS = 20.0     # Constant egress, whatever the number of clients
+BROADCAST_ROUND_GAP = 0.5      # Pause between rounds for receivers to report
+BROADCAST_TIMEOUT = 120.0      # Give up on multicast (and fall back to TCP) after this
+BROADCAST_MAX_OVERHEAD = 3.0   # Never send more than this multiple of the file size
+INTERLEAVE_BLOCKS = 8          # Blocks sent round-robin to spread loss bursts
+broadcast_status = {}          # transfer id -> {client addr: latest status}
+broadcast_lock = threading.Lock()
+
+# Instrumentation: Prometheus text on http://127.0.0.1:METRICS_PORT/metrics
+METRICS_PORT = 9100
+METRICS_DUMP_PATH = "server_metrics.json"
+METRICS_DUMP_INTERVAL = 10.0
+
+CONNECTED_CLIENTS = REGISTRY.gauge("haps_connected_clients", "Clients connected to the transfer server")
+CONNECTED_CLIENTS.set_function(lambda: len(connected_clients))
+ENCODED_TILES = REGISTRY.counter(
+    "haps_encoded_tiles_total", "Tiles by how the motion-gated encoder handled them",
+    ("kind",))
+ENCODED_BYTES = REGISTRY.counter("haps_encoded_bytes_total", "JPEG bytes produced by the frame encoder")
+
+# Motion / ROI gating
+MOTION_THRESHOLD = 4.0      # Mean abs grey-level change for a tile to count as changed
+INTEREST_DECAY = 0.9        # Per-frame decay of a tile's interest after it stops changing
+ROI_INTEREST = 0.3          # Tiles above this interest are encoded at ROI quality
+ROI_QUALITY_BOOST = 25      # ROI quality = compression quality + this
+FULL_FRAME_FRACTION = 0.6   # Above this fraction of changed tiles, encode the whole frame
+REFRESH_SECONDS = 2.0       # Full refresh interval, so encoding errors never accumulate
+
+# Tiled live stream
+live_streaming = False
+LIVE_QUALITY = 60
+LIVE_THRESHOLD = 2.0        # Mean abs grey-level change for a live tile to be resent
+LIVE_FULL_FRACTION = 0.5    # Above this fraction of changed tiles, send one whole-frame JPEG
+LIVE_KEYFRAME_SECONDS = 5.0  # Periodic full refresh of every tile
+# Process-pool offload of encoding, analysis and zipping (--workers N; None runs everything in-process)
+offload_pool = None
+INPUT_SLOT = 0       # Slots of a processor's shared frame slab
+REFERENCE_SLOT = 1
+
+# Processed frames of each source live in a shared memory ring that the display, the live
+# stream and other local processes read in place (see frame_ring.py)
+RING_SLOTS = 8
+
+# Control API (replaces the key bindings when running headless)
+CONTROL_PORT = 9102
+CONTROL_TIMEOUT = 30.0      # Seconds an HTTP request waits for the capture loop to run its command
+CAPTURE_RETRIES = 50        # Consecutive failed reads of a live source before giving up on it
+CAPTURE_RETRY_DELAY = 0.02
+CAPTURED_FRAMES = REGISTRY.counter("haps_captured_frames_total", "Frames read per frame source", ("source",))
+
+LIVE_TILES = REGISTRY.counter("haps_live_tiles_total", "Live stream tiles sent or skipped", ("kind",))
+LIVE_BYTES = REGISTRY.counter("haps_live_bytes_total", "Live stream payload bytes sent to all clients")
 
 
 class VideoProcessor:
-    def __init__(self, resolution=(640, 480), fps=30.0, codec='XVID'):
+    def __init__(self, resolution=(640, 480), fps=30.0, codec='XVID', name=None, aggregator=None, pool=None,
+                 hfov=DEFAULT_HFOV):
+        self.name = name  # Source label, used in file names and the overlay when there are several
         self.resolution = resolution
         self.fps = fps
         self.codec = cv2.VideoWriter_fourcc(*codec)
         self.output_file = None
+        self.output_filename = None
+        self.hfov = hfov  # Camera field of view, written to the pose sidecar
+        self.pose_log = None  # Sidecar with one pose per recorded frame, opened on the first pose
+        self.frames_recorded = 0
         self.frame_buffer = []
         self.compression_quality = 50  # JPEG compression quality (0-100)
         self.record_path = "recordings"
+        self.is_recording = False
+        self.recording_start_time = None
+        self.lock = threading.Lock()  # Held while a frame is processed; commands take it too
+        self.aggregator = aggregator or federated_aggregator
 
         # Create recording directory if it doesn't exist
         if not os.path.exists(self.record_path):
             os.makedirs(self.record_path)
 
         # Simple "model" for frame analysis (placeholder for actual ML model)
-        self.frame_analyzer = SimpleFrameAnalyzer()
+        self.frame_analyzer = SimpleFrameAnalyzer(aggregator=self.aggregator, source=name)
+
+        # With a pool, frames are handed to worker processes through shared memory
+        self.pool = pool
+        self.slab = None
+        self.resized = None  # Reused resize buffer (in-process mode)
+        if pool is not None:
+            self.slab = SharedFrameSlab((resolution[1], resolution[0], 3), slots=2)
+
+        # Motion-gated encoding: only changed tiles are re-encoded into the reference
+        self.motion_gating = True
+        self.reference = None
+        self.frames_since_refresh = 0
+        self.refresh_interval = max(1, int(fps * REFRESH_SECONDS))
+        self.changed_fraction = 1.0
 
     def start_recording(self):
-        global is_recording, recording_start_time
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = os.path.join(self.record_path, f"video_{timestamp}.avi")
+        prefix = f"video_{self.name}_" if self.name else "video_"
+        output_filename = os.path.join(self.record_path, f"{prefix}{timestamp}.avi")
         self.output_file = cv2.VideoWriter(
             output_filename,
             self.codec,
             self.fps,
             self.resolution
         )
-        is_recording = True
-        recording_start_time = time.time()
+        self.output_filename = output_filename
+        self.frames_recorded = 0
+        self.is_recording = True
+        self.recording_start_time = time.time()
         print(f"Recording started: {output_filename}")
         return output_filename
 
-    def stop_recording(self):
-        global is_recording
+    def stop_recording(self, archive=True):
+        """Close the recording; with archive, also zip recordings and auto-send the zip"""
         if self.output_file is not None:
             self.output_file.release()
             self.output_file = None
-            is_recording = False
-            duration = time.time() - recording_start_time
-            print(f"Recording stopped. Duration: {duration:.2f} seconds")
-            zip_file = zip_recordings()
-
-            # Automatically send zip to all connected clients
-            if auto_send_zip and zip_file and connected_clients:
-                print(f"Auto-sending zip file to {len(connected_clients)} clients...")
-                send_zip_to_all_clients(zip_file)
-
-    def compress_frame(self, frame):
+            if self.pose_log is not None:
+                self.pose_log.close()
+                self.pose_log = None
+            self.is_recording = False
+            duration = time.time() - self.recording_start_time
+            print(f"Recording stopped{f' ({self.name})' if self.name else ''}. Duration: {duration:.2f} seconds")
+            if archive:
+                archive_recordings()
+
+    def compress_frame(self, frame, quality=None):
         # Compress frame using JPEG compression
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.compression_quality]
+        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality or self.compression_quality]
         _, compressed = cv2.imencode('.jpg', frame, encode_param)
+        ENCODED_BYTES.inc(len(compressed))
         return cv2.imdecode(compressed, cv2.IMREAD_COLOR)
 
-    def process_frame(self, frame):
+    def close(self):
+        """Release the shared frame slab (pool mode)"""
+        if self.slab is not None:
+            self.reference = None
+            self.slab.close()
+            self.slab = None
+
+    def encode_into_reference(self, frame, rects):
+        """JPEG round-trip (x0, y0, x1, y1, quality) rects of frame into the reference, in a worker when pooled"""
+        if self.reference is None or self.reference.shape != frame.shape:
+            self.reference = self.slab.frame(REFERENCE_SLOT) if self.slab is not None else np.empty_like(frame)
+        if self.pool is not None:
+            encoded = self.pool.encode(self.slab, INPUT_SLOT, REFERENCE_SLOT, rects)
+        else:
+            encoded = encode_rects(frame, self.reference, rects)
+        ENCODED_BYTES.inc(encoded)
+        return self.reference
+
+    def encode_changes(self, frame, analysis):
+        """
+        Update the reference frame with only the tiles that changed
+
+        Static frames cost nothing, changed tiles are JPEG-encoded as row
+        spans, recently active (high-interest) tiles get a higher quality,
+        and a periodic full refresh bounds accumulated error.
+        """
+        grid = self.frame_analyzer.grid
+        total = grid.rows * grid.cols
+        changed = analysis['changed']
+        changed_count = int(changed.sum())
+        self.changed_fraction = changed_count / total
+        self.frames_since_refresh += 1
+
+        if (self.reference is None or self.reference.shape != frame.shape
+                or self.frames_since_refresh >= self.refresh_interval
+                or self.changed_fraction > FULL_FRAME_FRACTION):
+            self.encode_into_reference(frame, [(0, 0, frame.shape[1], frame.shape[0], self.compression_quality)])
+            self.frames_since_refresh = 0
+            self.frame_analyzer.accept_tiles(None)
+            ENCODED_TILES.labels("refresh").inc(total)
+            return self.reference
+
+        ENCODED_TILES.labels("static").inc(total - changed_count)
+        if not changed_count:
+            return self.reference
+
+        roi_quality = min(95, self.compression_quality + ROI_QUALITY_BOOST)
+        interest = analysis['interest']
+        rects = []
+        for row, col_start, col_end in row_spans(changed):
+            roi = interest[row, col_start:col_end].max() > ROI_INTEREST
+            quality = roi_quality if roi else self.compression_quality
+            rects.append(grid.rect(row, col_start, col_end) + (quality,))
+            ENCODED_TILES.labels("roi" if roi else "changed").inc(col_end - col_start)
+        self.encode_into_reference(frame, rects)
+        self.frame_analyzer.accept_tiles(changed)
+        return self.reference
+
+    def process_frame(self, frame, out=None, pose=None):
+        """
+        Encode, annotate and record one frame; the result is written to out when given (e.g. a ring slot)
+
+        pose (the source's telemetry for the frame) is logged to the
+        recording's pose sidecar.
+        """
         # Resize frame to target resolution
-        frame = cv2.resize(frame, self.resolution)
-
-        # Apply compression
-        compressed_frame = self.compress_frame(frame)
-
-        # Process with frame analyzer (simulated federated learning)
-        self.frame_analyzer.analyze_frame(compressed_frame)
+        with timed('resize'):
+            if self.slab is not None:
+                # Straight into shared memory, where the workers read it
+                frame = cv2.resize(frame, self.resolution, dst=self.slab.frame(INPUT_SLOT))
+            else:
+                frame = self.resized = cv2.resize(frame, self.resolution, dst=self.resized)
+        if out is None:
+            out = np.empty_like(frame)
+
+        # Process with frame analyzer (simulated federated learning); also finds changed tiles
+        with timed('analyze'):
+            features = self.pool.analyze(self.slab, INPUT_SLOT) if self.pool is not None else None
+            analysis = self.frame_analyzer.analyze_frame(frame, features)
+
+        # Apply compression (only to what changed when motion gating is on)
+        with timed('compress'):
+            compressed_frame = out
+            full_frame = [(0, 0, frame.shape[1], frame.shape[0], self.compression_quality)]
+            if self.motion_gating:
+                np.copyto(out, self.encode_changes(frame, analysis))
+            else:
+                self.changed_fraction = 1.0
+                if self.pool is not None:
+                    np.copyto(out, self.encode_into_reference(frame, full_frame))
+                else:
+                    ENCODED_BYTES.inc(encode_rects(frame, out, full_frame))
+                # The analyzer (and without a pool, the reference) fell behind: resume gating with a full refresh
+                self.frames_since_refresh = self.refresh_interval
 
         # Add text overlays
-        self.add_frame_info(compressed_frame)
+        with timed('overlay'):
+            self.add_frame_info(compressed_frame)
 
         # Save frame if recording
-        if is_recording and self.output_file is not None:
-            self.output_file.write(compressed_frame)
+        if self.is_recording and self.output_file is not None:
+            with timed('write'):
+                self.output_file.write(compressed_frame)
+                if pose is not None:
+                    if self.pose_log is None:
+                        self.pose_log = PoseWriter(self.output_filename, hfov=self.hfov)
+                    self.pose_log.write(self.frames_recorded, t=round(time.time() - self.recording_start_time, 3),
+                                        **pose)
+            self.frames_recorded += 1
 
         return compressed_frame
 
     def add_frame_info(self, frame):
-        # Add timestamp
+        # Add timestamp (and source label)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.name:
+            timestamp = f"[{self.name}] {timestamp}"
         cv2.putText(frame, timestamp, (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
         # Add compression info
         comp_text = f"Compression: {self.compression_quality}%"
+        if self.motion_gating:
+            comp_text += f" | Changed: {self.changed_fraction * 100:.0f}%"
         cv2.putText(frame, comp_text, (10, 60),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
@@ -111,19 +317,19 @@ class VideoProcessor:
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
         # Add recording indicator
-        if is_recording:
+        if self.is_recording:
             # Flashing red circle
             if int(time.time() * 2) % 2 == 0:
                 cv2.circle(frame, (frame.shape[1] - 30, 30), 10, (0, 0, 255), -1)
 
             # Recording duration
-            duration = time.time() - recording_start_time
+            duration = time.time() - self.recording_start_time
             duration_text = f"REC {int(duration // 60):02d}:{int(duration % 60):02d}"
             cv2.putText(frame, duration_text, (frame.shape[1] - 150, 30),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
         # Add model version info
-        model_text = f"Model v{current_model_version}"
+        model_text = f"Model v{self.aggregator.version}"
         cv2.putText(frame, model_text, (10, frame.shape[0] - 40),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
@@ -133,18 +339,166 @@ class VideoProcessor:
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if auto_send_zip else (0, 0, 255), 2)
 
 
+class LiveStreamer:
+    """
+    Tiled delta transport for the live view
+
+    The capture loop hands over the latest frame; a sender thread splits it
+    into fixed tiles, hashes them and resends only tiles whose content hash
+    changed and whose difference from what clients last got is above
+    LIVE_THRESHOLD. Keyframes with every tile go out periodically and
+    whenever a client joins. If the sender falls behind, older frames are
+    dropped rather than queued.
+    """
+
+    def __init__(self, tile_size=32, quality=LIVE_QUALITY):
+        self.tile_size = tile_size
+        self.quality = quality
+        self.grid = None
+        self.sent_hashes = None
+        self.sent_detection = None
+        self.frame_index = 0
+        self.last_keyframe = 0.0
+        self.streams = {}  # client connection -> live stream id
+        self.latest = None  # (frame ring, sequence) not picked up yet
+        self.buffer = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="live-stream", daemon=True)
+        self.thread.start()
+
+    def submit(self, ring, sequence):
+        """Offer a published ring frame; replaces any frame the sender has not picked up yet"""
+        with self.condition:
+            if self.latest is not None:
+                FRAMES_DROPPED.labels("live").inc()
+            self.latest = (ring, sequence)
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.latest is None:
+                    self.condition.wait()
+                (ring, sequence), self.latest = self.latest, None
+            clients = list(connected_clients)
+            if not clients:
+                continue
+            # Copy out of the ring: encoding takes longer than the producer takes to lap it
+            if self.buffer is None or self.buffer.shape != ring.shape:
+                self.buffer = np.empty(ring.shape, dtype=np.uint8)
+            frame = ring.read(sequence, self.buffer)
+            if frame is None:
+                FRAMES_DROPPED.labels("live").inc()
+                continue
+            try:
+                with timed('live_encode'):
+                    payload = self.encode(frame, clients)
+            except Exception as e:
+                print(f"Live stream encode error: {e}")
+                continue
+            if payload is not None:
+                self.send(payload, clients)
+
+    def encode(self, frame, clients):
+        """Tile update for frame, or None when nothing changed"""
+        new_clients = [conn for conn, _ in clients if conn not in self.streams]
+        for conn in new_clients:
+            self.streams[conn] = conn.new_stream_id()
+        current = {conn for conn, _ in clients}
+        for conn in list(self.streams):
+            if conn not in current:
+                del self.streams[conn]
+
+        if self.grid is None or not self.grid.matches(frame):
+            self.grid = TileGrid.for_frame(frame, self.tile_size)
+            self.sent_hashes = None
+        hashes = tile_hashes(frame, self.grid)
+        detection = detection_image(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+        now = time.time()
+        keyframe = (self.sent_hashes is None or bool(new_clients)
+                    or now - self.last_keyframe >= LIVE_KEYFRAME_SECONDS)
+        if keyframe:
+            changed = np.ones((self.grid.rows, self.grid.cols), bool)
+            self.last_keyframe = now
+        else:
+            changed = (hashes != self.sent_hashes) & \
+                (tile_differences(self.sent_detection, detection, self.grid) > LIVE_THRESHOLD)
+
+        total = self.grid.rows * self.grid.cols
+        sent = int(changed.sum())
+        LIVE_TILES.labels("skipped").inc(total - sent)
+        if not sent:
+            return None
+        LIVE_TILES.labels("keyframe" if keyframe else "sent").inc(sent)
+
+        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        if keyframe or sent > LIVE_FULL_FRACTION * total:
+            # One JPEG beats many small ones once most of the frame changed
+            changed[:] = True
+            rects = [(0, self.grid.rows, 0, self.grid.cols)]
+        else:
+            rects = [(row, row + 1, col_start, col_end) for row, col_start, col_end in row_spans(changed)]
+        spans = []
+        for row, row_end, col_start, col_end in rects:
+            x0, y0, x1, y1 = self.grid.rect(row, col_start, col_end, row_end)
+            _, jpeg = cv2.imencode('.jpg', frame[y0:y1, x0:x1], encode_param)
+            spans.append((row, row_end, col_start, col_end, jpeg.tobytes()))
+
+        # Remember what clients now hold, tile by tile
+        if changed.all():
+            self.sent_hashes = hashes
+            self.sent_detection = detection.copy()
+        else:
+            self.sent_hashes[changed] = hashes[changed]
+            mask = self.grid.expand(changed, *detection.shape[:2])
+            self.sent_detection[mask] = detection[mask]
+
+        self.frame_index += 1
+        return encode_tile_update(self.frame_index, self.grid, spans, keyframe)
+
+    def send(self, payload, clients):
+        for conn, addr in clients:
+            stream_id = self.streams.get(conn)
+            if stream_id is None:
+                continue
+            try:
+                conn.send_frame(MSG_FRAME, payload, stream_id)
+                LIVE_BYTES.inc(len(payload))
+            except OSError as e:
+                print(f"Live stream to {addr} failed: {e}")
+                self.streams.pop(conn, None)
+
+
 class SimpleFrameAnalyzer:
     """Simulates a federated learning model that analyzes frames"""
 
-    def __init__(self):
+    def __init__(self, tile_size=32, motion_threshold=MOTION_THRESHOLD, aggregator=None, source=None):
+        self.aggregator = aggregator or federated_aggregator
+        self.source = source
         self.frame_count = 0
         self.update_interval = 30  # Generate model update every 30 frames
         self.features_buffer = []
 
-    def analyze_frame(self, frame):
+        # Motion / region-of-interest state, per tile
+        self.tile_size = tile_size
+        self.motion_threshold = motion_threshold
+        self.grid = None
+        self.reference = None   # Detection image of what the encoder last sent, per tile
+        self.current = None
+        self.interest = None
+
+    def analyze_frame(self, frame, features=None):
+        """
+        One pass per frame: brightness feature plus changed tiles and interest
+
+        Tiles are compared with the last encoded state rather than the
+        previous frame, so slow drift still triggers an update eventually.
+        features is (brightness, detection image) when a worker process
+        already computed them.
+        """
         # Extract "features" (simplified for demonstration)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        avg_brightness = np.mean(gray)
+        avg_brightness, current = features if features is not None else frame_features(frame)
         self.features_buffer.append(avg_brightness)
 
         self.frame_count += 1
@@ -153,10 +507,29 @@ class SimpleFrameAnalyzer:
         if self.frame_count % self.update_interval == 0:
             self.generate_model_update()
 
+        self.current = current
+        if self.grid is None or not self.grid.matches(frame) or self.reference is None \
+                or self.reference.shape != self.current.shape:
+            self.grid = TileGrid.for_frame(frame, self.tile_size)
+            self.interest = np.zeros((self.grid.rows, self.grid.cols), np.float32)
+            changed = np.ones((self.grid.rows, self.grid.cols), bool)
+        else:
+            changed = tile_differences(self.reference, self.current, self.grid) > self.motion_threshold
+
+        self.interest *= INTEREST_DECAY
+        self.interest[changed] = 1.0
+        return {'brightness': avg_brightness, 'changed': changed, 'interest': self.interest}
+
+    def accept_tiles(self, tiles):
+        """Record that the encoder sent these tiles (None: the whole frame)"""
+        if tiles is None or self.reference is None:
+            self.reference = self.current.copy()
+            return
+        mask = self.grid.expand(tiles, *self.current.shape[:2])
+        self.reference[mask] = self.current[mask]
+
     def generate_model_update(self):
         """Simulate generating a model update from collected features"""
-        global model_updates_queue
-
         if not self.features_buffer:
             return
 
@@ -166,49 +539,52 @@ class SimpleFrameAnalyzer:
             'frame_count': self.frame_count
         }
 
-        # Add to queue for the federated learning process
-        model_updates_queue.put(update)
+        # Hand over to the federated learning process
+        self.aggregator.submit(update, self.source)
 
         # Clear buffer
         self.features_buffer = []
 
 
-def send_file(conn, file_path):
-    """Send a file to the connected client"""
+def send_file(conn, file_path, client=None):
+    """Send a file to the connected client as FILE_BEGIN / FILE_CHUNK... / FILE_END frames"""
+    sent_bytes = CLIENT_BYTES.labels(client or "unknown", "sent")
+    stream_id = conn.new_stream_id()
     try:
         # Check if file exists
         if not os.path.exists(file_path):
             print(f"File {file_path} does not exist!")
-            conn.send(struct.pack('!Q', 0))
+            conn.send_frame(MSG_FILE_ERROR, b"file not found", stream_id)
             return False
 
         # Get file size
         file_size = os.path.getsize(file_path)
         print(f"Sending file: {file_path} ({file_size} bytes)")
 
-        # Send file size first
-        conn.send(struct.pack('!Q', file_size))
-
-        # Send file name
+        # Announce size and name on the file's own stream
         file_name = os.path.basename(file_path)
-        file_name_bytes = file_name.encode('utf-8')
-        conn.send(struct.pack('!I', len(file_name_bytes)))
-        conn.send(file_name_bytes)
+        conn.send_frame(MSG_FILE_BEGIN, encode_file_begin(file_size, file_name), stream_id)
 
-        # Send file data in chunks
-        with open(file_path, 'rb') as f:
+        # Send file data in chunks; control frames (PING) can go out between them
+        with open(file_path, 'rb') as f, timed('send'):
+            # Compress only when negotiated and the file is not already compressed media
+            compress = conn.codec is not None and is_compressible(file_name, f.read(16))
+            f.seek(0)
             bytes_sent = 0
             while bytes_sent < file_size:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                conn.send(chunk)
-                bytes_sent += len(chunk)
+                count = min(FILE_CHUNK_SIZE, file_size - bytes_sent)
+                if compress:
+                    conn.send_frame(MSG_FILE_CHUNK, f.read(count), stream_id, compress=True)
+                else:
+                    conn.send_file_chunk(MSG_FILE_CHUNK, stream_id, f, bytes_sent, count)
+                bytes_sent += count
+                sent_bytes.inc(count)
 
                 # Show progress
                 progress = (bytes_sent / file_size) * 100
                 print(f"Progress: {progress:.1f}% ({bytes_sent}/{file_size} bytes)", end='\r')
 
+        conn.send_frame(MSG_FILE_END, b'', stream_id)
         print(f"\nFile sent successfully to client!")
         return True
 
@@ -223,18 +599,18 @@ def send_zip_to_all_clients(zip_file_path):
         print("No clients connected to send zip file")
         return
 
+    if broadcast_mode:
+        broadcast_file(zip_file_path)
+        return
+
     disconnected_clients = []
 
-    for client_conn, client_addr in connected_clients:
-        try:
-            print(f"Sending zip to client {client_addr}")
-            client_conn.send(b'FILE   ')  # Send file type
-            if send_file(client_conn, zip_file_path):
-                print(f"Zip file sent successfully to {client_addr}")
-            else:
-                print(f"Failed to send zip file to {client_addr}")
-        except Exception as e:
-            print(f"Error sending to client {client_addr}: {e}")
+    for client_conn, client_addr in list(connected_clients):
+        print(f"Sending zip to client {client_addr}")
+        if send_file(client_conn, zip_file_path, f"{client_addr[0]}:{client_addr[1]}"):
+            print(f"Zip file sent successfully to {client_addr}")
+        else:
+            print(f"Failed to send zip file to {client_addr}")
             disconnected_clients.append((client_conn, client_addr))
 
     # Remove disconnected clients
@@ -244,25 +620,169 @@ def send_zip_to_all_clients(zip_file_path):
             client[0].close()
 
 
+def _broadcast_needs(transfer_id, clients, encoder):
+    """Repair symbols to send per block: the most any pending client still needs, plus a margin"""
+    with broadcast_lock:
+        statuses = dict(broadcast_status.get(transfer_id, {}))
+    needs = {}
+    reported = False
+    for _, addr in clients:
+        status = statuses.get(addr)
+        if status is None:
+            continue
+        reported = True
+        for block, need in status.get('need', {}).items():
+            needs[int(block)] = max(needs.get(int(block), 0), need)
+    if not reported:
+        # Nobody has reported yet: a small repair round for every block
+        needs = {block: 1 for block in range(encoder.blocks)}
+    # Repair symbols get lost too; send a little more than the bare need
+    return {block: need + max(2, need // 4) for block, need in needs.items() if need > 0}
+
+
+def broadcast_file(file_path):
+    """
+    Send a file to every connected client with one fountain-coded multicast stream
+
+    The transfer is announced over each client's TCP connection, then all
+    source symbols are multicast once, followed by repair rounds sized from
+    the clients' reports until every client has rebuilt the file. Clients
+    that get nothing over multicast, or do not finish in time, receive the
+    file over TCP instead.
+    """
+    clients = list(connected_clients)
+    if not clients:
+        print("No clients connected to broadcast to")
+        return
+
+    transfer_id = random.getrandbits(32)
+    encoder = FountainEncoder(file_path, transfer_id)
+    announcement = encoder.describe()
+    announcement.update(group=BROADCAST_GROUP, port=BROADCAST_PORT)
+    with broadcast_lock:
+        broadcast_status[transfer_id] = {}
+
+    print(f"Broadcasting {file_path} ({encoder.file_size} bytes, {encoder.blocks} blocks) "
+          f"to {len(clients)} clients on {BROADCAST_GROUP}:{BROADCAST_PORT}")
+    for client_conn, client_addr in clients:
+        try:
+            client_conn.send_frame(MSG_BROADCAST_BEGIN, json.dumps(announcement).encode('utf-8'), compress=True)
+        except OSError as e:
+            print(f"Could not announce broadcast to {client_addr}: {e}")
+    # Give receivers time to join the group
+    time.sleep(BROADCAST_ROUND_GAP)
+
+    interface = server_socket.getsockname()[0] if server_socket else None
+    sock = open_multicast_sender(interface, BROADCAST_TTL)
+    pacer = Pacer(BROADCAST_RATE_MBPS)
+    started = time.time()
+    sent = 0
+    fallback = []
+    try:
+        with timed('broadcast'):
+            needs = None  # None: the systematic round with every source symbol
+            round_number = 0
+            while True:
+                blocks = list(range(encoder.blocks)) if needs is None else sorted(needs)
+                for i in range(0, len(blocks), INTERLEAVE_BLOCKS):
+                    window = blocks[i:i + INTERLEAVE_BLOCKS]
+                    if needs is None:
+                        per_block = {block: encoder.source_packets(block) for block in window}
+                    else:
+                        per_block = {block: encoder.repair_packets(block, needs[block]) for block in window}
+                    sent += send_packets(sock, interleave(per_block), BROADCAST_GROUP, BROADCAST_PORT, pacer)
+                time.sleep(BROADCAST_ROUND_GAP)
+
+                with broadcast_lock:
+                    statuses = dict(broadcast_status[transfer_id])
+                pending = []
+                for client in clients:
+                    status = statuses.get(client[1])
+                    if client not in connected_clients or (status and status.get('complete')):
+                        continue
+                    if status is not None and status.get('packets', 0) == 0:
+                        fallback.append(client)  # Multicast does not reach this client
+                    else:
+                        pending.append(client)
+                clients = pending
+
+                print(f"Broadcast round {round_number}: {sent / (1024 * 1024):.1f} MB sent, "
+                      f"{len(pending)} clients still decoding")
+                if not pending:
+                    break
+                if time.time() - started > BROADCAST_TIMEOUT or sent > BROADCAST_MAX_OVERHEAD * encoder.file_size:
+                    print("Broadcast did not complete for every client; falling back to TCP")
+                    fallback.extend(pending)
+                    break
+                needs = _broadcast_needs(transfer_id, pending, encoder)
+                round_number += 1
+    finally:
+        sock.close()
+        encoder.close()
+        CLIENT_BYTES.labels("multicast", "sent").inc(sent)
+
+    elapsed = time.time() - started
+    print(f"Broadcast finished in {elapsed:.1f}s: {sent / (1024 * 1024):.1f} MB on the wire for "
+          f"{encoder.file_size / (1024 * 1024):.1f} MB file")
+
+    # Clients reporting a failed decode also get the file over TCP
+    with broadcast_lock:
+        statuses = broadcast_status.pop(transfer_id, {})
+    for client in list(connected_clients):
+        status = statuses.get(client[1])
+        if status and status.get('complete') and not status.get('ok') and client not in fallback:
+            fallback.append(client)
+    for client_conn, client_addr in fallback:
+        if (client_conn, client_addr) in connected_clients:
+            print(f"Sending {file_path} to {client_addr} over TCP")
+            send_file(client_conn, file_path, f"{client_addr[0]}:{client_addr[1]}")
+
+
 def handle_client(conn, addr):
-    """Handle individual client connection"""
+    """Handle individual client connection: ping it and read its frames"""
     print(f"Client {addr} connected")
+    received_bytes = CLIENT_BYTES.labels(f"{addr[0]}:{addr[1]}", "received")
 
     try:
+        next_ping = time.monotonic()
+        last_heard = time.monotonic()
         while True:
-            # Send periodic messages or wait for client response
-            time.sleep(1)
+            now = time.monotonic()
+            if now >= next_ping:
+                conn.send_frame(MSG_PING)
+                next_ping = now + PING_INTERVAL
 
-            # Check if client is still connected
-            try:
-                conn.send(b'PING   ')
-                response = conn.recv(1024)
-                if not response:
-                    break
-            except:
+            if now - last_heard > CLIENT_TIMEOUT:
+                print(f"Client {addr} timed out")
                 break
 
-    except Exception as e:
+            # Wait for client frames until the next ping is due
+            if not conn.buffered():
+                readable, _, _ = select.select([conn], [], [], max(0.0, next_ping - time.monotonic()))
+                if not readable:
+                    continue
+
+            header, payload = conn.recv_frame()
+            last_heard = time.monotonic()
+            received_bytes.inc(header.length)
+            if header.msg_type == MSG_QUIT:
+                break
+            elif header.msg_type == MSG_HELLO:
+                reply, codec = negotiate(payload, COMPRESSION_DICTIONARY)
+                # Reply before switching on compression so the client can decode what follows
+                conn.send_frame(MSG_HELLO, reply)
+                conn.codec = codec
+                print(f"Client {addr} compression: {codec.name if codec else 'none'}"
+                      f"{' + dictionary' if codec and codec.dictionary else ''}")
+            elif header.msg_type == MSG_BROADCAST_STATUS:
+                status = json.loads(payload)
+                with broadcast_lock:
+                    if status.get('transfer') in broadcast_status:
+                        broadcast_status[status['transfer']][addr] = status
+            elif header.msg_type != MSG_PONG:
+                print(f"Ignoring {header.name} frame from client {addr}")
+
+    except (ConnectionError, OSError, ProtocolError) as e:
         print(f"Error with client {addr}: {e}")
     finally:
         print(f"Client {addr} disconnected")
@@ -271,24 +791,23 @@ def handle_client(conn, addr):
         conn.close()
 
 
-def server_thread():
+def server_thread(host='localhost', port=8080, backlog=128):
     """Run the file transfer server in a separate thread"""
     global server_socket, connected_clients
 
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
-    host = 'localhost'
-    port = 8080
-
     try:
         server_socket.bind((host, port))
-        server_socket.listen(5)
+        # Large backlog so bursts of ground stations connecting at once aren't refused
+        server_socket.listen(backlog)
         print(f"File transfer server listening on port {port}")
 
         while True:
             try:
-                conn, addr = server_socket.accept()
+                sock, addr = server_socket.accept()
+                conn = FramedConnection(sock)
                 connected_clients.append((conn, addr))
 
                 # Handle client in separate thread
@@ -307,24 +826,410 @@ def server_thread():
         print(f"Failed to start server: {e}")
 
 
-def federated_learning_process():
-    """Simulates a federated learning process running in background"""
-    global current_model_version
+class FederatedAggregator:
+    """
+    Collects model updates from the analyzers of every frame source
+
+    Runs in the background, folds pending updates into a new model version
+    every interval seconds and sends that version to every client.
+
+    With secure on, the sources' updates are combined by secure aggregation
+    (common/secure_aggregation.py): each source's update is masked, and
+    optionally clipped and noised, before it is summed. Clients then get
+    only the mean over the sources, never a single source's update.
+    """
+
+    def __init__(self, interval=5.0, secure=False, clip=None, noise_multiplier=0.0):
+        self.updates = queue.Queue()
+        self.version = 0
+        self.interval = interval
+        self.received = {}  # source -> updates received
+        self.lock = threading.Lock()
+        self.secure = secure
+        self.clip = clip  # L2 bound of each source's update (secure mode)
+        self.noise_multiplier = noise_multiplier  # Gaussian noise std of the sum, in units of clip
+
+    def submit(self, update, source=None):
+        with self.lock:
+            self.received[source] = self.received.get(source, 0) + 1
+        self.updates.put(update if source is None else dict(update, source=source))
+
+    def run(self):
+        while True:
+            # Collect updates (if any)
+            updates = []
+            while not self.updates.empty():
+                updates.append(self.updates.get())
+
+            # If we have updates, "improve" the model
+            if updates and self.secure:
+                self.secure_round(updates)
+            elif updates:
+                print(f"Received {len(updates)} model updates")
+                self.version += 1
+                print(f"Model updated to version {self.version}")
+                self.broadcast(updates)
+
+            # Sleep to simulate periodic model updates
+            time.sleep(self.interval)
+
+    def secure_round(self, updates):
+        """Average each source's updates, then securely aggregate the sources and broadcast the mean"""
+        by_source = {}
+        for update in updates:
+            by_source.setdefault(update.get('source'), []).append(update)
+        if len(by_source) < 2:
+            # The sum of one source's update is that update
+            print(f"Secure aggregation needs updates from 2 or more sources; dropped {len(updates)} update(s)")
+            return
+        fields = sorted(key for key in updates[0] if key != 'source')
+        vectors = {index: np.mean([[float(update[field]) for field in fields] for update in group], axis=0)
+                   for index, group in enumerate(by_source.values(), start=1)}
+        with timed('secure_aggregation'):
+            total, report = secure_sum(vectors, clip=self.clip, noise_multiplier=self.noise_multiplier)
+        aggregate = {field: float(value) for field, value in zip(fields, total / report['participants'])}
+        self.version += 1
+        print(f"Securely aggregated {report['participants']} sources; model updated to version {self.version}")
+        self.broadcast([], aggregate, report['participants'])
+
+    def broadcast(self, updates, aggregate=None, participants=None):
+        """Send the new model version and its updates (or their secure aggregate) to every client (compressed JSON)"""
+        message = {
+            'version': self.version,
+            'updates': [{key: value if key == 'source' else float(value) for key, value in update.items()}
+                        for update in updates],
+        }
+        if aggregate is not None:
+            message.update(aggregate=aggregate, participants=participants, secure=True)
+        payload = json.dumps(message).encode('utf-8')
+        for client_conn, client_addr in list(connected_clients):
+            try:
+                client_conn.send_frame(MSG_MODEL_UPDATE, payload, compress=True)
+            except OSError as e:
+                print(f"Failed to send model update to {client_addr}: {e}")
 
-    while True:
-        # Collect updates (if any)
-        updates = []
-        while not model_updates_queue.empty():
-            updates.append(model_updates_queue.get())
 
-        # If we have updates, "improve" the model
-        if updates:
-            print(f"Received {len(updates)} model updates")
-            current_model_version += 1
-            print(f"Model updated to version {current_model_version}")
+federated_aggregator = FederatedAggregator()
+QUEUE_DEPTH.labels("model_updates").set_function(federated_aggregator.updates.qsize)
 
-        # Sleep to simulate periodic model updates
-        time.sleep(5)
+
+class CaptureWorker:
+    """
+    Capture loop of one frame source on its own thread
+
+    Each source has its own VideoProcessor (recorder, encoder, analyzer);
+    the transfer server and the aggregator are shared. Frames are captured
+    into a reused buffer and processed straight into the next slot of the
+    source's FrameRing; the display and the live stream read them from
+    there by sequence number.
+    """
+
+    def __init__(self, label, source, processor):
+        self.label = label
+        self.source = source
+        self.processor = processor
+        self.live_streamer = None
+        width, height = processor.resolution
+        self.ring = FrameRing((height, width, 3), RING_SLOTS, name=f"haps_{os.getpid()}_{label}")
+        self.buffer = None
+        self.latest = -1
+        self.frames = 0
+        self.started = None
+        self.running = False
+        self.thread = None
+        self.captured = CAPTURED_FRAMES.labels(label)
+
+    def start(self):
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name=f"capture-{self.label}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+        self.source.release()
+        if not self.alive():
+            self.processor.close()
+            self.ring.close()
+
+    def alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        dropped = FRAMES_DROPPED.labels("capture")
+        failures = 0
+        skipped = self.source.frames_skipped
+        while self.running:
+            with timed('capture'):
+                ret, frame = self.source.read(self.buffer)
+            if self.source.frames_skipped != skipped:
+                dropped.inc(self.source.frames_skipped - skipped)
+                skipped = self.source.frames_skipped
+            if not ret:
+                # Every failed read is a dropped frame; a live device gets a few more tries
+                dropped.inc()
+                failures += 1
+                if self.source.live and failures < CAPTURE_RETRIES:
+                    time.sleep(CAPTURE_RETRY_DELAY)
+                    continue
+                print(f"Frame source {self.source.name} ended or failed.")
+                break
+            failures = 0
+            self.captured.inc()
+            self.buffer = frame
+
+            # Process the frame into the next ring slot
+            sequence, slot = self.ring.claim()
+            with self.processor.lock:
+                self.processor.process_frame(frame, out=slot, pose=self.source.pose())
+            self.ring.publish(sequence)
+            self.frames += 1
+            self.latest = sequence
+
+            streamer = self.live_streamer
+            if streamer is not None and connected_clients:
+                streamer.submit(self.ring, sequence)
+        self.running = False
+
+    def stats(self):
+        processor = self.processor
+        elapsed = max(time.time() - (self.started or time.time()), 1e-6)
+        return {
+            'label': self.label,
+            'source': self.source.describe(),
+            'running': self.alive(),
+            'ring': self.ring.name,
+            'frames': self.frames,
+            'fps': round(self.frames / elapsed, 1),
+            'recording': processor.is_recording,
+            'quality': processor.compression_quality,
+            'motion_gating': processor.motion_gating,
+            'changed_fraction': round(processor.changed_fraction, 3),
+            'model_updates': processor.aggregator.received.get(processor.name, 0),
+        }
+
+
+class ServerController:
+    """
+    Commands shared by the keyboard and the HTTP control API
+
+    Commands run on the main thread: the keyboard calls execute()
+    directly, HTTP requests are queued with submit() and picked up by
+    run_pending(). Anything touching a processor takes its lock, so it
+    never changes in the middle of a frame on the capture thread.
+    """
+
+    COMMANDS = ('status', 'record', 'quality', 'motion', 'live', 'broadcast',
+                'auto_send', 'send', 'zips', 'quit')
+
+    def __init__(self, workers, live_source=None):
+        self.workers = workers
+        self.live_source = live_source or workers[0].label
+        self.live_streamer = None
+        self.running = True
+        self.pending = queue.Queue()
+
+    @staticmethod
+    def _switch(current, value):
+        """Toggle when no value is given, otherwise parse on/off"""
+        if value is None or value == '':
+            return not current
+        return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+    def is_recording(self):
+        return any(worker.processor.is_recording for worker in self.workers)
+
+    def _selected(self, source):
+        """Workers a command applies to: all of them, or the one labelled source"""
+        if not source:
+            return self.workers
+        selected = [worker for worker in self.workers if worker.label == source]
+        if not selected:
+            raise ValueError(f"unknown source {source!r}")
+        return selected
+
+    def status(self):
+        return {
+            'sources': [worker.stats() for worker in self.workers],
+            'recording': self.is_recording(),
+            'live_streaming': live_streaming,
+            'live_source': self.live_source,
+            'broadcast_mode': broadcast_mode,
+            'auto_send': auto_send_zip,
+            'clients': [f"{addr[0]}:{addr[1]}" for _, addr in list(connected_clients)],
+            'model_version': federated_aggregator.version,
+        }
+
+    def execute(self, command, value=None, source=None):
+        """Run one command; returns a JSON-serialisable result (raises ValueError on bad input)"""
+        global auto_send_zip, broadcast_mode, live_streaming
+        workers = self._selected(source)
+
+        if command == 'status':
+            return self.status()
+        if command == 'record':
+            # All cameras record together and end up in one zip
+            recording = self._switch(any(worker.processor.is_recording for worker in workers), value)
+            for worker in workers:
+                processor = worker.processor
+                with processor.lock:
+                    if recording and not processor.is_recording:
+                        processor.start_recording()
+                    elif not recording and processor.is_recording:
+                        processor.stop_recording(archive=False)
+            if not recording and not self.is_recording():
+                archive_recordings()
+            return {'recording': self.is_recording()}
+        if command == 'quality':
+            if value not in ('up', '+', 'down', '-'):
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError("quality needs a number, 'up' or 'down'")
+            qualities = {}
+            for worker in workers:
+                processor = worker.processor
+                with processor.lock:
+                    if value in ('up', '+'):
+                        quality = processor.compression_quality + 5
+                    elif value in ('down', '-'):
+                        quality = processor.compression_quality - 5
+                    else:
+                        quality = value
+                    processor.compression_quality = qualities[worker.label] = max(5, min(100, quality))
+            if len(qualities) == 1:
+                print(f"Compression quality: {next(iter(qualities.values()))}%")
+            else:
+                print("Compression quality: " + ", ".join(f"{label} {quality}%"
+                                                          for label, quality in qualities.items()))
+            return {'quality': qualities}
+        if command == 'motion':
+            gating = self._switch(workers[0].processor.motion_gating, value)
+            for worker in workers:
+                with worker.processor.lock:
+                    worker.processor.motion_gating = gating
+                    worker.processor.reference = None
+            print(f"Motion-gated encoding: {'ON' if gating else 'OFF'}")
+            return {'motion_gating': gating}
+        if command == 'live':
+            if source:
+                self.live_source = source
+            live_streaming = self._switch(live_streaming, value)
+            if live_streaming and self.live_streamer is None:
+                self.live_streamer = LiveStreamer()
+            for worker in self.workers:
+                streaming = live_streaming and worker.label == self.live_source
+                worker.live_streamer = self.live_streamer if streaming else None
+            print(f"Live stream: {'ON (' + self.live_source + ')' if live_streaming else 'OFF'}")
+            return {'live_streaming': live_streaming, 'live_source': self.live_source}
+        if command == 'broadcast':
+            broadcast_mode = self._switch(broadcast_mode, value)
+            print(f"Multicast broadcast: {'ON' if broadcast_mode else 'OFF'}")
+            return {'broadcast_mode': broadcast_mode}
+        if command == 'auto_send':
+            auto_send_zip = self._switch(auto_send_zip, value)
+            print(f"Auto-send zip files: {'ON' if auto_send_zip else 'OFF'}")
+            return {'auto_send': auto_send_zip}
+        if command == 'send':
+            zip_files = list_zip_files()
+            if value:
+                if value not in zip_files:
+                    raise ValueError(f"no such zip file: {value}")
+                zip_file = value
+            elif zip_files:
+                zip_file = max(zip_files, key=os.path.getctime)
+            else:
+                print("No zip files to send")
+                return {'sent': None}
+            print(f"Sending zip file: {zip_file}")
+            send_zip_to_all_clients(zip_file)
+            return {'sent': zip_file, 'clients': len(connected_clients)}
+        if command == 'zips':
+            return {'zips': list_zip_files()}
+        if command == 'quit':
+            self.running = False
+            return {'quit': True}
+        raise ValueError(f"unknown command {command!r}")
+
+    def submit(self, command, value=None, source=None, timeout=CONTROL_TIMEOUT):
+        """Queue a command for the main thread and wait for its result"""
+        reply = queue.Queue(maxsize=1)
+        self.pending.put((command, value, source, reply))
+        return reply.get(timeout=timeout)
+
+    def run_pending(self, timeout=None):
+        """Run queued commands; waits up to timeout for the first one"""
+        block = timeout is not None
+        while True:
+            try:
+                command, value, source, reply = self.pending.get(block, timeout)
+            except queue.Empty:
+                return
+            block = False
+            try:
+                reply.put((True, self.execute(command, value, source)))
+            except Exception as e:
+                reply.put((False, str(e)))
+
+
+def _control_handler(controller):
+    """
+    Request handler class for the control API
+
+    GET  /status, /zips
+    POST /record, /quality, /motion, /live, /broadcast, /auto_send, /send, /quit
+         with an optional ?value=... (on/off, a quality or up/down, a zip name)
+         and ?source=... to address one source (record, quality, motion, live)
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class ControlHandler(BaseHTTPRequestHandler):
+        def _respond(self, code, body):
+            data = json.dumps(body, indent=2).encode('utf-8')
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, allowed):
+            url = urlsplit(self.path)
+            command = url.path.strip('/').replace('-', '_') or 'status'
+            if command not in allowed:
+                self._respond(404, {'error': f"unknown command {command!r}",
+                                    'commands': list(ServerController.COMMANDS)})
+                return
+            query = dict(parse_qsl(url.query))
+            try:
+                ok, result = controller.submit(command, query.get('value'), query.get('source'))
+            except queue.Empty:
+                self._respond(503, {'error': "server did not answer in time"})
+                return
+            self._respond(200 if ok else 400, result if ok else {'error': result})
+
+        def do_GET(self):
+            self._handle(('status', 'zips'))
+
+        def do_POST(self):
+            self._handle(ServerController.COMMANDS)
+
+        def log_message(self, format, *args):
+            pass  # Keep requests out of the console
+
+    return ControlHandler
+
+
+def start_control_server(controller, port=CONTROL_PORT, host='127.0.0.1'):
+    """Serve the control API from a daemon thread"""
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _control_handler(controller))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="control-http", daemon=True)
+    thread.start()
+    return server
 
 
 def display_help():
@@ -334,7 +1239,10 @@ def display_help():
     ------------------
     SPACE - Start/Stop Recording (auto-sends zip to clients)
     + / - - Increase/Decrease Compression
+    m     - Toggle motion-gated encoding
+    l     - Toggle the tiled live stream to clients
     s     - Send latest zip file to all clients
+    b     - Toggle multicast broadcast mode for sends
     a     - Toggle auto-send zip files
     z     - List available zip files
     q     - Quit
@@ -343,6 +1251,17 @@ def display_help():
     print(help_text)
 
 
+def archive_recordings():
+    """Zip the recordings and, with auto-send on, send the zip to every client"""
+    zip_file = zip_recordings()
+
+    # Automatically send zip to all connected clients
+    if auto_send_zip and zip_file and connected_clients:
+        print(f"Auto-sending zip file to {len(connected_clients)} clients...")
+        send_zip_to_all_clients(zip_file)
+    return zip_file
+
+
 def zip_recordings():
     """Create zip file from recordings"""
     if not os.path.exists("recordings") or not os.listdir("recordings"):
@@ -353,13 +1272,17 @@ def zip_recordings():
     zip_path = os.path.join(os.getcwd(), zip_filename)
 
     try:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk("recordings"):
-                for file in files:
-                    if file.endswith(".avi"):
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, "recordings")
-                        zipf.write(file_path, arcname)
+        entries = []
+        for root, _, files in os.walk("recordings"):
+            for file in files:
+                if file.endswith((".avi", ".avi" + SIDECAR_SUFFIX)):
+                    file_path = os.path.join(root, file)
+                    entries.append((file_path, os.path.relpath(file_path, "recordings")))
+        with timed('zip'):
+            if offload_pool is not None:
+                offload_pool.write_zip(zip_path, entries)
+            else:
+                write_zip(zip_path, entries)
 
         print(f"Recordings zipped successfully: {zip_path}")
         return zip_path
@@ -381,79 +1304,174 @@ def list_zip_files():
     return zip_files
 
 
-def main():
-    global auto_send_zip
+def warm_up_encoder():
+    """Run one JPEG round trip so the first real frame does not pay for codec setup"""
+    _, jpeg = cv2.imencode('.jpg', np.zeros((64, 64, 3), dtype=np.uint8))
+    cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+
+
+# Key bindings of the display window: key -> (command, value)
+KEY_COMMANDS = {
+    ord('q'): ('quit', None),
+    ord(' '): ('record', None),
+    ord('+'): ('quality', 'up'),
+    ord('='): ('quality', 'up'),
+    ord('-'): ('quality', 'down'),
+    ord('m'): ('motion', None),
+    ord('l'): ('live', None),
+    ord('s'): ('send', None),
+    ord('a'): ('auto_send', None),
+    ord('b'): ('broadcast', None),
+    ord('z'): ('zips', None),
+}
+
+
+def main(argv=None):
+    global offload_pool
+    parser = argparse.ArgumentParser(description="HAPS camera server with file transfer and federated learning")
+    parser.add_argument('--source', action='append',
+                        help="frame source: camera:N, file:PATH, dir:PATH or synthetic[:WxH] (options ?loop=1&fps=N); "
+                             "repeat for several cameras (default: camera:0)")
+    parser.add_argument('--headless', action='store_true',
+                        help="no display window; control through the HTTP API instead of keys")
+    parser.add_argument('--host', default='localhost', help="file transfer server address")
+    parser.add_argument('--port', type=int, default=8080, help="file transfer server port")
+    parser.add_argument('--control-port', type=int, default=CONTROL_PORT,
+                        help="HTTP control API port (0 disables it)")
+    parser.add_argument('--live-source', help="label of the source sent on the live stream (default: the first)")
+    parser.add_argument('--record', action='store_true', help="start recording immediately")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes for encoding, analysis and zipping (0: in-process)")
+    parser.add_argument('--secure-aggregation', action='store_true',
+                        help="combine the sources' model updates by secure aggregation (needs 2+ sources)")
+    parser.add_argument('--dp-clip', type=float, help="clip each source's update to this L2 norm (secure mode)")
+    parser.add_argument('--dp-noise', type=float, default=0.0,
+                        help="Gaussian noise std of the aggregate, in units of --dp-clip (secure mode)")
+    args = parser.parse_args(argv)
+    specs = args.source or ['camera:0']
+    if args.dp_noise and not args.dp_clip:
+        print("Error: --dp-noise needs --dp-clip")
+        return
+    if args.secure_aggregation and len(specs) < 2:
+        print("Error: --secure-aggregation needs 2 or more --source")
+        return
+    federated_aggregator.secure = args.secure_aggregation
+    federated_aggregator.clip = args.dp_clip
+    federated_aggregator.noise_multiplier = args.dp_noise
 
     # Start server in background
-    server_th = threading.Thread(target=server_thread, daemon=True)
+    server_th = threading.Thread(target=server_thread, args=(args.host, args.port), daemon=True)
     server_th.start()
 
+    # Load OpenCV and warm up the JPEG encoder while the rest starts
+    prewarm('numpy', 'cv2', warm_up_encoder, name="server-prewarm")
+
     # Start federated learning background process
-    fl_thread = threading.Thread(target=federated_learning_process, daemon=True)
+    fl_thread = threading.Thread(target=federated_aggregator.run, daemon=True)
     fl_thread.start()
 
-    # Initialize video capture
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Error: Could not open camera.")
+    # Expose instrumentation
+    try:
+        start_metrics_server(METRICS_PORT)
+        print(f"Metrics available at http://127.0.0.1:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"Could not start metrics endpoint on port {METRICS_PORT}: {e}")
+    start_json_dump(METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL)
+
+    sources = []
+    for spec in specs:
+        try:
+            source = open_source(spec)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if not source.is_opened():
+            print(f"Error: Could not open frame source {source.name}.")
+            return
+        sources.append(source)
+    labels = [f"cam{index}" for index in range(len(sources))]
+    if args.live_source and args.live_source not in labels:
+        print(f"Error: no source labelled {args.live_source}")
         return
 
-    # Initialize video processor
-    processor = VideoProcessor()
-
-    display_help()
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture frame.")
-            break
-
-        # Process the frame
-        processed_frame = processor.process_frame(frame)
-
-        # Display the processed frame
-        cv2.imshow("Federated Learning Camera with File Transfer", processed_frame)
+    if args.workers > 0:
+        offload_pool = OffloadPool(args.workers)
+        offload_pool.warm_up()
+        print(f"Encoding, analysis and zipping offloaded to {offload_pool.workers} worker processes")
+
+    # One frame source, processor, recorder and analyzer per camera
+    workers = []
+    for label, source in zip(labels, sources):
+        # A single source keeps the plain file names and overlay
+        processor = VideoProcessor(name=label if len(sources) > 1 else None, pool=offload_pool, hfov=source.hfov)
+        workers.append(CaptureWorker(label, source, processor))
+        print(f"Source {label}: {source.name}")
+    controller = ServerController(workers, args.live_source)
+
+    if args.control_port:
+        try:
+            start_control_server(controller, args.control_port)
+            print(f"Control API at http://127.0.0.1:{args.control_port}/status")
+        except OSError as e:
+            print(f"Could not start control API on port {args.control_port}: {e}")
+
+    if args.record:
+        controller.execute('record', 'on')
+
+    for worker in workers:
+        worker.start()
+
+    if not args.headless:
+        display_help()
+
+    window = "Federated Learning Camera with File Transfer"
+    shown = {}
+    buffers = {worker.label: np.empty(worker.ring.shape, dtype=np.uint8) for worker in workers}
+    while controller.running and any(worker.alive() for worker in workers):
+        if args.headless:
+            # Capture runs unthrottled on the worker threads; just serve commands
+            controller.run_pending(timeout=0.1)
+            continue
+
+        # Commands from the control API
+        controller.run_pending()
+
+        # Display the latest processed frame of every source, copied out so the producer cannot tear it
+        for worker in workers:
+            sequence = worker.latest
+            if sequence < 0 or shown.get(worker.label) == sequence:
+                continue
+            frame = worker.ring.read(sequence, buffers[worker.label])
+            if frame is not None:
+                shown[worker.label] = sequence
+                cv2.imshow(window if len(workers) == 1 else f"{window} [{worker.label}]", frame)
 
         # Process keyboard input
         key = cv2.waitKey(1) & 0xFF
-
-        if key == ord('q'):
-            break
-        elif key == ord(' '):  # Space to start/stop recording
-            if is_recording:
-                processor.stop_recording()
-            else:
-                processor.start_recording()
-        elif key == ord('+') or key == ord('='):  # Increase quality
-            processor.compression_quality = min(100, processor.compression_quality + 5)
-            print(f"Compression quality: {processor.compression_quality}%")
-        elif key == ord('-'):  # Decrease quality
-            processor.compression_quality = max(5, processor.compression_quality - 5)
-            print(f"Compression quality: {processor.compression_quality}%")
-        elif key == ord('s'):  # Send latest zip file
-            zip_files = list_zip_files()
-            if zip_files:
-                latest_zip = max(zip_files, key=os.path.getctime)
-                print(f"Sending latest zip file: {latest_zip}")
-                send_zip_to_all_clients(latest_zip)
-            else:
-                print("No zip files to send")
-        elif key == ord('a'):  # Toggle auto-send
-            auto_send_zip = not auto_send_zip
-            print(f"Auto-send zip files: {'ON' if auto_send_zip else 'OFF'}")
-        elif key == ord('z'):  # List zip files
-            list_zip_files()
-        elif key == ord('h'):  # Help
+        if key == ord('h'):
             display_help()
+        elif key in KEY_COMMANDS:
+            try:
+                controller.execute(*KEY_COMMANDS[key])
+            except ValueError as e:
+                print(e)
 
     # Clean up
-    if is_recording:
-        processor.stop_recording()
-    cap.release()
-    cv2.destroyAllWindows()
-
-    # Close server
+    if controller.is_recording():
+        controller.execute('record', 'off')
+    for worker in workers:
+        worker.stop()
+    if offload_pool is not None:
+        offload_pool.shutdown()
+    if not args.headless:
+        cv2.destroyAllWindows()
+
+    # Tell clients we are leaving, then close server
+    for client_conn, _ in list(connected_clients):
+        try:
+            client_conn.send_frame(MSG_QUIT)
+        except OSError:
+            pass
     if server_socket:
         server_socket.close()
 
@@ -0,0 +1,59 @@
+"""Dropout recovery and input checks of common/secure_aggregation.py (run with pytest)"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from secure_aggregation import neighbour_graph, secure_sum  # noqa: E402
+
+DIMENSION = 1000
+
+
+def _updates(clients):
+    rng = np.random.default_rng(0)
+    return {u: rng.normal(0.0, 0.01, DIMENSION) for u in range(1, clients + 1)}
+
+
+def _check(updates, dropouts, **kwargs):
+    total, report = secure_sum(updates, dropouts, **kwargs)
+    plain = sum(update for u, update in updates.items() if u not in dropouts)
+    assert report['dropped'] == sorted(dropouts)
+    assert np.abs(total - plain).max() < 1e-5
+
+
+@pytest.mark.parametrize('dropped', [1, 2, 3])
+def test_three_clients_one_dropout(dropped):
+    _check(_updates(3), {dropped})
+
+
+def test_consecutive_dropouts():
+    # A ring over the sorted ids left client 8 with 5 of the 6 shares it needed
+    _check(_updates(30), set(range(1, 8)), seed=0)
+
+
+def test_graph_is_regular():
+    for clients, neighbours in ((30, 10), (30, 5), (12, 3)):
+        graph = neighbour_graph(range(1, clients + 1), neighbours)
+        assert {len(vs) for vs in graph.values()} == {neighbours + neighbours % 2}
+        assert all(u in graph[v] for u, vs in graph.items() for v in vs)
+
+
+@pytest.mark.parametrize('neighbours', [0, 1])
+def test_too_few_neighbours(neighbours):
+    with pytest.raises(ValueError):
+        secure_sum(_updates(10), neighbours=neighbours)
+
+
+def test_unrecoverable_dropouts_raise():
+    # Every neighbour of client 1 is gone: its self mask cannot be removed
+    with pytest.raises(ValueError):
+        secure_sum(_updates(3), {2, 3})
+
+
+def test_single_client_raises():
+    # One client has no neighbours to share its masks with: refuse rather than return garbage
+    with pytest.raises(ValueError):
+        secure_sum({1: np.ones(4)})
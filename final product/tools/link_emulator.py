@@ -0,0 +1,298 @@
+"""
+HAPS link emulator: a TCP proxy with scripted bandwidth, latency and outages
+
+Sits between the server and the clients so transfers can be tested under
+the conditions we fly in rather than perfect loopback:
+
+    server (8080) <--- link_emulator (9080) <--- client2.py / load_generator.py
+
+Each direction is one shared link: a bandwidth limit serialises every
+connection's bytes, a one-way delay of RTT/2 plus seeded jitter is applied
+per chunk, and outage windows either stall the link or drop every
+connection. Profiles are time-based and replay identically for a given
+seed, so runs can be compared.
+
+Usage:
+    python link_emulator.py --listen localhost:9080 --target localhost:8080 --profile haps-nominal
+    python link_emulator.py --profile my_profile.json
+
+Profile JSON:
+    {
+      "seed": 7,
+      "phases": [
+        {"at": 0,   "bandwidth_kbps": 8000, "rtt_ms": 60,  "jitter_ms": 5},
+        {"at": 120, "bandwidth_kbps": 2000, "rtt_ms": 250, "jitter_ms": 40}
+      ],
+      "outages": [{"start": 30, "duration": 5}],
+      "periodic_outage": {"every": 300, "duration": 20, "offset": 0},
+      "outage_mode": "stall"
+    }
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+
+CHUNK_SIZE = 16 * 1024
+
+PROFILES = {
+    'perfect': {
+        'phases': [{'at': 0, 'bandwidth_kbps': 0, 'rtt_ms': 0, 'jitter_ms': 0}],
+    },
+    'haps-nominal': {
+        'phases': [{'at': 0, 'bandwidth_kbps': 20000, 'rtt_ms': 60, 'jitter_ms': 5}],
+    },
+    'haps-degraded': {
+        'phases': [
+            {'at': 0, 'bandwidth_kbps': 8000, 'rtt_ms': 120, 'jitter_ms': 20},
+            {'at': 60, 'bandwidth_kbps': 1500, 'rtt_ms': 400, 'jitter_ms': 80},
+            {'at': 120, 'bandwidth_kbps': 8000, 'rtt_ms': 120, 'jitter_ms': 20},
+        ],
+        'loop_every': 180,
+    },
+    'blackout-5min': {
+        'phases': [{'at': 0, 'bandwidth_kbps': 10000, 'rtt_ms': 80, 'jitter_ms': 10}],
+        'periodic_outage': {'every': 300, 'duration': 20, 'offset': 280},
+    },
+}
+
+
+class LinkProfile:
+    """Time-indexed link conditions; t is seconds since the emulator started"""
+
+    def __init__(self, config):
+        self.seed = config.get('seed', 0)
+        self.phases = sorted(config.get('phases') or PROFILES['perfect']['phases'], key=lambda p: p['at'])
+        self.phase_starts = [phase['at'] for phase in self.phases]
+        self.loop_every = config.get('loop_every')
+        self.outages = sorted((o['start'], o['start'] + o['duration']) for o in config.get('outages', []))
+        self.periodic = config.get('periodic_outage')
+        self.outage_mode = config.get('outage_mode', 'stall')
+        if self.outage_mode not in ('stall', 'drop'):
+            raise ValueError("outage_mode must be 'stall' or 'drop'")
+
+    @classmethod
+    def load(cls, name_or_path):
+        if name_or_path in PROFILES:
+            return cls(PROFILES[name_or_path])
+        with open(name_or_path) as f:
+            return cls(json.load(f))
+
+    def phase(self, t):
+        """Link parameters in effect at time t"""
+        if self.loop_every:
+            t %= self.loop_every
+        index = max(0, bisect.bisect_right(self.phase_starts, t) - 1)
+        return self.phases[index]
+
+    def outage_end(self, t):
+        """End time of the outage covering t, or None when the link is up"""
+        for start, end in self.outages:
+            if start <= t < end:
+                return end
+        if self.periodic:
+            every = self.periodic['every']
+            offset = self.periodic.get('offset', 0)
+            if t >= offset:
+                cycle_start = offset + ((t - offset) // every) * every
+                if t < cycle_start + self.periodic['duration']:
+                    return cycle_start + self.periodic['duration']
+        return None
+
+
+class LinkDirection:
+    """One direction of the shared link (uplink or downlink)"""
+
+    def __init__(self, name, emulator, seed):
+        self.name = name
+        self.emulator = emulator
+        self.rng = random.Random(seed)
+        self.next_free = 0.0
+        self.bytes = 0
+
+    async def transmit(self, nbytes):
+        """
+        Wait for the link to carry nbytes and return when they arrive
+
+        Returns the arrival time on the emulator clock; callers deliver the
+        chunk at that time so delay and bandwidth add like on a real link.
+        """
+        emulator = self.emulator
+        now = emulator.now()
+        outage_end = emulator.profile.outage_end(now)
+        if outage_end is not None and emulator.profile.outage_mode == 'stall':
+            await asyncio.sleep(outage_end - now)
+            now = emulator.now()
+
+        phase = emulator.profile.phase(now)
+        rate = phase.get('bandwidth_kbps', 0) * 1024 / 8
+        start = max(now, self.next_free)
+        self.next_free = start + (nbytes / rate if rate > 0 else 0.0)
+        if self.next_free > now:
+            await asyncio.sleep(self.next_free - now)
+        self.bytes += nbytes
+
+        one_way = phase.get('rtt_ms', 0) / 2000.0
+        jitter = phase.get('jitter_ms', 0) / 1000.0
+        delay = max(0.0, one_way + (self.rng.gauss(0, jitter) if jitter else 0.0))
+        return self.next_free + delay
+
+
+class LinkEmulator:
+    """TCP proxy applying a LinkProfile to every connection"""
+
+    def __init__(self, listen_host, listen_port, target_host, target_port, profile):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.profile = profile
+        self.started = time.monotonic()
+        self.downlink = LinkDirection('down', self, profile.seed * 2 + 1)
+        self.uplink = LinkDirection('up', self, profile.seed * 2 + 2)
+        self.connections = set()
+        self.connection_count = 0
+        self.outages_seen = 0
+        self.server = None
+
+    def now(self):
+        return time.monotonic() - self.started
+
+    async def _pipe(self, reader, writer, direction):
+        """Forward one direction of a connection through the link model"""
+        deliveries = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                arrival, data = await deliveries.get()
+                if data is None:
+                    break
+                wait = arrival - self.now()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+
+        delivery = asyncio.create_task(deliver())
+        last_arrival = 0.0
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                arrival = await direction.transmit(len(data))
+                # TCP never reorders: a chunk can't overtake the previous one
+                last_arrival = max(last_arrival, arrival)
+                await deliveries.put((last_arrival, data))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            await deliveries.put((last_arrival, None))
+            try:
+                await delivery
+            except (ConnectionError, OSError):
+                pass
+
+    async def _handle(self, client_reader, client_writer):
+        if self.profile.outage_mode == 'drop' and self.profile.outage_end(self.now()) is not None:
+            client_writer.transport.abort()
+            return
+        try:
+            server_reader, server_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError as e:
+            print(f"Link emulator: cannot reach {self.target_host}:{self.target_port}: {e}")
+            client_writer.close()
+            return
+
+        self.connection_count += 1
+        pair = (client_writer, server_writer)
+        self.connections.add(pair)
+        peer = client_writer.get_extra_info('peername')
+        print(f"Link emulator: connection {self.connection_count} from {peer}")
+        try:
+            await asyncio.gather(
+                self._pipe(server_reader, client_writer, self.downlink),
+                self._pipe(client_reader, server_writer, self.uplink),
+            )
+        finally:
+            self.connections.discard(pair)
+            for writer in pair:
+                writer.close()
+
+    async def _outage_monitor(self):
+        """Report outages and, in drop mode, cut every connection"""
+        in_outage = False
+        while True:
+            now = self.now()
+            end = self.profile.outage_end(now)
+            if end is not None and not in_outage:
+                in_outage = True
+                self.outages_seen += 1
+                print(f"Link emulator: outage at t={now:.1f}s for {end - now:.1f}s ({self.profile.outage_mode})")
+                if self.profile.outage_mode == 'drop':
+                    for pair in list(self.connections):
+                        for writer in pair:
+                            writer.transport.abort()
+            elif end is None and in_outage:
+                in_outage = False
+                print(f"Link emulator: link restored at t={now:.1f}s")
+            await asyncio.sleep(0.1)
+
+    async def _report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            phase = self.profile.phase(self.now())
+            print(f"Link emulator: t={self.now():.0f}s connections={len(self.connections)} "
+                  f"down={self.downlink.bytes / (1 << 20):.1f}MB up={self.uplink.bytes / (1 << 20):.1f}MB "
+                  f"bw={phase.get('bandwidth_kbps', 0)}kbps rtt={phase.get('rtt_ms', 0)}ms")
+
+    async def serve(self, report_interval=10.0):
+        self.server = await asyncio.start_server(self._handle, self.listen_host, self.listen_port)
+        print(f"Link emulator listening on {self.listen_host}:{self.listen_port} "
+              f"-> {self.target_host}:{self.target_port}")
+        tasks = [asyncio.create_task(self._outage_monitor())]
+        if report_interval:
+            tasks.append(asyncio.create_task(self._report(report_interval)))
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def parse_address(value, default_host='localhost'):
+    """(host, port) of 'host:port' or a bare 'port'"""
+    host, _, port = value.rpartition(':')
+    return host or default_host, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TCP proxy emulating a HAPS downlink")
+    parser.add_argument('--listen', default='localhost:9080', help="host:port (or port) clients connect to")
+    parser.add_argument('--target', default='localhost:8080', help="host:port (or port) of the real server")
+    parser.add_argument('--profile', default='haps-nominal',
+                        help=f"built-in profile ({', '.join(PROFILES)}) or path to a JSON profile")
+    parser.add_argument('--seed', type=int, default=None, help="override the profile's jitter seed")
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    listen_host, listen_port = parse_address(args.listen)
+    target_host, target_port = parse_address(args.target)
+    profile = LinkProfile.load(args.profile)
+    if args.seed is not None:
+        profile.seed = args.seed
+
+    emulator = LinkEmulator(listen_host, listen_port, target_host, target_port, profile)
+    try:
+        asyncio.run(emulator.serve(args.report_interval))
+    except KeyboardInterrupt:
+        print("Link emulator stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Loopback load generator simulating many HAPS ground-station clients
+
+Starts hundreds of lightweight clients in one asyncio event loop. Each one
+speaks the server's framed FILE/PING/PONG/QUIT protocol like client2.py does, with
+configurable reply latency, a per-client bandwidth cap and random abrupt
+disconnects. At the end it reports fan-out throughput, per-client
+completion latency percentiles and how the server handled the disconnects.
+
+Against a running server (trigger sends from its UI):
+    python load_generator.py --clients 200 --duration 60
+
+Self-contained, with an in-process server that sends a synthetic payload:
+    python load_generator.py --spawn-server --clients 200 --sends 3 --payload-mb 4 \\
+        --bandwidth-kbps 2000 --latency-ms 40 --disconnect-rate 0.01 --report load_report.json
+
+Through the link emulator (clients on 9080, spawned server on 8080):
+    python link_emulator.py --listen localhost:9080 --target localhost:8080 --profile haps-degraded
+    python load_generator.py --spawn-server --port 9080 --server-port 8080
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from framing import (read_frame_async, encode_frame, decode_file_begin, ProtocolError, MSG_PING,
+                     MSG_PONG, MSG_QUIT, MSG_FILE_BEGIN, MSG_FILE_CHUNK, MSG_FILE_END, MSG_FILE_ERROR,
+                     MSG_BROADCAST_BEGIN, MSG_FRAME, MSG_MODEL_UPDATE)
+
+PONG_FRAME = encode_frame(MSG_PONG)
+# Sent by a running server but of no interest to a ground station under load: read and dropped
+# (a broadcast announcement goes unanswered, so the server falls back to TCP)
+IGNORED_MESSAGES = (MSG_FRAME, MSG_MODEL_UPDATE, MSG_BROADCAST_BEGIN)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadStats:
+    """Counters and timings shared by every simulated client"""
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_failures = 0
+        self.pings = 0
+        self.quits = 0
+        self.protocol_errors = 0
+        self.ignored_messages = 0
+        self.server_disconnects = 0
+        self.injected_disconnects = []   # (client address, time)
+        self.transfers = {}              # "name#send" -> list of per-client records
+        self.bytes_received = 0
+
+    def record_transfer(self, file_name, record):
+        self.transfers.setdefault(file_name, []).append(record)
+
+
+class SimulatedClient:
+    """One ground station: connects, answers PINGs and downloads FILEs"""
+
+    def __init__(self, client_id, args, stats, rng):
+        self.client_id = client_id
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.bandwidth = args.bandwidth_kbps * 1024 / 8 if args.bandwidth_kbps else None
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.files_seen = {}
+        self.incoming = {}  # stream id -> [file name, size, received, started]
+
+    def reply_delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def disconnect_due(self, elapsed):
+        """Decide whether to drop the link, as a Poisson process per client"""
+        rate = self.args.disconnect_rate
+        return rate > 0 and self.rng.random() < 1 - pow(1 - rate, max(elapsed, 0.0))
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            reconnect = await self.session(stop_event)
+            if not reconnect or not self.args.reconnect:
+                return
+            await asyncio.sleep(self.args.reconnect_delay)
+
+    async def session(self, stop_event):
+        """Run one connection; returns True when the link was dropped on purpose"""
+        try:
+            reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError:
+            self.stats.connect_failures += 1
+            return True
+        self.stats.connects += 1
+        address = writer.get_extra_info('sockname')
+        last_check = time.perf_counter()
+
+        self.incoming.clear()
+        # Keep one read pending across polls: cancelling it mid-frame would desync the stream
+        pending = None
+        try:
+            while not stop_event.is_set():
+                if pending is None:
+                    pending = asyncio.ensure_future(read_frame_async(reader))
+                done, _ = await asyncio.wait({pending}, timeout=0.5)
+                frame = None
+                if done:
+                    frame = pending.result()
+                    pending = None
+
+                now = time.perf_counter()
+                if self.disconnect_due(now - last_check):
+                    # Simulate the link dropping: abort without a FIN handshake
+                    writer.transport.abort()
+                    self.stats.injected_disconnects.append((address, time.time()))
+                    return True
+                last_check = now
+
+                if frame is None:
+                    continue
+                header, payload = frame
+                if header.msg_type == MSG_PING:
+                    self.stats.pings += 1
+                    await asyncio.sleep(self.reply_delay())
+                    writer.write(PONG_FRAME)
+                    await writer.drain()
+                elif header.msg_type in (MSG_FILE_BEGIN, MSG_FILE_CHUNK, MSG_FILE_END, MSG_FILE_ERROR):
+                    await self.handle_file_frame(header, payload)
+                elif header.msg_type == MSG_QUIT:
+                    self.stats.quits += 1
+                    return False
+                elif header.msg_type in IGNORED_MESSAGES:
+                    self.stats.ignored_messages += 1
+                else:
+                    self.stats.protocol_errors += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.stats.server_disconnects += 1
+            return False
+        except ProtocolError:
+            self.stats.protocol_errors += 1
+            return False
+        finally:
+            if pending is not None:
+                pending.cancel()
+            if not writer.transport.is_closing():
+                writer.close()
+        return False
+
+    async def handle_file_frame(self, header, payload):
+        if header.msg_type == MSG_FILE_BEGIN:
+            file_size, file_name = decode_file_begin(payload)
+            self.incoming[header.stream_id] = [file_name, file_size, 0, time.time()]
+            return
+
+        transfer = self.incoming.get(header.stream_id)
+        if transfer is None:
+            self.stats.protocol_errors += 1
+            return
+
+        if header.msg_type == MSG_FILE_CHUNK:
+            transfer[2] += len(payload)
+            self.stats.bytes_received += len(payload)
+            if self.bandwidth:
+                # Pace reads so TCP flow control throttles the sender like a slow link
+                await asyncio.sleep(len(payload) / self.bandwidth)
+            return
+
+        del self.incoming[header.stream_id]
+        file_name, file_size, received, started = transfer
+        if header.msg_type == MSG_FILE_ERROR or received != file_size:
+            self.stats.protocol_errors += 1
+            return
+
+        # The same archive may be sent repeatedly; number the sends per client
+        occurrence = self.files_seen.get(file_name, 0) + 1
+        self.files_seen[file_name] = occurrence
+        self.stats.record_transfer(f"{file_name}#{occurrence}", {
+            'client': self.client_id,
+            'started': started,
+            'finished': time.time(),
+            'bytes': file_size,
+        })
+
+
+class SpawnedServer:
+    """sever3's transfer server running in this process, driven by the load test"""
+
+    def __init__(self, host, port):
+        sys.path.insert(0, SERVER_DIR)
+        import sever3
+        self.sever3 = sever3
+        self.thread = threading.Thread(target=sever3.server_thread, args=(host, port), daemon=True)
+        self.thread.start()
+        time.sleep(0.5)
+        self.removals = {}
+        self.watching = True
+        self.watcher = threading.Thread(target=self._watch_clients, daemon=True)
+        self.watcher.start()
+
+    def _watch_clients(self):
+        """Record when the server drops each client from connected_clients"""
+        seen = set()
+        while self.watching:
+            current = {addr for _, addr in list(self.sever3.connected_clients)}
+            for addr in seen - current:
+                self.removals.setdefault(addr, time.time())
+            seen = current
+            time.sleep(0.05)
+
+    def connected(self):
+        return len(self.sever3.connected_clients)
+
+    def send(self, path):
+        self.sever3.send_zip_to_all_clients(path)
+
+    def stop(self):
+        self.watching = False
+        if self.sever3.server_socket:
+            self.sever3.server_socket.close()
+
+
+async def drive_spawned_server(server, args, stats, payload):
+    """Wait for the clients to connect, then push the payload --sends times"""
+    deadline = time.time() + 30
+    while server.connected() < args.clients * 0.9 and time.time() < deadline:
+        await asyncio.sleep(0.2)
+    for _ in range(args.sends):
+        started = time.time()
+        await asyncio.to_thread(server.send, payload)
+        print(f"Sent payload to {server.connected()} client(s) in {time.time() - started:.2f}s")
+        await asyncio.sleep(args.send_interval)
+
+
+def build_report(args, stats, started, server=None):
+    fan_out = []
+    for file_name, records in stats.transfers.items():
+        first_start = min(r['started'] for r in records)
+        completions = [r['finished'] - first_start for r in records]
+        total_bytes = sum(r['bytes'] for r in records)
+        span = max(completions) if completions else 0
+        fan_out.append({
+            'file': file_name,
+            'clients': len(records),
+            'bytes': total_bytes,
+            'seconds': span,
+            'throughput_mb_s': total_bytes / (1 << 20) / span if span > 0 else None,
+            'latency_p50': percentile(completions, 0.50),
+            'latency_p95': percentile(completions, 0.95),
+            'latency_p99': percentile(completions, 0.99),
+            'latency_max': max(completions) if completions else None,
+        })
+
+    disconnects = {'injected': len(stats.injected_disconnects)}
+    if server is not None:
+        detection = [server.removals[addr] - when
+                     for addr, when in stats.injected_disconnects if addr in server.removals]
+        disconnects.update({
+            'detected_by_server': len(detection),
+            'detection_p50': percentile(detection, 0.50),
+            'detection_p95': percentile(detection, 0.95),
+            'still_registered': len(stats.injected_disconnects) - len(detection),
+        })
+
+    return {
+        'config': vars(args),
+        'duration': time.time() - started,
+        'connects': stats.connects,
+        'connect_failures': stats.connect_failures,
+        'pings_answered': stats.pings,
+        'quits': stats.quits,
+        'protocol_errors': stats.protocol_errors,
+        'ignored_messages': stats.ignored_messages,
+        'server_disconnects': stats.server_disconnects,
+        'bytes_received': stats.bytes_received,
+        'fan_out': fan_out,
+        'disconnects': disconnects,
+    }
+
+
+async def run_load(args):
+    stats = LoadStats()
+    stop_event = asyncio.Event()
+    rng = random.Random(args.seed)
+
+    server = None
+    payload = None
+    if args.spawn_server:
+        server = SpawnedServer(args.host, args.server_port or args.port)
+        fd, payload = tempfile.mkstemp(prefix="load_payload_", suffix=".zip")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(int(args.payload_mb * (1 << 20))))
+
+    started = time.time()
+    clients = [SimulatedClient(i, args, stats, random.Random(rng.random())) for i in range(args.clients)]
+    tasks = []
+    for client in clients:
+        tasks.append(asyncio.create_task(client.run(stop_event)))
+        if args.ramp_ms:
+            await asyncio.sleep(args.ramp_ms / 1000.0)
+
+    try:
+        if server is not None:
+            await drive_spawned_server(server, args, stats, payload)
+            # Give slow clients time to finish downloading
+            await asyncio.sleep(args.drain)
+        else:
+            await asyncio.sleep(args.duration)
+    finally:
+        stop_event.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if server is not None:
+            server.stop()
+            os.remove(payload)
+
+    return build_report(args, stats, started, server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many ground-station clients against the server")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=100, help="number of simulated clients")
+    parser.add_argument('--ramp-ms', type=float, default=2.0, help="delay between client connects")
+    parser.add_argument('--duration', type=float, default=60.0, help="run time against an external server")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="artificial reply latency")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="uniform jitter added to the latency")
+    parser.add_argument('--bandwidth-kbps', type=float, default=0.0, help="per-client receive cap (0 = unlimited)")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help="probability per client per second of an abrupt disconnect")
+    parser.add_argument('--reconnect', action='store_true', help="reconnect after an injected disconnect")
+    parser.add_argument('--reconnect-delay', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1, help="seed for latency jitter and disconnects")
+    parser.add_argument('--spawn-server', action='store_true', help="run sever3's transfer server in-process")
+    parser.add_argument('--server-port', type=int, default=None,
+                        help="port for the spawned server when clients go through link_emulator.py on --port")
+    parser.add_argument('--sends', type=int, default=3, help="payload sends when spawning the server")
+    parser.add_argument('--send-interval', type=float, default=2.0)
+    parser.add_argument('--payload-mb', type=float, default=1.0)
+    parser.add_argument('--drain', type=float, default=5.0, help="seconds to wait for downloads after the last send")
+    parser.add_argument('--report', default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(args))
+
+    print(f"\nClients: {args.clients} | connects: {report['connects']} | "
+          f"connect failures: {report['connect_failures']} | protocol errors: {report['protocol_errors']} | "
+          f"ignored messages: {report['ignored_messages']}")
+    for entry in report['fan_out']:
+        throughput = f"{entry['throughput_mb_s']:.1f} MB/s" if entry['throughput_mb_s'] else "n/a"
+        print(f"{entry['file']}: {entry['clients']} clients in {entry['seconds']:.2f}s ({throughput}) | "
+              f"p50 {entry['latency_p50']:.2f}s p95 {entry['latency_p95']:.2f}s p99 {entry['latency_p99']:.2f}s")
+    print(f"Disconnects: {report['disconnects']}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,52 @@
-import cv2
-import os
-import glob
-import numpy as np
-
-# Read the video from specified path
-cam = cv2.VideoCapture("C:\\Users\\adarsh\\Downloads\\panorama\\video.mp4")
-
-try:
-    # creating a folder named data
-    if not os.path.exists('data'):
-        os.makedirs('data')
-except OSError:
-    print('Error: Creating directory of data')
-
-# frame
-currentframe = 0
-frames = []
-
-while(True):
-    # reading from frame
-    ret, frame = cam.read()
-
-    if ret:
-        # if video is still left continue creating images
-        name = './data/frame' + str(currentframe) + '.jpg'
-        print('Creating...' + name)
-
-        # writing the extracted images
-        cv2.imwrite(name, frame)
-
-        # store frame for stitching
-        frames.append(frame)
+"""
+Panorama from every frame of a video at full resolution (PANORAMA mode)
 
-        # increasing counter
-        currentframe += 1
-    else:
-        break
-
-# Release video capture
-cam.release()
-
-# Create panorama from extracted frames
-print("Creating panorama...")
-
-# Initialize OpenCV's Stitcher
-stitcher = cv2.Stitcher_create(cv2.Stitcher_PANORAMA)
-
-# Stitch all frames
-status, panorama = stitcher.stitch(frames)
-
-if status == cv2.Stitcher_OK:
-    # Save the panorama
-    cv2.imwrite('./data/panorama.jpg', panorama)
-    print("Panorama created successfully and saved as './data/panorama.jpg'")
-else:
-    print("Error during stitching:", status)
-    if status == cv2.Stitcher_ERR_NEED_MORE_IMGS:
-        print("Need more images for successful stitching")
-    elif status == cv2.Stitcher_ERR_HOMOGRAPHY_EST_FAIL:
-        print("Homography estimation failed")
-    elif status == cv2.Stitcher_ERR_CAMERA_PARAMS_ADJUST_FAIL:
-        print("Camera parameters adjustment failed")
-
-# Clean up: optionally remove individual frame images
-# Comment out if you want to keep individual frames
-for frame_file in glob.glob('./data/frame*.jpg'):
-    os.remove(frame_file)
-
-# Destroy all windows
-cv2.destroyAllWindows()
\ No newline at end of file
+Usage:
+    python index.py [video.mp4] [--output data/panorama.jpg] [--frames-dir data]
+"""
+import argparse
+import os
+import sys
+
+# Panorama pipeline shared with the client
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final product', 'common'))
+from panorama_pipeline import panorama_from_video
+from tile_pyramid import save_image
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video.mp4')
+
+
+def progress(event, **info):
+    if event == 'frame':
+        print(f"Reading frame {info['count']}")
+    elif event == 'extracted':
+        print("Creating panorama...")
+    elif event == 'failed':
+        print("Error during stitching:", info['status'])
+        if info['message']:
+            print(info['message'])
+
+
+def create_panorama(video_path, output='data/panorama.jpg', frames_directory=None):
+    """Stitch every frame of video_path into output; returns True on success"""
+    panorama, _ = panorama_from_video(video_path, skip_frames=1, size=None, modes=('PANORAMA',),
+                                      frames_directory=frames_directory, progress=progress)
+    if panorama is None:
+        return False
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    save_image(panorama, output)
+    print(f"Panorama created successfully and saved as '{output}'")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stitch every frame of a video into a panorama")
+    parser.add_argument('video', nargs='?', default=DEFAULT_VIDEO, help="input video (default: video.mp4 here)")
+    parser.add_argument('--output', default='data/panorama.jpg', help="panorama image to write (.dzi for a tile pyramid)")
+    parser.add_argument('--frames-dir', help="also save the frames as JPEGs in this directory")
+    args = parser.parse_args(argv)
+    return 0 if create_panorama(args.video, args.output, args.frames_dir) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,53 +1,61 @@
-import cv2
-import os
+"""
+Panorama from every 5th frame of a video, downscaled to 640x360 (SCANS mode)
+
+SCANS mode suits the linear panning of a HAPS camera and, with the smaller
+frames, stitches much faster than index.py.
 
-# Read the video
-cam = cv2.VideoCapture("C:\\Users\\adarsh\\Downloads\\panorama\\video.mp4")
-
-try:
-    if not os.path.exists('data'):
-        os.makedirs('data')
-except OSError:
-    print('Error: Creating directory of data')
-
-# Frame extraction
-currentframe = 0
-frames = []
-skip_frames = 5  # Process every 5th frame
-frame_count = 0
-
-while True:
-    ret, frame = cam.read()
-    if not ret:
-        break
-    if frame_count % skip_frames == 0:
-        # Downscale frame
-        frame = cv2.resize(frame, (640, 360))
-        name = f'./data/frame{currentframe}.jpg'
-        print(f'Creating...{name}')
-        cv2.imwrite(name, frame)
-        frames.append(frame)
-        currentframe += 1
-    frame_count += 1
-
-# Release video
-cam.release()
-
-# Stitch frames
-print("Stitching frames into panorama...")
-stitcher = cv2.Stitcher_create(cv2.Stitcher_SCANS)  # Optimized for linear panning
-status, panorama = stitcher.stitch(frames)
-
-if status == cv2.Stitcher_OK:
-    cv2.imwrite('./data/panorama.jpg', panorama)
-    print("Panorama saved as './data/panorama.jpg'")
-else:
-    print("Stitching failed with status:", status)
-    if status == cv2.Stitcher_ERR_NEED_MORE_IMGS:
-        print("Need more images")
-    elif status == cv2.Stitcher_ERR_HOMOGRAPHY_EST_FAIL:
-        print("Homography estimation failed")
-    elif status == cv2.Stitcher_ERR_CAMERA_PARAMS_ADJUST_FAIL:
-        print("Camera parameters adjustment failed")
-
-cv2.destroyAllWindows()
\ No newline at end of file
+Usage:
+    python model2.py [video.mp4] [--skip-frames 5] [--preset fast] [--output data/panorama.jpg] [--frames-dir data]
+"""
+import argparse
+import os
+import sys
+
+# Panorama pipeline shared with the client
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'final product', 'common'))
+from panorama_pipeline import panorama_from_video
+from tile_pyramid import save_image
+from stitching import PRESETS
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video.mp4')
+
+
+def progress(event, **info):
+    if event == 'frame':
+        print(f"Selected frame {info['count']}")
+    elif event == 'extracted':
+        print("Stitching frames into panorama...")
+    elif event == 'failed':
+        print("Stitching failed with status:", info['status'])
+        if info['message']:
+            print(info['message'])
+
+
+def create_panorama(video_path, output='data/panorama.jpg', skip_frames=5, size=(640, 360),
+                    frames_directory=None, preset=None):
+    """Stitch every skip_frames-th frame of video_path into output; returns True on success"""
+    panorama, _ = panorama_from_video(video_path, skip_frames, size, modes=('SCANS',),
+                                      frames_directory=frames_directory, progress=progress, preset=preset)
+    if panorama is None:
+        return False
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    save_image(panorama, output)
+    print(f"Panorama saved as '{output}'")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stitch a downscaled subset of a video's frames into a panorama")
+    parser.add_argument('video', nargs='?', default=DEFAULT_VIDEO, help="input video (default: video.mp4 here)")
+    parser.add_argument('--skip-frames', type=int, default=5, help="use every Nth frame (default: 5)")
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        help="stitch with the configurable engine and this preset (default: cv2.Stitcher SCANS)")
+    parser.add_argument('--output', default='data/panorama.jpg', help="panorama image to write (.dzi for a tile pyramid)")
+    parser.add_argument('--frames-dir', help="also save the selected frames as JPEGs in this directory")
+    args = parser.parse_args(argv)
+    return 0 if create_panorama(args.video, args.output, args.skip_frames, frames_directory=args.frames_dir,
+                                preset=args.preset) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())